@@ -0,0 +1,74 @@
+"""Benchmark decoding `/ts` responses to arrays against decoding them to time series dictionaries.
+
+Run with `python benchmarks/bench_decode.py`. For every size, the observations are split over responses of
+RESERVOIRS_PER_RESPONSE reservoirs. The responses are decoded once with the standard library JSON parser, keeping the
+time series of all responses until they are converted with `observations_to_arrays`, as the anomalies were calculated
+before, and once with `decode_source_data` per response, which uses orjson when it is installed. The peak memory is
+measured in a separate run traced by tracemalloc, as tracing slows down the decoding.
+"""
+
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+from gww_anomalies.decode import decode_source_data, orjson
+from gww_anomalies.kernel import observations_to_arrays
+
+SIZES = (10_000, 100_000, 1_000_000)
+OBSERVATIONS_PER_RESERVOIR = 500
+RESERVOIRS_PER_RESPONSE = 50
+
+
+def synthetic_bodies(n_observations: int, rng: np.random.Generator) -> list[bytes]:
+    times = np.datetime64("2000-01-01T00:00:00") + np.arange(OBSERVATIONS_PER_RESERVOIR) * np.timedelta64(5, "D")
+    times = [str(t) for t in times]
+    fids = np.arange(n_observations // OBSERVATIONS_PER_RESERVOIR)
+    bodies = []
+    for batch in np.array_split(fids, max(1, len(fids) // RESERVOIRS_PER_RESPONSE)):
+        values = rng.normal(1e6, 1e5, (len(batch), len(times)))
+        source_data = {
+            str(fid): [{"t": t, "value": float(v)} for t, v in zip(times, fid_values, strict=True)]
+            for fid, fid_values in zip(batch, values, strict=True)
+        }
+        bodies.append(json.dumps({"source_data": source_data}).encode())
+    return bodies
+
+
+def to_dictionaries(bodies: list[bytes]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    reservoirs_ts = {}
+    for body in bodies:
+        reservoirs_ts.update({int(fid): ts for fid, ts in json.loads(body)["source_data"].items()})
+    return observations_to_arrays(reservoirs_ts)
+
+
+def to_columns(bodies: list[bytes]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    columns = [decode_source_data(body)[1:] for body in bodies]
+    return tuple(np.concatenate(column) for column in zip(*columns, strict=True))
+
+
+def measure(decode: callable, bodies: list[bytes]) -> tuple[float, float]:
+    t0 = time.perf_counter()
+    decode(bodies)
+    elapsed = time.perf_counter() - t0
+    tracemalloc.start()
+    decode(bodies)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+def main() -> None:
+    rng = np.random.default_rng(42)
+    print(f"orjson {'installed' if orjson is not None else 'not installed'}")
+    print(f"{'observations':>12} {'decoder':>14} {'seconds':>10} {'peak MB':>10}")
+    for n in SIZES:
+        bodies = synthetic_bodies(n, rng)
+        for name, decode in (("dictionaries", to_dictionaries), ("columnar", to_columns)):
+            elapsed, peak = measure(decode, bodies)
+            print(f"{n:>12} {name:>14} {elapsed:>10.3f} {peak:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Benchmark the retrieval throughput from a fake GWW API that injects errors and throttles requests.
+
+Run with `python benchmarks/bench_fault_tolerance.py`. The baseline retrieves the reservoirs from a fake API without
+faults at its CAPACITY, which is the best achievable throughput. The other runs are started with more workers than
+the API accepts: requests beyond CAPACITY concurrent requests are rejected with 429 errors, and a fraction of the
+requests fails with a 503 error. The AIMD limiter has to find the capacity while the failed requests are retried.
+"""
+
+import logging
+import time
+from datetime import datetime
+
+from gww_anomalies import gww_api
+from gww_anomalies.fake_api import serve
+
+N_RESERVOIRS = 1_000
+LATENCY = 0.05
+CAPACITY = 16
+CONCURRENCY = 64
+ERROR_RATES = (0.0, 0.05, 0.2)
+
+
+def retrieve(concurrency: int, **faults: float) -> tuple[float, int]:
+    server = serve(latency=LATENCY, **faults)
+    gww_api.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    fids = list(range(N_RESERVOIRS))
+    t0 = time.perf_counter()
+    reservoirs_ts = gww_api.get_reservoirs_ts(
+        fids,
+        datetime(2020, 1, 1),
+        datetime(2020, 2, 1),
+        "surface_water_area",
+        concurrency=concurrency,
+    )
+    elapsed = time.perf_counter() - t0
+    server.shutdown()
+    return elapsed, len(gww_api.failed_reservoirs(fids, reservoirs_ts))
+
+
+def main() -> None:
+    logging.getLogger("gww_anomalies.gww_api").setLevel(logging.ERROR)
+    gww_api.BACKOFF_BASE = LATENCY
+    baseline, _ = retrieve(CAPACITY)
+    print(f"{'error rate':>10} {'seconds':>10} {'reservoirs/s':>14} {'of baseline':>12} {'failed':>8}")
+    print(f"{'baseline':>10} {baseline:>10.2f} {N_RESERVOIRS / baseline:>14.1f} {1:>12.2f} {0:>8}")
+    for error_rate in ERROR_RATES:
+        elapsed, failed = retrieve(CONCURRENCY, error_rate=error_rate, capacity=CAPACITY)
+        # the faults make every reservoir take 1 / (1 - error_rate) requests on average
+        relative = baseline / elapsed / (1 - error_rate)
+        print(f"{error_rate:>10.2f} {elapsed:>10.2f} {N_RESERVOIRS / elapsed:>14.1f} {relative:>12.2f} {failed:>8}")
+
+
+if __name__ == "__main__":
+    main()
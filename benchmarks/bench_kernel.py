@@ -0,0 +1,44 @@
+"""Benchmark the vectorized anomaly kernel for an increasing number of reservoirs.
+
+Run with `python benchmarks/bench_kernel.py`. The time per reservoir should stay roughly constant as the number of
+reservoirs grows, showing that the kernel scales linearly.
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from gww_anomalies.kernel import ClimatologyIndex, compute_anomalies
+
+SIZES = (1_000, 10_000, 100_000, 200_000)
+OBSERVATIONS_PER_RESERVOIR = 6
+
+
+def synthetic_inputs(n: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray, np.ndarray, ClimatologyIndex]:
+    fids = rng.permutation(n * 2)[:n]
+    fid = np.repeat(fids, OBSERVATIONS_PER_RESERVOIR)
+    days = rng.integers(0, 31, size=len(fid)).astype("timedelta64[D]")
+    time = (np.datetime64("2020-01-01") + days).astype("datetime64[s]")
+    value = rng.normal(1e6, 1e5, size=len(fid))
+    climatologies = pd.DataFrame({"fid": fids})
+    for m in range(1, 13):
+        climatologies[f"mean_{m}"] = rng.normal(1e6, 1e5, size=n)
+        climatologies[f"std_{m}"] = rng.uniform(1e4, 1e5, size=n)
+    return fid, time, value, ClimatologyIndex.from_dataframe(climatologies)
+
+
+def main() -> None:
+    rng = np.random.default_rng(42)
+    print(f"{'reservoirs':>12} {'seconds':>10} {'us/reservoir':>14}")
+    for n in SIZES:
+        fid, time_, value, climatology = synthetic_inputs(n, rng)
+        t0 = time.perf_counter()
+        anomalies = compute_anomalies(fid, time_, value, climatology)
+        elapsed = time.perf_counter() - t0
+        assert len(anomalies) == n
+        print(f"{n:>12} {elapsed:>10.3f} {elapsed / n * 1e6:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
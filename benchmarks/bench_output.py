@@ -0,0 +1,62 @@
+"""Benchmark the write time and file size of the anomaly output formats.
+
+Run with `python benchmarks/bench_output.py`. The anomalies of a synthetic set of reservoirs are written in every
+format and compared with GeoJSON, which has been the only vector format.
+"""
+
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely import points
+
+from gww_anomalies import output
+from gww_anomalies.locations import LocationsIndex
+from gww_anomalies.output import FORMATS, write_anomalies
+
+N_RESERVOIRS = 100_000
+
+
+def main() -> None:
+    rng = np.random.default_rng(42)
+    fids = np.arange(1, N_RESERVOIRS + 1)
+    anomalies_df = pd.DataFrame(
+        {
+            "fid": fids,
+            "anomaly": rng.normal(size=N_RESERVOIRS),
+            "monthly_surface_area": rng.uniform(1e5, 1e8, size=N_RESERVOIRS),
+        },
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = Path(tmp)
+        reservoir_locations = gpd.GeoDataFrame(
+            {"feature_id": fids},
+            geometry=points(rng.uniform(-180, 180, N_RESERVOIRS), rng.uniform(-60, 70, N_RESERVOIRS)),
+            crs=4326,
+        )
+        reservoir_locations.to_file(data_dir / "reservoirs-locations-v1.0.gpkg")
+        output.LocationsIndex = partial(LocationsIndex, cache_path=data_dir / "locations.parquet")
+        # convert the locations once, so that the conversion is not part of the first timing
+        output.LocationsIndex(data_dir / "reservoirs-locations-v1.0.gpkg")
+
+        results = {}
+        for output_format in FORMATS:
+            t0 = time.perf_counter()
+            output_path = write_anomalies(anomalies_df, data_dir / "anomalies", output_format, data_dir)
+            results[output_format] = (time.perf_counter() - t0, output_path.stat().st_size)
+
+    geojson_time, geojson_size = results["geojson"]
+    print(f"{'format':>12} {'seconds':>10} {'MB':>10} {'speedup':>10} {'size ratio':>12}")
+    for output_format, (elapsed, size) in results.items():
+        print(
+            f"{output_format:>12} {elapsed:>10.3f} {size / 1e6:>10.2f} {geojson_time / elapsed:>10.1f}"
+            f" {size / geojson_size:>12.3f}",
+        )
+
+
+if __name__ == "__main__":
+    main()
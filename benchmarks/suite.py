@@ -0,0 +1,196 @@
+"""End-to-end benchmark suite against a local fake GWW API, writing machine-readable results.
+
+Run with `python benchmarks/suite.py [--sizes 100 10000 100000] [--stages ...] [--output results.json]`. For every
+number of reservoirs a fake GWW API is started in a separate process serving synthetic data for reservoirs 1 to N,
+together with synthetic climatologies and reservoir locations. Then the stages are timed:
+
+- `calculate_anomalies`: retrieve one month and compute the anomalies of all reservoirs
+- `write_vector`: join the reservoir locations to the anomalies and write them to GeoJSON
+- `build_climatologies`: build the climatologies of all reservoirs from ten years of monthly data
+- `cli`: calculate and write the anomalies of all reservoirs with the command line interface in a new process
+
+The results are written as JSON with the commit they were measured at, so that results of different commits can be
+compared to find regressions. The largest sizes take long, mostly for building climatologies.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timezone
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely import points
+
+from gww_anomalies import gww_api
+from gww_anomalies.climatology import build_climatologies
+from gww_anomalies.main import calculate_anomalies
+from gww_anomalies.output import write_anomalies
+
+SIZES = (100, 10_000, 100_000)
+STAGES = ("calculate_anomalies", "write_vector", "build_climatologies", "cli")
+MONTH = datetime(2021, 2, 1)
+CLIMATOLOGY_PERIOD = (datetime(2000, 1, 1), datetime(2010, 1, 1))
+BATCH_SIZE = 50
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_fake_api(n_reservoirs: int, latency: float, error_rate: float) -> tuple[subprocess.Popen, str]:
+    port = _free_port()
+    command = [sys.executable, "-m", "gww_anomalies.fake_api", "--port", str(port), "--latency", str(latency)]
+    command += ["--error-rate", str(error_rate), "--reservoirs", str(n_reservoirs)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)  # noqa: S603
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"{url}/docs", timeout=1)  # noqa: S310
+        except urllib.error.HTTPError:
+            return process, url
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    err_msg = "The fake GWW API did not start"
+    raise RuntimeError(err_msg)
+
+
+def synthetic_data(data_dir: Path, n_reservoirs: int) -> None:
+    rng = np.random.default_rng(42)
+    fids = np.arange(1, n_reservoirs + 1)
+    climatologies = pd.DataFrame({"fid": fids})
+    for m in range(1, 13):
+        climatologies[f"mean_{m}"] = rng.normal(1e6, 1e5, size=n_reservoirs)
+        climatologies[f"std_{m}"] = rng.uniform(1e4, 1e5, size=n_reservoirs)
+    climatologies.to_parquet(data_dir / "climatologies.parquet")
+    reservoir_locations = gpd.GeoDataFrame(
+        {"feature_id": fids},
+        geometry=points(rng.uniform(-180, 180, n_reservoirs), rng.uniform(-60, 70, n_reservoirs)),
+        crs=4326,
+    )
+    reservoir_locations.to_file(data_dir / "reservoirs-locations-v1.0.gpkg")
+    (data_dir / "reservoirs.txt").write_text(",".join(str(fid) for fid in fids))
+
+
+def run_stages(n_reservoirs: int, stages: list[str], data_dir: Path, url: str) -> list[dict]:
+    gww_api.base_url = url
+    os.environ["GWW_API_URL"] = url
+    fids = list(range(1, n_reservoirs + 1))
+    climatologies = pd.read_parquet(data_dir / "climatologies.parquet")
+    start, stop = MONTH, datetime(MONTH.year, MONTH.month + 1, 1)
+    anomalies_df = None
+    results = []
+
+    def timed(stage: str, function: callable) -> None:
+        t0 = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - t0
+        results.append(
+            {
+                "stage": stage,
+                "n_reservoirs": n_reservoirs,
+                "seconds": elapsed,
+                "reservoirs_per_second": n_reservoirs / elapsed,
+            },
+        )
+        print(f"{stage:>20} {n_reservoirs:>10} {elapsed:>10.2f} {n_reservoirs / elapsed:>14.1f}")
+
+    def anomalies() -> None:
+        nonlocal anomalies_df
+        anomalies_df = calculate_anomalies(climatologies, fids, start, stop, batch_size=BATCH_SIZE)
+
+    if "calculate_anomalies" in stages or "write_vector" in stages:
+        timed("calculate_anomalies", anomalies)
+    if "write_vector" in stages:
+        # convert the locations once, so that the one-time conversion is not part of the timing
+        write_anomalies(anomalies_df.head(1), data_dir / "warmup", "geojson", data_dir)
+        timed("write_vector", lambda: write_anomalies(anomalies_df, data_dir / "anomalies", "geojson", data_dir))
+    if "build_climatologies" in stages:
+        timed(
+            "build_climatologies",
+            lambda: build_climatologies(
+                fids,
+                data_dir / "built_climatologies.parquet",
+                data_dir / "climatology_shards",
+                *CLIMATOLOGY_PERIOD,
+                use_cache=False,
+            ),
+        )
+    if "cli" in stages:
+        command = [
+            sys.executable,
+            "-m",
+            "gww_anomalies.cli",
+            "-d",
+            str(data_dir),
+            "-r",
+            str(data_dir / "reservoirs.txt"),
+        ]
+        command += ["-m", MONTH.strftime("%m-%d-%Y"), "-b", str(BATCH_SIZE), "-f", "geoparquet", "--no-cache"]
+        timed("cli", lambda: subprocess.run(command, check=True, capture_output=True))  # noqa: S603
+    return [result for result in results if result["stage"] in stages]
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],  # noqa: S607
+            check=True,
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+parser = argparse.ArgumentParser(description="Benchmark gww-anomalies against a local fake GWW API.")
+parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="Numbers of reservoirs to benchmark")
+parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="Stages to benchmark")
+parser.add_argument("--latency", type=float, default=0.0, help="Seconds the fake API waits before answering")
+parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with a 503 error")
+parser.add_argument("--output", default="benchmark-results.json", help="JSON file to write the results to")
+
+
+def main() -> None:
+    args = parser.parse_args()
+    print(f"{'stage':>20} {'reservoirs':>10} {'seconds':>10} {'reservoirs/s':>14}")
+    results = []
+    for n_reservoirs in args.sizes:
+        process, url = start_fake_api(n_reservoirs, args.latency, args.error_rate)
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                synthetic_data(Path(tmp), n_reservoirs)
+                results += run_stages(n_reservoirs, args.stages, Path(tmp), url)
+        finally:
+            process.terminate()
+            process.wait()
+    report = {
+        "commit": _commit(),
+        "timestamp": datetime.now(tz=timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "fake_api": {"latency": args.latency, "error_rate": args.error_rate},
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"Wrote results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
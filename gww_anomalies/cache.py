@@ -0,0 +1,261 @@
+"""Persistent on-disk cache of reservoir time series retrieved from the GWW API."""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import TYPE_CHECKING
+
+from gww_anomalies import CACHE_PATH
+from gww_anomalies.log import setup_log
+from gww_anomalies.metrics import metrics
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+logger = setup_log(__name__)
+
+TIMESERIES_CACHE: Path = CACHE_PATH / "timeseries.sqlite"
+DEFAULT_CACHE_MAX_BYTES: int = 2_000_000_000
+EVICTION_FRACTION: float = 0.1
+# late observations of a month keep arriving for a while after it has ended, so recent months are not cached yet
+DEFAULT_SETTLE_DAYS: float = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS months (
+    fid INTEGER NOT NULL,
+    variable TEXT NOT NULL,
+    month TEXT NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (fid, variable, month)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS months_accessed ON months (accessed);
+CREATE TABLE IF NOT EXISTS observations (
+    fid INTEGER NOT NULL,
+    variable TEXT NOT NULL,
+    month TEXT NOT NULL,
+    t TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (fid, variable, month, t)
+) WITHOUT ROWID;
+"""
+
+
+def month_key(date: datetime) -> str:
+    """Get the cache key of the month of `date`, formatted as 'YYYY-MM'."""
+    return f"{date.year:04d}-{date.month:02d}"
+
+
+def _next_month(date: datetime) -> datetime:
+    return datetime(date.year + date.month // 12, date.month % 12 + 1, 1)
+
+
+def split_months(start: datetime, stop: datetime) -> list[tuple[str, datetime, datetime]]:
+    """Split the period from `start` to `stop` into calendar months.
+
+    Returns
+    -------
+    list[tuple[str, datetime, datetime]]
+        month key, start and stop of every month overlapping the period, clipped to the period
+
+    """
+    months = []
+    month_start = datetime(start.year, start.month, 1)
+    while month_start < stop:
+        month_stop = _next_month(month_start)
+        months.append((month_key(month_start), max(month_start, start), min(month_stop, stop)))
+        month_start = month_stop
+    return months
+
+
+class TimeSeriesCache:
+    """SQLite store of reservoir observations keyed by reservoir, variable and month.
+
+    Only complete months are stored: months that lie entirely within a requested period and that ended more than
+    `settle_days` days ago, so that observations of a month that arrive late are not missed. Months are stored even
+    when they hold no observations, so that empty months are not requested again. When the database grows beyond
+    `max_bytes`, the least recently used months are evicted.
+
+    Parameters
+    ----------
+    path : Path, optional
+        location of the SQLite database, by default TIMESERIES_CACHE
+    max_bytes : int, optional
+        maximum size of the database, by default DEFAULT_CACHE_MAX_BYTES
+    settle_days : float, optional
+        number of days after the end of a month before it is complete, by default DEFAULT_SETTLE_DAYS
+
+    """
+
+    def __init__(
+        self,
+        path: Path = TIMESERIES_CACHE,
+        max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+        settle_days: float = DEFAULT_SETTLE_DAYS,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.settle_days = settle_days
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self._connection.close()
+
+    def _complete_months(self, start: datetime, stop: datetime) -> list[tuple[str, datetime, datetime]]:
+        settled = datetime.now() - timedelta(days=self.settle_days)
+        return [
+            (key, month_start, month_stop)
+            for key, month_start, month_stop in split_months(start, stop)
+            if month_start == datetime(month_start.year, month_start.month, 1)
+            and month_stop == _next_month(month_start) <= settled
+        ]
+
+    def plan(
+        self,
+        fid: int,
+        variable: str,
+        start: datetime,
+        stop: datetime,
+    ) -> tuple[list[dict], tuple[datetime, datetime] | None]:
+        """Get the cached observations of a reservoir and the period that still has to be retrieved.
+
+        Parameters
+        ----------
+        fid : int
+            feature id of the reservoir
+        variable : str
+            name of the variable
+        start : datetime
+            start of the requested period
+        stop : datetime
+            end of the requested period
+
+        Returns
+        -------
+        tuple[list[dict], tuple[datetime, datetime] | None]
+            cached observations outside the period to retrieve, and the period to retrieve or None if every month of
+            the requested period is cached
+
+        """
+        months = split_months(start, stop)
+        if not months:
+            return [], None
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT month FROM months WHERE fid = ? AND variable = ? AND month BETWEEN ? AND ?",
+                (fid, variable, months[0][0], months[-1][0]),
+            ).fetchall()
+        cached = {row[0] for row in rows}
+        complete = {key for key, _, _ in self._complete_months(start, stop)}
+        missing = [(key, a, b) for key, a, b in months if key not in cached or key not in complete]
+        metrics.record_cache(hits=len(months) - len(missing), misses=len(missing))
+        if not missing:
+            return self._read(fid, variable, [key for key, _, _ in months]), None
+        span = (missing[0][1], missing[-1][2])
+        outside = [key for key, _, _ in months if key < missing[0][0] or key > missing[-1][0]]
+        return self._read(fid, variable, outside), span
+
+    def _read(self, fid: int, variable: str, months: list[str]) -> list[dict]:
+        if not months:
+            return []
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT t, value FROM observations WHERE fid = ? AND variable = ? AND month BETWEEN ? AND ? ORDER BY t",
+                (fid, variable, min(months), max(months)),
+            ).fetchall()
+            self._connection.executemany(
+                "UPDATE months SET accessed = ? WHERE fid = ? AND variable = ? AND month = ?",
+                [(time.time(), fid, variable, month) for month in months],
+            )
+            self._connection.commit()
+        months = set(months)
+        return [{"t": t, "value": value} for t, value in rows if t[:7] in months]
+
+    def store(self, fid: int, variable: str, start: datetime, stop: datetime, observations: list[dict]) -> list[dict]:
+        """Store the complete months of observations retrieved for the period from `start` to `stop`.
+
+        Returns
+        -------
+        list[dict]
+            the observations that fall within the months of the period
+
+        """
+        keys = {key for key, _, _ in split_months(start, stop)}
+        observations = [obs for obs in observations if obs["t"][:7] in keys]
+        complete = {key for key, _, _ in self._complete_months(start, stop)}
+        if not complete:
+            return observations
+        rows = [
+            (fid, variable, obs["t"][:7], obs["t"], obs["value"]) for obs in observations if obs["t"][:7] in complete
+        ]
+        now = time.time()
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO months VALUES (?, ?, ?, ?)",
+                [(fid, variable, key, now) for key in complete],
+            )
+            self._connection.executemany("INSERT OR REPLACE INTO observations VALUES (?, ?, ?, ?, ?)", rows)
+            self._connection.commit()
+        self.evict()
+        return observations
+
+    def size(self) -> int:
+        """Get the number of bytes in use by the database."""
+        with self._lock:
+            page_size = self._connection.execute("PRAGMA page_size").fetchone()[0]
+            page_count = self._connection.execute("PRAGMA page_count").fetchone()[0]
+            freelist_count = self._connection.execute("PRAGMA freelist_count").fetchone()[0]
+        return page_size * (page_count - freelist_count)
+
+    def evict(self) -> None:
+        """Evict the least recently used months until the database is smaller than `max_bytes`."""
+        while self.size() > self.max_bytes:
+            with self._lock:
+                n_months = self._connection.execute("SELECT COUNT(*) FROM months").fetchone()[0]
+                if n_months == 0:
+                    return
+                evicted = self._connection.execute(
+                    "SELECT fid, variable, month FROM months ORDER BY accessed LIMIT ?",
+                    (max(1, int(n_months * EVICTION_FRACTION)),),
+                ).fetchall()
+                self._connection.executemany(
+                    "DELETE FROM observations WHERE fid = ? AND variable = ? AND month = ?",
+                    evicted,
+                )
+                self._connection.executemany("DELETE FROM months WHERE fid = ? AND variable = ? AND month = ?", evicted)
+                self._connection.commit()
+                self._connection.execute("PRAGMA incremental_vacuum")
+            logger.info("Evicted %s months from the time series cache", len(evicted))
+
+    def cached_spans(
+        self,
+        fids: list[int],
+        variable: str,
+        start: datetime,
+        stop: datetime,
+    ) -> tuple[dict[int, list[dict]], dict[tuple[datetime, datetime], list[int]]]:
+        """Plan the retrieval of many reservoirs, grouping reservoirs that miss the same period.
+
+        Returns
+        -------
+        tuple[dict[int, list[dict]], dict[tuple[datetime, datetime], list[int]]]
+            cached observations per reservoir, and the reservoirs to retrieve per missing period
+
+        """
+        cached = {}
+        plans = []
+        for fid in fids:
+            cached[fid], span = self.plan(fid, variable, start, stop)
+            if span is not None:
+                plans.append((span, fid))
+        plans.sort(key=lambda plan: plan[0])
+        spans = {span: [fid for _, fid in group] for span, group in groupby(plans, key=lambda plan: plan[0])}
+        return cached, spans
@@ -0,0 +1,102 @@
+"""Single change point detection in reservoir time series using prefix sums.
+
+The optimal single breakpoint under an L2 cost splits a series where the summed squared deviations from the segment
+means are smallest. With cumulative sums that cost is known for every candidate split at once, which makes the
+detection linear in the length of the series and allows detecting breakpoints of many series in one vectorized call.
+The candidate breakpoints are the same as those of `ruptures.Dynp` with its default `min_size=2` and `jump=5`.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+MIN_SIZE: int = 2
+JUMP: int = 5
+TOLERANCE: float = 0.7
+
+
+def best_breakpoints(values: np.ndarray, lengths: np.ndarray | None = None) -> np.ndarray:
+    """Find the optimal single L2 breakpoint of every series in a padded 2D array.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        (series x time) array, series shorter than the array are padded at the end
+    lengths : np.ndarray | None, optional
+        length of every series, by default all series span the full array
+
+    Returns
+    -------
+    np.ndarray
+        index of the first value after the breakpoint of every series, or 0 when a series is too short for a breakpoint
+
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    n_series, n_max = values.shape
+    lengths = np.full(n_series, n_max) if lengths is None else np.asarray(lengths)
+    in_series = np.arange(n_max) < lengths[:, None]
+    values = np.where(in_series, values, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # center the series to limit the loss of precision in the cumulative sums
+        values = np.where(in_series, values - values.sum(axis=1, keepdims=True) / lengths[:, None], 0.0)
+    cumsum = np.cumsum(values, axis=1)
+    total = cumsum[:, -1:]
+    candidates = np.arange(JUMP, n_max, JUMP)
+    if len(candidates) == 0:
+        return np.zeros(n_series, dtype=np.int64)
+    left = cumsum[:, candidates - 1]
+    n_right = lengths[:, None] - candidates
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # the total sum of squares is the same for every split, so only the explained part has to be maximized
+        explained = left**2 / candidates + (total - left) ** 2 / n_right
+    explained = np.where((candidates >= MIN_SIZE) & (n_right >= MIN_SIZE), explained, -np.inf)
+    best = np.argmax(explained, axis=1)
+    return np.where(np.isfinite(explained[np.arange(n_series), best]), candidates[best], 0)
+
+
+def change_points(
+    values: np.ndarray,
+    lengths: np.ndarray | None = None,
+    tolerance: float = TOLERANCE,
+) -> np.ndarray:
+    """Detect valid change points in many series at once.
+
+    A breakpoint is a valid change when the mean of the values before it divided by the mean of the values after it
+    is smaller than `tolerance`.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        (series x time) array, series shorter than the array are padded at the end
+    lengths : np.ndarray | None, optional
+        length of every series, by default all series span the full array
+    tolerance : float, optional
+        maximum ratio of the means before and after the breakpoint, by default TOLERANCE
+
+    Returns
+    -------
+    np.ndarray
+        index of the first value after the change of every series, or 0 when a series has no valid change
+
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    n_series, n_max = values.shape
+    lengths = np.full(n_series, n_max) if lengths is None else np.asarray(lengths)
+    breakpoints = best_breakpoints(values, lengths)
+    position = np.arange(n_max)
+    in_series = position < lengths[:, None]
+    before = position < breakpoints[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        m1 = np.where(before, values, 0.0).sum(axis=1) / breakpoints
+        m2 = np.where(in_series & ~before, values, 0.0).sum(axis=1) / (lengths - breakpoints)
+        valid = (breakpoints > 0) & (m1 / m2 < tolerance)
+    return np.where(valid, breakpoints, 0)
+
+
+def pad(series: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """Pad series of unequal length into a (series x time) array with the lengths of the series."""
+    lengths = np.array([len(s) for s in series], dtype=np.int64)
+    values = np.zeros((len(series), lengths.max(initial=0)))
+    for i, s in enumerate(series):
+        values[i, : len(s)] = s
+    return values, lengths
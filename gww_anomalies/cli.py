@@ -1,13 +1,19 @@
-"""Lightweight CLI for calculating reservoir anomalies."""
+"""Lightweight CLI for calculating reservoir anomalies.
+
+Only the standard library and the light modules of the package are imported at startup, so that `--help` and argument
+errors return quickly. The anomaly calculation and its dependencies are imported once the arguments are parsed.
+"""
 
 from __future__ import annotations
 
 import argparse
+import cProfile
+import pstats
 from pathlib import Path
 
+from gww_anomalies.defaults import DEFAULT_CHUNK_SIZE, DEFAULT_CONCURRENCY, FORMATS
 from gww_anomalies.log import setup_log
-from gww_anomalies.main import run
-from gww_anomalies.utils import _parse_reservoir_ids_file, parse_date
+from gww_anomalies.utils import _parse_reservoir_ids_file, parse_date, parse_shard
 
 logger = setup_log(__name__)
 
@@ -18,6 +24,11 @@ parser.add_argument(
     help="Output directory to write the reservoir anomalies file to, by default the file is written to"
     "./gww-anomalies/data",
 )
+parser.add_argument(
+    "-d",
+    "--data-dir",
+    help="Directory with the climatologies and reservoir locations files, by default ./gww-anomalies/data",
+)
 parser.add_argument(
     "-r",
     "--reservoir_ids_file",
@@ -28,6 +39,15 @@ parser.add_argument(
     "--month",
     help="Calculate the anomalies by a given month in 'mm-dd-YYYY' format. By default the latest month is used.",
 )
+parser.add_argument(
+    "--start-month",
+    help="Calculate the anomalies for every month from this month up to and including the end month, in 'mm-dd-YYYY'"
+    " format. The anomalies of all months are written to one file keyed by fid and month.",
+)
+parser.add_argument(
+    "--end-month",
+    help="Last month, in 'mm-dd-YYYY' format, of the range of months started with --start-month.",
+)
 parser.add_argument(
     "-v",
     "--as-vector",
@@ -35,13 +55,137 @@ parser.add_argument(
     action=argparse.BooleanOptionalAction,
     default=True,
 )
+parser.add_argument(
+    "-f",
+    "--format",
+    help="Format of the anomalies file. GeoParquet, FlatGeobuf and Arrow IPC files are compact, typed and fast to write"
+    " and read. By default GeoJSON with --as-vector and CSV with --no-as-vector.",
+    choices=list(FORMATS),
+)
+parser.add_argument(
+    "-c",
+    "--concurrency",
+    help=f"Number of concurrent requests to the GWW API, by default {DEFAULT_CONCURRENCY}",
+    type=int,
+    default=DEFAULT_CONCURRENCY,
+)
+parser.add_argument(
+    "-b",
+    "--batch-size",
+    help="Fetch reservoirs in batches per request, starting with this many reservoirs per batch and adapting the batch"
+    " size to the response times of the GWW API. By default every reservoir is fetched with a separate request.",
+    type=int,
+)
+parser.add_argument(
+    "--chunk-size",
+    help="Number of reservoirs per chunk. The anomalies of every chunk are saved as soon as the chunk is completed, by"
+    f" default {DEFAULT_CHUNK_SIZE}",
+    type=int,
+    default=DEFAULT_CHUNK_SIZE,
+)
+parser.add_argument(
+    "--resume",
+    help="Resume an interrupted run with the same arguments, skipping the chunks it completed",
+    action="store_true",
+)
+parser.add_argument(
+    "--cache",
+    help="Read and store retrieved time series in the local time series cache, so that only months that are not"
+    " cached yet are requested from the GWW API",
+    action=argparse.BooleanOptionalAction,
+    default=True,
+)
+parser.add_argument(
+    "--shard",
+    help="Only calculate the anomalies of shard i of n, given as 'i/n' with 0 <= i < n, to spread a run over n nodes."
+    " Reservoirs are assigned to shards by a hash of their fid, and every shard writes its own anomalies file, to be"
+    " combined with `python -m gww_anomalies.sharding merge`.",
+    type=parse_shard,
+)
+parser.add_argument(
+    "--standardized-index",
+    action="store_true",
+    help="Also write the standardized index of every reservoir, the monthly surface water area transformed to a"
+    " standard normal quantile with the distribution fitted per reservoir and calendar month in the climatologies"
+    " file. Requires scipy.",
+)
+parser.add_argument(
+    "--regions",
+    help="Polygon layer of regions, such as countries or river basins, to aggregate the anomalies to. The area-weighted"
+    " mean anomaly and the number of reservoirs below normal per region are written to a _regions.csv file next to the"
+    " anomalies file. Requires --region-column.",
+)
+parser.add_argument("--region-column", help="Column of the --regions layer with the name or code of every region")
+parser.add_argument(
+    "--cube",
+    help="Also write the anomalies to the dense reservoir x month anomaly cube in this directory, which holds the"
+    " anomalies of all runs and is read by reservoir or by month without opening the monthly anomalies files",
+)
+parser.add_argument(
+    "--prometheus-textfile",
+    help="Also write the run metrics to this file in the Prometheus text format, for the node exporter textfile"
+    " collector. The metrics are always written to a JSON run report next to the anomalies file.",
+)
+parser.add_argument(
+    "--profile",
+    help="Profile the run with cProfile and write the statistics to this file, to be read with pstats or snakeviz",
+)
 
 
-if __name__ == "__main__":
-    args = parser.parse_args()
-    data_dir = Path(__file__).parent.parent / "data"
+def main(argv: list[str] | None = None) -> None:
+    """Calculate reservoir anomalies with the command line arguments `argv`, by default those of the process."""
+    args = parser.parse_args(argv)
+    data_dir = Path(args.data_dir) if args.data_dir else Path(__file__).parent.parent / "data"
     fid_list = _parse_reservoir_ids_file(fp=args.reservoir_ids_file) if args.reservoir_ids_file else None
     month = parse_date(args.month) if args.month else None
+    if bool(args.start_month) != bool(args.end_month):
+        parser.error("--start-month and --end-month must be given together")
+    if args.month and args.start_month:
+        parser.error("--month cannot be combined with --start-month/--end-month")
+    if args.regions and not args.region_column:
+        parser.error("--regions requires --region-column")
+    start_month = parse_date(args.start_month) if args.start_month else None
+    end_month = parse_date(args.end_month) if args.end_month else None
     output_dir = data_dir if args.output_dir is None else args.output_dir
     logger.info("Setting output directory to %s", output_dir)
-    run(output_dir=output_dir, month=month, data_dir=data_dir, reservoir_list=fid_list, as_vector=args.as_vector)
+    # imported here, so that parsing the arguments does not wait for pandas and the other heavy dependencies
+    from gww_anomalies.main import run
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    run(
+        output_dir=output_dir,
+        month=month,
+        data_dir=data_dir,
+        reservoir_list=fid_list,
+        as_vector=args.as_vector,
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        use_cache=args.cache,
+        start_month=start_month,
+        end_month=end_month,
+        output_format=args.format,
+        chunk_size=args.chunk_size,
+        resume=args.resume,
+        shard=args.shard,
+        standardized_index=args.standardized_index,
+        regions_path=Path(args.regions) if args.regions else None,
+        region_column=args.region_column,
+        cube_path=Path(args.cube) if args.cube else None,
+        prometheus_path=Path(args.prometheus_textfile) if args.prometheus_textfile else None,
+    )
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        stats = pstats.Stats(profiler)
+        logger.info(
+            "Profiled %s function calls in %.2f s, wrote the profile to %s",
+            stats.total_calls,
+            stats.total_tt,
+            args.profile,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,713 @@
+"""Build reservoir climatologies from the surface water area time series of the GWW API."""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import requests
+from tqdm import tqdm
+
+from gww_anomalies.cache import TIMESERIES_CACHE, TimeSeriesCache
+from gww_anomalies.change_detection import TOLERANCE, change_points
+from gww_anomalies.gww_api import DEFAULT_CONCURRENCY, failed_reservoirs, get_reservoir_ts, get_reservoirs_ts
+from gww_anomalies.kernel import monthly_means, observations_to_arrays
+from gww_anomalies.log import setup_log
+from gww_anomalies.utils import _parse_reservoir_ids_file, download_reservoir_geometries, get_month_range, parse_date
+
+logger = setup_log(__name__)
+
+START_DATE: datetime = datetime(2000, 1, 1)
+DIST: str = "norm"
+MIN_SAMPLE_SIZE: int = 5  # minimum of 5 years of data
+MIN_RECORDS: int = 100  # skip reservoirs that have less than 100 records
+INCLUDE_ZERO: bool = False
+SKIP_RESERVOIRS: int = 13000  # first 13000 reservoirs are too small
+DEFAULT_SHARD_SIZE: int = 500
+VARIABLE: str = "surface_water_area_monthly"
+DIST_PARAMETERS: dict[str, tuple[str, ...]] = {
+    "norm": ("mean", "std"),
+    "gamma": ("a", "loc", "scale"),
+    "genextreme": ("c", "loc", "scale"),
+}
+FIT_METHODS: tuple[str, ...] = ("moments", "scipy")
+
+
+def change_detect(df: pd.DataFrame, tolerance: float = TOLERANCE, value: str = "value") -> list[int] | None:
+    """Change detection for reservoir behavior.
+
+    Detected changes are evaluated by comparing the mean of the first against the mean of the second period. If they
+    significantly deviate, then the change is considered valid, otherwise not.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        dataframe with the values to evaluate changes on
+    tolerance : float
+        If mean of first period divided by mean of second period is smaller than tolerance, the change is considered
+        valid.
+    value : str
+        column of `df` with the values
+
+    Returns
+    -------
+    change point as index (or None if not reaching the tolerance)
+
+    """
+    breakpoint_ = change_points(df[value].to_numpy(), tolerance=tolerance)[0]
+    if breakpoint_:
+        return [int(breakpoint_), len(df)]
+    return None
+
+
+def fit(ts: pd.DataFrame, dist: str = "norm", include_zero: bool = False) -> tuple[tuple, float]:  # noqa: FBT001, FBT002
+    """Fit a distribution from a number of samples.
+
+    The distribution can be any distribution supported by scipy.stats, e.g. normal, gamma or genextreme. It can
+    (should) be tested whether the process fits chosen distribution, e.g. with a goodness of fit or Q-Q plots.
+
+    Parameters
+    ----------
+    ts : pd.DataFrame
+        the samples from the process, to be described by the distribution
+    dist : str
+        chosen distribution, compatible with scipy.stats
+    include_zero : bool
+        decide if probability of zero values occurring should be included explicitly
+
+    Returns
+    -------
+    tuple[tuple, float]
+        fit parameters of chosen distribution such as shape, location, scale and the probability of zero occurring
+
+    """
+    from scipy import stats
+
+    samples = ts.to_numpy().flatten()  # flatten the matrix to a one-dimensional array
+    # compute probability of zero (only relevant for things like rainfall)
+    prob_zero = float(sum(samples == 0)) / len(samples) if include_zero else 0.0
+    dist_func = getattr(stats, dist)
+    # fit parameters of chosen distribution function, only through non-zero samples
+    if include_zero:
+        fit_params = dist_func.fit(samples[(samples != 0) & np.isfinite(samples)])
+    else:
+        fit_params = dist_func.fit(samples[np.isfinite(samples)])
+    return fit_params, prob_zero
+
+
+def climatology_columns(dist: str = DIST, include_zero: bool = INCLUDE_ZERO) -> list[str]:
+    """Get the columns of the climatologies table for a distribution.
+
+    Every table has the `mean_{m}` and `std_{m}` columns used for the anomalies, other distributions add a column per
+    distribution parameter and calendar month. With `include_zero`, a `p_zero_{m}` column holds the probability of a
+    zero surface water area per calendar month.
+    """
+    parameters = ["mean", "std"] + [p for p in DIST_PARAMETERS[dist] if p not in ("mean", "std")]
+    if include_zero:
+        parameters.append("p_zero")
+    return ["fid"] + [f"{p}_{m}" for m in range(1, 13) for p in parameters]
+
+
+def _l_moments(group: np.ndarray, value: np.ndarray, count: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute the first three sample L-moments per group from probability weighted moments."""
+    order = np.lexsort((value, group))
+    group, value = group[order], value[order]
+    group_start = np.concatenate([[0], np.cumsum(count)[:-1]])
+    rank = np.arange(len(value)) - group_start[group]  # 0-based rank within the group
+    n = count[group].astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        b0 = np.bincount(group, weights=value, minlength=len(count)) / count
+        b1 = np.bincount(group, weights=value * rank / (n - 1), minlength=len(count)) / count
+        b2 = np.bincount(group, weights=value * rank * (rank - 1) / ((n - 1) * (n - 2)), minlength=len(count)) / count
+    return b0, 2 * b1 - b0, 6 * b2 - 6 * b1 + b0
+
+
+def _fit_moments(
+    group: np.ndarray,
+    value: np.ndarray,
+    count: np.ndarray,
+    mean: np.ndarray,
+    std: np.ndarray,
+    dist: str,
+) -> dict[str, np.ndarray]:
+    """Estimate distribution parameters per group in closed form.
+
+    The normal distribution is fitted by maximum likelihood (the mean and the biased standard deviation, as
+    `scipy.stats.norm.fit`), the gamma distribution by the method of moments with the location fixed at zero and the
+    generalized extreme value distribution from L-moments (Hosking, 1985).
+    """
+    if dist == "norm":
+        return {"mean": mean, "std": std}
+    if dist == "gamma":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return {"a": (mean / std) ** 2, "loc": np.zeros_like(mean), "scale": std**2 / mean}
+    if dist == "genextreme":
+        l1, l2, l3 = _l_moments(group, value, count)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = 2 / (3 + l3 / l2) - np.log(2) / np.log(3)
+            c = 7.8590 * z + 2.9554 * z**2
+            gamma_c = np.frompyfunc(math.gamma, 1, 1)(1 + c).astype(np.float64)
+            scale = l2 * c / ((1 - 2 ** (-c)) * gamma_c)
+            loc = l1 - scale * (1 - gamma_c) / c
+        return {"c": c, "loc": loc, "scale": scale}
+    err_msg = f"Distribution should be one of {', '.join(DIST_PARAMETERS)}, not '{dist}'"
+    raise ValueError(err_msg)
+
+
+def _fit_scipy(group: np.ndarray, value: np.ndarray, n_groups: int, dist: str) -> dict[str, np.ndarray]:
+    """Estimate distribution parameters per group with `scipy.stats`, one fit per group."""
+    params = np.full((n_groups, len(DIST_PARAMETERS[dist])), np.nan)
+    order = np.argsort(group, kind="stable")
+    groups, starts = np.unique(group[order], return_index=True)
+    for g, samples in zip(groups, np.split(value[order], starts[1:]), strict=True):
+        params[g] = fit(pd.Series(samples), dist=dist)[0]
+    return dict(zip(DIST_PARAMETERS[dist], params.T, strict=True))
+
+
+def fit_climatologies(
+    fid: np.ndarray,
+    time: np.ndarray,
+    value: np.ndarray,
+    dist: str = DIST,
+    method: str = "moments",
+    include_zero: bool = INCLUDE_ZERO,
+) -> pd.DataFrame:
+    """Fit a distribution per reservoir and calendar month for all reservoirs at once.
+
+    The observations are laid out as (reservoir x calendar month) groups, and the parameters of all groups are
+    estimated with vectorized NumPy reductions. Reservoirs with less than MIN_SAMPLE_SIZE observations in any calendar
+    month are left out. With `include_zero`, the probability of a zero value is stored per group and the distribution
+    is fitted to the non-zero values only, as for the standardized precipitation index. The `mean_{m}` and `std_{m}`
+    columns are always computed from all values.
+
+    Parameters
+    ----------
+    fid : np.ndarray
+        reservoir id of every observation
+    time : np.ndarray
+        datetime64 time of every observation
+    value : np.ndarray
+        monthly surface water area of every observation
+    dist : str, optional
+        distribution to fit, one of "norm", "gamma" or "genextreme", by default DIST
+    method : str, optional
+        "moments" for closed-form estimators or "scipy" to fit every group with `scipy.stats`, by default "moments"
+    include_zero : bool, optional
+        store the probability of zero values and fit the distribution to the non-zero values, by default INCLUDE_ZERO
+
+    Returns
+    -------
+    pd.DataFrame
+        climatologies with the columns given by `climatology_columns(dist, include_zero)`
+
+    """
+    if dist not in DIST_PARAMETERS:
+        err_msg = f"Distribution should be one of {', '.join(DIST_PARAMETERS)}, not '{dist}'"
+        raise ValueError(err_msg)
+    if method not in FIT_METHODS:
+        err_msg = f"Fit method should be one of {', '.join(FIT_METHODS)}, not '{method}'"
+        raise ValueError(err_msg)
+    if include_zero and dist == "norm":
+        err_msg = "The probability of zero values can only be included for the gamma and genextreme distributions"
+        raise ValueError(err_msg)
+    valid = np.isfinite(value)
+    fid, time, value = fid[valid], time[valid], value[valid]
+    fids, reservoir = np.unique(fid, return_inverse=True)
+    group = reservoir * 12 + time.astype("datetime64[M]").astype(np.int64) % 12
+    n_groups = len(fids) * 12
+    count = np.bincount(group, minlength=n_groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.bincount(group, weights=value, minlength=n_groups) / count
+        std = np.sqrt(np.bincount(group, weights=(value - mean[group]) ** 2, minlength=n_groups) / count)
+    params = {"mean": mean, "std": std}
+    fit_group, fit_value, fit_count, fit_mean, fit_std = group, value, count, mean, std
+    if include_zero:
+        nonzero = value != 0
+        fit_group, fit_value = group[nonzero], value[nonzero]
+        fit_count = np.bincount(fit_group, minlength=n_groups)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            params["p_zero"] = 1 - fit_count / count
+            fit_mean = np.bincount(fit_group, weights=fit_value, minlength=n_groups) / fit_count
+            fit_std = np.sqrt(
+                np.bincount(fit_group, weights=(fit_value - fit_mean[fit_group]) ** 2, minlength=n_groups) / fit_count,
+            )
+    if method == "scipy":
+        params |= _fit_scipy(fit_group, fit_value, n_groups, dist)
+    elif dist != "norm":
+        params |= _fit_moments(fit_group, fit_value, fit_count, fit_mean, fit_std, dist)
+
+    keep = (count.reshape(-1, 12) >= MIN_SAMPLE_SIZE).all(axis=1)
+    columns = climatology_columns(dist, include_zero)
+    data = {"fid": fids[keep]}
+    for column in columns[1:]:
+        parameter, month = column.rsplit("_", 1)
+        data[column] = params[parameter].reshape(-1, 12)[keep, int(month) - 1]
+    return pd.DataFrame(data, columns=columns)
+
+
+def _prepare_series(reservoirs_ts: dict[int, list[dict]]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Flatten the series of reservoirs with enough records, cutting every series at its detected change point.
+
+    The change points of all series are detected at once on a padded (reservoir x time) array.
+    """
+    reservoirs_ts = {fid: ts for fid, ts in reservoirs_ts.items() if len(ts) >= MIN_RECORDS}
+    fid, time, value = observations_to_arrays(reservoirs_ts)
+    valid = np.isfinite(value)
+    order = np.argsort(fid[valid], kind="stable")
+    fid, time, value = fid[valid][order], time[valid][order], value[valid][order]
+    _, reservoir, lengths = np.unique(fid, return_inverse=True, return_counts=True)
+    position = np.arange(len(fid)) - np.concatenate([[0], np.cumsum(lengths)[:-1]])[reservoir]
+    padded = np.zeros((len(lengths), lengths.max(initial=0)))
+    padded[reservoir, position] = value
+    after_change = position >= change_points(padded, lengths)[reservoir]
+    return fid[after_change], time[after_change], value[after_change]
+
+
+def reservoir_climatology(
+    fid: int,
+    reservoir_ts: list[dict],
+    dist: str = DIST,
+    method: str = "moments",
+) -> dict | None:
+    """Calculate the climatology of a reservoir from its monthly surface water area time series.
+
+    The series is cut at a detected change point, after which a distribution is fitted per calendar month.
+
+    Parameters
+    ----------
+    fid : int
+        feature id of the reservoir
+    reservoir_ts : list[dict]
+        monthly surface water area time series of the reservoir
+    dist : str, optional
+        distribution to fit, by default DIST
+    method : str, optional
+        fit method, "moments" or "scipy", by default "moments"
+
+    Returns
+    -------
+    dict | None
+        fid with the `mean_{m}` and `std_{m}` parameters per calendar month, or None when the series is too short
+
+    """
+    climatology = fit_climatologies(*_prepare_series({fid: reservoir_ts}), dist=dist, method=method)
+    return climatology.iloc[0].to_dict() | {"fid": fid} if len(climatology) else None
+
+
+def statistics_path(climatology_path: Path) -> Path:
+    """Get the path of the sufficient statistics stored next to a climatologies file."""
+    return climatology_path.with_name(f"{climatology_path.stem}_stats.parquet")
+
+
+def sufficient_statistics(fid: np.ndarray, time: np.ndarray, value: np.ndarray) -> pd.DataFrame:
+    """Get the sufficient statistics of the monthly series of reservoirs.
+
+    Parameters
+    ----------
+    fid : np.ndarray
+        reservoir id of every observation
+    time : np.ndarray
+        datetime64 time of every observation, after the change point of the reservoir
+    value : np.ndarray
+        monthly surface water area of every observation
+
+    Returns
+    -------
+    pd.DataFrame
+        per reservoir the first month after its change point (`start`), the last month included (`last_month`) and
+        the `count_{m}`, `mean_{m}` and `m2_{m}` (sum of squared deviations from the mean) of the values of every
+        calendar month, zero for the months without values
+
+    """
+    valid = np.isfinite(value)
+    fid, value = fid[valid], value[valid]
+    month = time[valid].astype("datetime64[M]").astype(np.int64)
+    fids, reservoir = np.unique(fid, return_inverse=True)
+    group = reservoir * 12 + month % 12
+    n_groups = len(fids) * 12
+    start = np.full(len(fids), np.iinfo(np.int64).max)
+    last_month = np.full(len(fids), np.iinfo(np.int64).min)
+    np.minimum.at(start, reservoir, month)
+    np.maximum.at(last_month, reservoir, month)
+    data = {
+        "fid": fids,
+        "start": start.astype("datetime64[M]").astype("datetime64[s]"),
+        "last_month": last_month.astype("datetime64[M]").astype("datetime64[s]"),
+    }
+    count = np.bincount(group, minlength=n_groups)
+    total = np.bincount(group, weights=value, minlength=n_groups)
+    mean = np.divide(total, count, out=np.zeros_like(total), where=count > 0)
+    statistics = {
+        "count": count,
+        "mean": mean,
+        "m2": np.bincount(group, weights=(value - mean[group]) ** 2, minlength=n_groups),
+    }
+    for name, values in statistics.items():
+        for m in range(1, 13):
+            data[f"{name}_{m}"] = values.reshape(-1, 12)[:, m - 1]
+    return pd.DataFrame(data)
+
+
+def _statistics_shard(shard_path: Path) -> Path:
+    return shard_path.with_name(shard_path.name.replace("shard_", "stats_", 1))
+
+
+def _failed_shard(shard_path: Path) -> Path:
+    return shard_path.with_name(f"{shard_path.stem}_failed.txt")
+
+
+def _write_parquet(df: pd.DataFrame, path: Path) -> None:
+    # write to a temporary file first, so that an interrupted write does not leave a completed file behind
+    tmp_path = path.with_suffix(".tmp")
+    df.to_parquet(tmp_path)
+    tmp_path.replace(path)
+
+
+def _build_shard(
+    fids: list[int],
+    shard_path: Path,
+    start: datetime,
+    stop: datetime,
+    cache_path: Path | None,
+    dist: str = DIST,
+    method: str = "moments",
+    include_zero: bool = INCLUDE_ZERO,
+) -> Path:
+    cache = TimeSeriesCache(cache_path) if cache_path else None
+    reservoirs_ts = {}
+    for fid in fids:
+        try:
+            reservoirs_ts[fid] = get_reservoir_ts(fid, start=start, stop=stop, var_name=VARIABLE, cache=cache)
+        except (requests.RequestException, ValueError) as err:
+            logger.warning("Failed to retrieve time series for reservoir %s: %s", fid, err)
+    # the reservoirs that keep failing are left out of the shard, so that they do not block the build
+    failed = failed_reservoirs(fids, reservoirs_ts)
+    _failed_shard(shard_path).write_text(",".join(str(fid) for fid in failed))
+    fid, time, value = _prepare_series(reservoirs_ts)
+    climatology_df = fit_climatologies(fid, time, value, dist=dist, method=method, include_zero=include_zero)
+    in_climatology = np.isin(fid, climatology_df["fid"].to_numpy())
+    statistics_df = sufficient_statistics(fid[in_climatology], time[in_climatology], value[in_climatology])
+    # the climatology shard is written last, as its presence marks the shard as completed
+    _write_parquet(statistics_df, _statistics_shard(shard_path))
+    _write_parquet(climatology_df, shard_path)
+    return shard_path
+
+
+def _checkpoint_manifest(checkpoint_dir: Path, fids: list[int], shard_size: int) -> None:
+    manifest = {
+        "n_reservoirs": len(fids),
+        "shard_size": shard_size,
+        "reservoirs_sha256": hashlib.sha256(np.asarray(fids, dtype=np.int64).tobytes()).hexdigest(),
+    }
+    manifest_path = checkpoint_dir / "manifest.json"
+    if manifest_path.exists():
+        if json.loads(manifest_path.read_text()) != manifest:
+            err_msg = (
+                f"Checkpoint directory {checkpoint_dir} belongs to a build with other reservoirs or shard size, remove"
+                " it to start a new build"
+            )
+            raise ValueError(err_msg)
+        return
+    manifest_path.write_text(json.dumps(manifest))
+
+
+def build_climatologies(
+    fids: list[int],
+    output_path: Path,
+    checkpoint_dir: Path,
+    start: datetime = START_DATE,
+    stop: datetime | None = None,
+    processes: int | None = None,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    use_cache: bool = True,
+    dist: str = DIST,
+    method: str = "moments",
+    include_zero: bool = INCLUDE_ZERO,
+) -> Path:
+    """Build the climatologies of reservoirs on a process pool, checkpointing the results in shards.
+
+    The reservoirs are split into shards of `shard_size` reservoirs. Every completed shard is written to the checkpoint
+    directory, and shards that are already there are skipped, so an interrupted build resumes from the last completed
+    shards. When all shards are complete they are merged into the climatologies parquet file, with the sufficient
+    statistics of every reservoir next to it for incremental updates with `update_climatologies`.
+
+    Parameters
+    ----------
+    fids : list[int]
+        feature ids of the reservoirs
+    output_path : Path
+        path of the climatologies parquet file to write
+    checkpoint_dir : Path
+        directory to write the completed shards to
+    start : datetime, optional
+        start of the time series to build the climatologies from, by default START_DATE
+    stop : datetime | None, optional
+        end of the time series to build the climatologies from, by default now
+    processes : int | None, optional
+        number of worker processes, by default the number of CPUs
+    shard_size : int, optional
+        number of reservoirs per shard, by default DEFAULT_SHARD_SIZE. Reservoirs for which retrieving the time series
+        fails are left out of their shard and written to a `_failed.txt` reservoir ids file next to the output
+    use_cache : bool, optional
+        read and store the retrieved time series in the local time series cache, by default True
+    dist : str, optional
+        distribution to fit per reservoir and calendar month, by default DIST
+    method : str, optional
+        "moments" to fit all reservoirs of a shard at once with closed-form estimators or "scipy" to fit every
+        reservoir-month with `scipy.stats`, by default "moments"
+    include_zero : bool, optional
+        store the probability of a zero surface water area per reservoir and calendar month and fit the distribution
+        to the non-zero values, by default INCLUDE_ZERO
+
+    Returns
+    -------
+    Path
+        path of the climatologies parquet file
+
+    """
+    stop = stop or datetime.now()
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    _checkpoint_manifest(checkpoint_dir, fids, shard_size)
+    shards = {
+        checkpoint_dir / f"shard_{i // shard_size:05d}.parquet": fids[i : i + shard_size]
+        for i in range(0, len(fids), shard_size)
+    }
+    todo = {
+        shard_path: shard_fids
+        for shard_path, shard_fids in shards.items()
+        if not (shard_path.exists() and _statistics_shard(shard_path).exists())
+    }
+    logger.info(
+        "Building climatologies for %s reservoirs, %s of %s shards already completed",
+        len(fids),
+        len(shards) - len(todo),
+        len(shards),
+    )
+    cache_path = TIMESERIES_CACHE if use_cache else None
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [
+            executor.submit(_build_shard, shard_fids, shard_path, start, stop, cache_path, dist, method, include_zero)
+            for shard_path, shard_fids in todo.items()
+        ]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            future.result()
+
+    climatology_df = pd.concat([pd.read_parquet(shard_path) for shard_path in shards], ignore_index=True)
+    statistics_df = pd.concat(
+        [pd.read_parquet(_statistics_shard(shard_path)) for shard_path in shards],
+        ignore_index=True,
+    )
+    climatology_df.to_parquet(output_path)
+    statistics_df.to_parquet(statistics_path(output_path))
+    failed_paths = [_failed_shard(shard_path) for shard_path in shards]
+    failed = [fid for path in failed_paths if path.exists() for fid in path.read_text().split(",") if fid]
+    failed_path = output_path.with_name(f"{output_path.stem}_failed.txt")
+    if failed:
+        failed_path.write_text(",".join(failed))
+        logger.warning("Retrieving the time series failed for %s reservoirs, written to %s", len(failed), failed_path)
+    else:
+        failed_path.unlink(missing_ok=True)
+    logger.info("Wrote climatologies of %s reservoirs to %s", len(climatology_df), output_path)
+    return output_path
+
+
+def update_climatologies(
+    climatology_path: Path,
+    month: datetime,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    use_cache: bool = True,
+) -> Path:
+    """Fold the monthly surface water area of one month into the climatologies.
+
+    The month is added to the stored sufficient statistics of every reservoir that has not included it yet, after
+    which only the `mean_{m}` and `std_{m}` entries of that calendar month are recomputed for those reservoirs. Other
+    distribution parameters are left unchanged.
+
+    Parameters
+    ----------
+    climatology_path : Path
+        climatologies parquet file, with its sufficient statistics next to it
+    month : datetime
+        datetime in the month to add
+    concurrency : int, optional
+        number of concurrent requests to the GWW API, by default DEFAULT_CONCURRENCY
+    use_cache : bool, optional
+        read and store the retrieved time series in the local time series cache, by default True
+
+    Returns
+    -------
+    Path
+        path of the updated climatologies parquet file
+
+    """
+    climatologies = pd.read_parquet(climatology_path)
+    statistics = pd.read_parquet(statistics_path(climatology_path))
+    start = datetime(month.year, month.month, 1)
+    stop = get_month_range(start, start)[1]
+    month64 = np.datetime64(start, "s")
+    pending = statistics.loc[(statistics["last_month"] < month64) & (statistics["start"] <= month64), "fid"]
+    logger.info("Adding %s to the climatologies of %s reservoirs", start.strftime("%Y-%m"), len(pending))
+    reservoirs_ts = get_reservoirs_ts(
+        pending.to_list(),
+        start,
+        stop,
+        var_name=VARIABLE,
+        concurrency=concurrency,
+        cache=TimeSeriesCache() if use_cache else None,
+    )
+    fid, time, value = observations_to_arrays(reservoirs_ts)
+    in_month = (time >= month64) & (time < np.datetime64(stop, "s"))
+    fids, _, monthly_value = monthly_means(fid[in_month], time[in_month], value[in_month])
+
+    m = start.month
+    # get_indexer gives positions, not index labels, and -1 for reservoirs that are not in the table
+    rows = pd.Index(statistics["fid"]).get_indexer(fids)
+    fids, rows, monthly_value = fids[rows >= 0], rows[rows >= 0], monthly_value[rows >= 0]
+    count_column, mean_column, m2_column, last_month_column = statistics.columns.get_indexer(
+        [f"count_{m}", f"mean_{m}", f"m2_{m}", "last_month"],
+    )
+    # Welford's update keeps the sum of squared deviations, which unlike sum(x**2) / n - mean**2 does not cancel
+    count = statistics.iloc[rows, count_column].to_numpy() + 1
+    delta = monthly_value - statistics.iloc[rows, mean_column].to_numpy()
+    mean = statistics.iloc[rows, mean_column].to_numpy() + delta / count
+    m2 = statistics.iloc[rows, m2_column].to_numpy() + delta * (monthly_value - mean)
+    statistics.iloc[rows, count_column] = count
+    statistics.iloc[rows, mean_column] = mean
+    statistics.iloc[rows, m2_column] = m2
+    statistics.iloc[rows, last_month_column] = month64
+    std = np.sqrt(m2 / count)
+
+    rows = pd.Index(climatologies["fid"]).get_indexer(fids)
+    if (rows < 0).any():
+        logger.warning("%s reservoirs with statistics are not in the climatologies, skipping them", (rows < 0).sum())
+    mean_column, std_column = climatologies.columns.get_indexer([f"mean_{m}", f"std_{m}"])
+    climatologies.iloc[rows[rows >= 0], mean_column] = mean[rows >= 0]
+    climatologies.iloc[rows[rows >= 0], std_column] = std[rows >= 0]
+    _write_parquet(statistics, statistics_path(climatology_path))
+    _write_parquet(climatologies, climatology_path)
+    logger.info("Updated the %s climatologies of %s reservoirs", start.strftime("%B"), len(fids))
+    return climatology_path
+
+
+def _reservoir_ids_from_locations(reservoir_locations_fp: Path) -> list[int]:
+    import geopandas as gpd
+
+    if not reservoir_locations_fp.exists():
+        download_reservoir_geometries(reservoir_locations_fp)
+    reservoir_locations = gpd.read_file(reservoir_locations_fp, columns=["feature_id"], ignore_geometry=True)
+    return reservoir_locations["feature_id"].iloc[SKIP_RESERVOIRS:].astype(int).to_list()
+
+
+parser = argparse.ArgumentParser(description="Build or update reservoir climatologies from the GWW API time series.")
+parser.add_argument(
+    "-d",
+    "--data-dir",
+    help="Directory with the reservoir locations and climatologies files. By default './gww-anomalies/data'",
+)
+parser.add_argument(
+    "--cache",
+    help="Read and store retrieved time series in the local time series cache",
+    action=argparse.BooleanOptionalAction,
+    default=True,
+)
+subparsers = parser.add_subparsers(dest="command", required=True)
+build_parser = subparsers.add_parser("build", help="Build the climatologies of all reservoirs from scratch")
+build_parser.add_argument(
+    "-r",
+    "--reservoir_ids_file",
+    help="Text file containing reservoir fids seperated by commas and on one line, by default all reservoirs in the"
+    " reservoir locations file",
+)
+build_parser.add_argument(
+    "-p",
+    "--processes",
+    type=int,
+    help="Number of worker processes, by default the number of CPUs",
+)
+build_parser.add_argument(
+    "--shard-size",
+    type=int,
+    default=DEFAULT_SHARD_SIZE,
+    help=f"Number of reservoirs per checkpointed shard, by default {DEFAULT_SHARD_SIZE}",
+)
+build_parser.add_argument(
+    "--checkpoint-dir",
+    help="Directory to checkpoint completed shards to, by default 'climatology_shards' in the data directory. An"
+    " interrupted build resumes from the shards in this directory.",
+)
+build_parser.add_argument(
+    "--dist",
+    choices=list(DIST_PARAMETERS),
+    default=DIST,
+    help=f"Distribution to fit per reservoir and calendar month, by default {DIST}",
+)
+build_parser.add_argument(
+    "--method",
+    choices=FIT_METHODS,
+    default="moments",
+    help="Fit all reservoirs at once with closed-form estimators ('moments', the default) or fit every reservoir-month"
+    " separately with scipy.stats ('scipy')",
+)
+build_parser.add_argument(
+    "--include-zero",
+    action="store_true",
+    help="Store the probability of a zero surface water area per reservoir and calendar month and fit the distribution"
+    " to the non-zero values only, for the standardized index of reservoirs that run dry",
+)
+update_parser = subparsers.add_parser("update", help="Add one month of data to the existing climatologies")
+update_parser.add_argument(
+    "-m",
+    "--month",
+    required=True,
+    help="Month to add to the climatologies, in 'mm-dd-YYYY' format",
+)
+update_parser.add_argument(
+    "-c",
+    "--concurrency",
+    type=int,
+    default=DEFAULT_CONCURRENCY,
+    help=f"Number of concurrent requests to the GWW API, by default {DEFAULT_CONCURRENCY}",
+)
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Build or update the climatologies file from the command line."""
+    args = parser.parse_args(argv)
+    data_dir = Path(args.data_dir) if args.data_dir else Path(__file__).parent.parent / "data"
+    climatology_path = data_dir / "climatologies.parquet"
+    if args.command == "update":
+        update_climatologies(
+            climatology_path,
+            month=parse_date(args.month),
+            concurrency=args.concurrency,
+            use_cache=args.cache,
+        )
+        return
+    if args.reservoir_ids_file:
+        fids = _parse_reservoir_ids_file(fp=args.reservoir_ids_file)
+    else:
+        fids = _reservoir_ids_from_locations(data_dir / "reservoirs-locations-v1.0.gpkg")
+    checkpoint_dir = Path(args.checkpoint_dir) if args.checkpoint_dir else data_dir / "climatology_shards"
+    build_climatologies(
+        fids=fids,
+        output_path=climatology_path,
+        checkpoint_dir=checkpoint_dir,
+        processes=args.processes or os.cpu_count(),
+        shard_size=args.shard_size,
+        use_cache=args.cache,
+        dist=args.dist,
+        method=args.method,
+        include_zero=args.include_zero,
+    )
+
+
+if __name__ == "__main__":
+    main()
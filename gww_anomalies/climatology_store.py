@@ -0,0 +1,146 @@
+"""Column-projected and memory-mapped access to the reservoir climatologies."""
+
+from __future__ import annotations
+
+import json
+import shutil
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pyarrow.parquet as pq
+
+from gww_anomalies import CACHE_PATH
+from gww_anomalies.climatology import DIST_PARAMETERS
+from gww_anomalies.kernel import MONTHS, ClimatologyIndex
+from gww_anomalies.log import setup_log
+from gww_anomalies.standard_index import DistributionIndex, climatology_dist
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+    from pathlib import Path
+
+logger = setup_log(__name__)
+
+CLIMATOLOGY_CACHE: Path = CACHE_PATH / "climatologies"
+
+
+def _source_fingerprint(climatology_path: Path) -> list:
+    stat = climatology_path.stat()
+    return [str(climatology_path.resolve()), stat.st_size, stat.st_mtime_ns]
+
+
+class ClimatologyStore:
+    """Climatologies file that is read one calendar month at a time.
+
+    Without `cache_dir`, only the `fid` column and the `mean_{m}` and `std_{m}` columns of the requested months are
+    read from the parquet file. With `cache_dir`, the climatologies are converted once to a compact form: the sorted
+    fids in `fid.npy` and a float32 (month x parameter x reservoir) array in `parameters.npy`, in which the means and
+    standard deviations of a month are contiguous. Both are memory-mapped, so a run only pages in the months it uses.
+    The compact form is converted again when the climatologies file changes.
+
+    Parameters
+    ----------
+    path : Path
+        climatologies parquet file with `fid`, `mean_{m}` and `std_{m}` columns
+    cache_dir : Path | None, optional
+        directory of the compact, memory-mapped form of the climatologies, by default None which reads the parquet
+        file directly
+
+    """
+
+    def __init__(self, path: Path, cache_dir: Path | None = None) -> None:
+        self.path = path
+        self.cache_dir = cache_dir
+        self._fid: np.ndarray | None = None
+        self._parameters: np.ndarray | None = None
+        if cache_dir is not None:
+            fingerprint = _source_fingerprint(path)
+            source_path = cache_dir / "source.json"
+            if not source_path.exists() or json.loads(source_path.read_text()) != fingerprint:
+                self._convert(fingerprint)
+            self._fid = np.load(cache_dir / "fid.npy", mmap_mode="r")
+            self._parameters = np.load(cache_dir / "parameters.npy", mmap_mode="r")
+
+    def _convert(self, fingerprint: list) -> None:
+        logger.info("Converting climatologies %s to %s", self.path, self.cache_dir)
+        table = pq.read_table(self.path)
+        fid = table["fid"].to_numpy().astype(np.int64)
+        order = np.argsort(fid, kind="stable")
+        parameters = np.empty((len(MONTHS), 2, len(fid)), dtype=np.float32)
+        for i, m in enumerate(MONTHS):
+            parameters[i, 0] = table[f"mean_{m}"].to_numpy()[order]
+            parameters[i, 1] = table[f"std_{m}"].to_numpy()[order]
+        # the source is recorded last, so that an interrupted conversion is converted again
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        self.cache_dir.mkdir(parents=True)
+        np.save(self.cache_dir / "fid.npy", fid[order])
+        np.save(self.cache_dir / "parameters.npy", parameters)
+        (self.cache_dir / "source.json").write_text(json.dumps(fingerprint))
+
+    def fids(self) -> np.ndarray:
+        """Get the sorted ids of the reservoirs with climatology, reading only the `fid` column."""
+        if self._fid is not None:
+            return np.asarray(self._fid)
+        return np.sort(pq.read_table(self.path, columns=["fid"])["fid"].to_numpy().astype(np.int64))
+
+    def index(self, months: Iterable[int] = MONTHS) -> ClimatologyIndex:
+        """Get a climatology index holding the parameters of the given calendar months only.
+
+        Parameters
+        ----------
+        months : Iterable[int], optional
+            calendar months (1-12) to read the climatology of, by default MONTHS
+
+        Returns
+        -------
+        ClimatologyIndex
+            index sorted by fid, with float32 parameters when read from the compact form
+
+        """
+        months = sorted(set(months))
+        if self._parameters is not None:
+            parameters = self._parameters[[m - 1 for m in months]]
+            return ClimatologyIndex(self._fid, parameters[:, 0].T, parameters[:, 1].T, months=months)
+        columns = [f"{parameter}_{m}" for parameter in ("mean", "std") for m in months]
+        table = pq.read_table(self.path, columns=["fid", *columns])
+        return ClimatologyIndex(
+            fid=table["fid"].to_numpy(),
+            mean=np.column_stack([table[f"mean_{m}"].to_numpy() for m in months]),
+            std=np.column_stack([table[f"std_{m}"].to_numpy() for m in months]),
+            months=months,
+        )
+
+    def distribution_index(self, months: Iterable[int] = MONTHS) -> DistributionIndex:
+        """Get an index of the fitted distributions of the given calendar months, for standardized indices.
+
+        The distribution is taken from the columns of the climatologies file. Only the columns of its parameters and
+        of the probabilities of zero values of the requested months are read from the parquet file, also when the
+        compact form is used for the means and standard deviations.
+
+        Parameters
+        ----------
+        months : Iterable[int], optional
+            calendar months (1-12) to read the distributions of, by default MONTHS
+
+        Returns
+        -------
+        DistributionIndex
+            index sorted by fid
+
+        """
+        months = sorted(set(months))
+        names = pq.read_schema(self.path).names
+        dist = climatology_dist(names)
+        parameters = sorted({"mean", "std", *DIST_PARAMETERS[dist]}) + (["p_zero"] if "p_zero_1" in names else [])
+        table = pq.read_table(self.path, columns=["fid", *(f"{p}_{m}" for p in parameters for m in months)])
+        arrays = {p: np.column_stack([table[f"{p}_{m}"].to_numpy() for m in months]) for p in parameters}
+        p_zero = arrays.pop("p_zero", None)
+        return DistributionIndex(
+            fid=table["fid"].to_numpy(),
+            mean=arrays.pop("mean"),
+            std=arrays.pop("std"),
+            dist=dist,
+            parameters=arrays,
+            p_zero=p_zero,
+            months=months,
+        )
@@ -0,0 +1,206 @@
+"""Dense reservoir x month store of the anomalies, memory-mapped for slicing by reservoir or by month."""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from gww_anomalies.log import setup_log
+
+if TYPE_CHECKING:
+    from datetime import datetime
+
+    import pandas as pd
+
+logger = setup_log(__name__)
+
+VARIABLES: tuple[str, ...] = ("monthly_surface_area", "anomaly")
+MONTH_BLOCK: int = 12  # months are allocated a year at a time, so that appending a month rarely grows the arrays
+METADATA = "cube.json"
+PENDING_METADATA = "cube.pending.json"
+
+
+class AnomalyCube:
+    """Monthly surface water area and anomaly of all reservoirs and months, in dense memory-mapped arrays.
+
+    The store is a directory with the sorted fids of the reservoir axis in `fid.npy`, a float32 (month x reservoir)
+    array per variable in `<variable>.npy` and the first month and the number of months in `cube.json`. A month of all
+    reservoirs is a contiguous row, so that a run writes only the pages of its months, and the history of a reservoir
+    is a column. Both are read without loading the rest of the cube. Reservoir-months without anomalies are NaN.
+
+    The arrays are reallocated when new reservoirs are written or a month falls outside the allocated months, which
+    are allocated MONTH_BLOCK months at a time. The reallocated arrays are written to temporary files first, and are
+    moved into place once the metadata of the new arrays is written, so that an interrupted reallocation either leaves
+    the previous cube or is completed when the cube is opened again. The store is not safe for concurrent writers.
+
+    Parameters
+    ----------
+    path : Path
+        directory of the store, created on the first write
+
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.start: np.datetime64 | None = None
+        self.n_months = 0
+        self.fid = np.empty(0, dtype=np.int64)
+        self._arrays: dict[str, np.ndarray] = {}
+        self._commit()
+        if (self.path / METADATA).exists():
+            self._open("r")
+
+    def _write_metadata(self, start: np.datetime64, n_months: int, name: str = METADATA) -> None:
+        tmp_path = self.path / f"{name}.tmp"
+        tmp_path.write_text(json.dumps({"start": str(start), "n_months": n_months}))
+        tmp_path.replace(self.path / name)
+
+    def _commit(self) -> None:
+        # moves the arrays of a reallocation into place, the metadata last, once all of them have been written
+        if not (self.path / PENDING_METADATA).exists():
+            return
+        for name in (*VARIABLES, "fid"):
+            tmp_path = self.path / f"{name}.tmp.npy"
+            if tmp_path.exists():
+                tmp_path.replace(self.path / f"{name}.npy")
+        (self.path / PENDING_METADATA).replace(self.path / METADATA)
+
+    def _open(self, mode: str) -> None:
+        metadata = json.loads((self.path / METADATA).read_text())
+        self.start = np.datetime64(metadata["start"], "M")
+        self.n_months = metadata["n_months"]
+        self.fid = np.load(self.path / "fid.npy")
+        self._arrays = {variable: np.load(self.path / f"{variable}.npy", mmap_mode=mode) for variable in VARIABLES}
+        for variable, array in self._arrays.items():
+            if array.shape[1] != len(self.fid) or array.shape[0] < self.n_months:
+                err_msg = (
+                    f"Anomaly cube {self.path} is inconsistent: {variable}.npy has shape {array.shape} for"
+                    f" {len(self.fid)} reservoirs and {self.n_months} months"
+                )
+                raise ValueError(err_msg)
+
+    @property
+    def months(self) -> np.ndarray:
+        """Get the datetime64[M] months of the month axis."""
+        if self.start is None:
+            return np.empty(0, dtype="datetime64[M]")
+        return np.arange(self.start, self.start + self.n_months)
+
+    def locate(self, fids: np.ndarray) -> np.ndarray:
+        """Get the positions of reservoir ids on the reservoir axis, or -1 for reservoirs that are not in the cube."""
+        fids = np.asarray(fids, dtype=np.int64)
+        positions = np.searchsorted(self.fid, fids)
+        positions[positions == len(self.fid)] = 0
+        found = self.fid[positions] == fids if len(self.fid) else np.zeros(len(fids), dtype=bool)
+        return np.where(found, positions, -1)
+
+    def reservoir(self, fid: int, variable: str = "anomaly") -> np.ndarray:
+        """Get the series of a variable of one reservoir over all months of the cube.
+
+        Raises
+        ------
+        KeyError
+            if the reservoir is not in the cube
+
+        """
+        position = self.locate([fid])[0]
+        if position < 0:
+            err_msg = f"Reservoir {fid} is not in the anomaly cube"
+            raise KeyError(err_msg)
+        return self._arrays[variable][: self.n_months, position]
+
+    def month(self, month: datetime | np.datetime64 | str, variable: str = "anomaly") -> np.ndarray:
+        """Get a variable of all reservoirs of the cube, in the order of `fid`, for one month.
+
+        Raises
+        ------
+        KeyError
+            if the month is not in the cube
+
+        """
+        month = np.datetime64(month, "M")
+        if self.start is None or not 0 <= (i := int((month - self.start).astype(np.int64))) < self.n_months:
+            err_msg = f"Month {month} is not in the anomaly cube"
+            raise KeyError(err_msg)
+        return self._arrays[variable][i]
+
+    def read(self, variable: str = "anomaly") -> np.ndarray:
+        """Get the memory-mapped (month x reservoir) array of a variable, without reading it."""
+        return self._arrays[variable][: self.n_months] if self._arrays else np.empty((0, 0), dtype=np.float32)
+
+    def _allocate(self, fids: np.ndarray, start: np.datetime64, n_months: int) -> None:
+        capacity = -(-n_months // MONTH_BLOCK) * MONTH_BLOCK
+        logger.info("Allocating an anomaly cube of %s months for %s reservoirs in %s", capacity, len(fids), self.path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        rows = np.searchsorted(fids, self.fid)
+        offset = int((self.start - start).astype(np.int64)) if self.start is not None else 0
+        for variable in VARIABLES:
+            tmp_path = self.path / f"{variable}.tmp.npy"
+            array = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(capacity, len(fids)))
+            array[:] = np.nan
+            if self.n_months:
+                array[offset : offset + self.n_months, rows] = self._arrays[variable][: self.n_months]
+            array.flush()
+            del array
+        np.save(self.path / "fid.tmp.npy", fids)
+        self._arrays = {}
+        # the pending metadata marks the temporary files as complete, from then on the reallocation is rolled forward
+        self._write_metadata(start, offset + self.n_months, PENDING_METADATA)
+        self._commit()
+
+    def write(self, fid: np.ndarray, month: np.ndarray, values: dict[str, np.ndarray]) -> None:
+        """Write the variables of reservoir-months to the cube, overwriting only those reservoir-months.
+
+        Parameters
+        ----------
+        fid : np.ndarray
+            reservoir id of every value
+        month : np.ndarray
+            datetime64 month of every value
+        values : dict[str, np.ndarray]
+            values per variable in VARIABLES
+
+        """
+        fid = np.asarray(fid, dtype=np.int64)
+        month = np.asarray(month).astype("datetime64[M]")
+        if not len(fid):
+            return
+        fids = np.union1d(self.fid, fid)
+        start = month.min() if self.start is None else min(self.start, month.min())
+        stop = month.max() + 1 if self.start is None else max(self.start + self.n_months, month.max() + 1)
+        n_months = int((stop - start).astype(np.int64))
+        capacity = len(self._arrays[VARIABLES[0]]) if self._arrays else 0
+        if len(fids) != len(self.fid) or start != self.start or n_months > capacity:
+            self._allocate(fids, start, n_months)
+        self._open("r+")
+        rows = np.searchsorted(self.fid, fid)
+        columns = (month - start).astype(np.int64)
+        for variable in VARIABLES:
+            self._arrays[variable][columns, rows] = values[variable]
+            self._arrays[variable].flush()
+        # the number of months is recorded last, so that an interrupted write does not extend the month axis
+        self._write_metadata(start, n_months)
+        self._open("r")
+
+    def update(self, anomalies_df: pd.DataFrame, month: datetime | None = None) -> None:
+        """Write anomalies as returned by `calculate_anomalies` or `calculate_monthly_anomalies` to the cube.
+
+        Parameters
+        ----------
+        anomalies_df : pd.DataFrame
+            anomalies with `fid`, `monthly_surface_area` and `anomaly` columns, and a `month` column unless `month`
+            is given
+        month : datetime | None, optional
+            month of all anomalies, by default None which takes the month of every row from its `month` column
+
+        """
+        months = anomalies_df["month"].to_numpy() if month is None else np.full(len(anomalies_df), np.datetime64(month))
+        self.write(
+            anomalies_df["fid"].to_numpy(),
+            months,
+            {variable: anomalies_df[variable].to_numpy() for variable in VARIABLES},
+        )
+        logger.info("Wrote %s reservoir-months to the anomaly cube %s", len(anomalies_df), self.path)
@@ -0,0 +1,51 @@
+"""Decoding of GWW API responses into columnar NumPy arrays."""
+
+from __future__ import annotations
+
+import json
+from itertools import chain
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(body: bytes) -> object:
+    """Parse a JSON response body, with orjson when it is installed and with the standard library otherwise."""
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def decode_source_data(body: bytes) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Decode the time series of many reservoirs, as returned by the `/ts` endpoint, to one columnar table.
+
+    The observations of all reservoirs are converted at once, so that the dictionaries parsed from the body can be
+    released as soon as the response is decoded.
+
+    Parameters
+    ----------
+    body : bytes
+        body of a `/ts` response, with the time series per reservoir id in `source_data`
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+        int32 ids of the reservoirs in the response, including those without observations, and the int32 reservoir
+        ids, datetime64 times and float64 values (NaN when missing) of all observations
+
+    Raises
+    ------
+    KeyError
+        if the response has no `source_data`
+
+    """
+    source_data = loads(body)["source_data"] or {}
+    fids = np.array([int(fid) for fid in source_data], dtype=np.int32)
+    counts = np.fromiter(map(len, source_data.values()), dtype=np.int64, count=len(source_data))
+    observations = list(chain.from_iterable(source_data.values()))
+    time = np.array([obs["t"] for obs in observations], dtype="datetime64[s]")
+    # None values become NaN
+    value = np.array([obs["value"] for obs in observations], dtype=np.float64)
+    return fids, np.repeat(fids, counts), time, value
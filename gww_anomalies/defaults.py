@@ -0,0 +1,12 @@
+"""Default settings of the anomaly run, kept free of heavy imports so that the CLI starts quickly."""
+
+DEFAULT_CONCURRENCY: int = 16
+DEFAULT_CHUNK_SIZE: int = 5_000
+
+FORMATS: dict[str, str] = {
+    "csv": ".csv",
+    "geojson": ".geojson",
+    "geoparquet": ".parquet",
+    "fgb": ".fgb",
+    "arrow": ".arrow",
+}
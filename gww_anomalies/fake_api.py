@@ -0,0 +1,245 @@
+"""Local stand-in for the GWW API serving synthetic reservoir time series."""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from gww_anomalies.log import setup_log
+
+logger = setup_log(__name__)
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+OBSERVATION_INTERVAL = timedelta(days=5)
+
+
+def synthetic_series(reservoir_id: int, start: datetime, stop: datetime, var_name: str) -> list[dict]:
+    """Generate a deterministic seasonal surface water area series for a reservoir.
+
+    Parameters
+    ----------
+    reservoir_id : int
+        feature id of the reservoir, used to seed the series
+    start : datetime
+        start of the requested period
+    stop : datetime
+        end of the requested period
+    var_name : str
+        name of the requested variable
+
+    Returns
+    -------
+    list[dict]
+        observations in the same layout as the GWW API
+
+    """
+    base = 1e6 + (reservoir_id % 1000) * 1e5
+    observations = []
+    t = start
+    while t < stop:
+        rng = random.Random(reservoir_id * 100_003 + t.toordinal())  # noqa: S311
+        season = 1 + 0.3 * math.sin(2 * math.pi * t.timetuple().tm_yday / 365.25)
+        observations.append(
+            {
+                "t": t.strftime(DATE_FORMAT),
+                "value": base * season * (1 + rng.gauss(0, 0.05)),
+                "name": var_name,
+                "unit": "m2",
+            },
+        )
+        t += OBSERVATION_INTERVAL
+    return observations
+
+
+def monthly_series(reservoir_id: int, start: datetime, stop: datetime, var_name: str) -> list[dict]:
+    """Aggregate the synthetic series of a reservoir to monthly means, as the `/ts` endpoint does."""
+    months: dict[str, list[float]] = {}
+    for observation in synthetic_series(reservoir_id, start, stop, var_name):
+        months.setdefault(observation["t"][:7], []).append(observation["value"])
+    return [
+        {"t": f"{month}-01T00:00:00", "value": sum(values) / len(values), "name": var_name, "unit": "m2"}
+        for month, values in months.items()
+    ]
+
+
+class InFlight:
+    """Thread-safe count of the requests being served and the peak count, as a context manager around a request."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> None:
+        """Count a request that is being served."""
+        with self._lock:
+            self.count += 1
+            self.peak = max(self.peak, self.count)
+
+    def __exit__(self, *exc_info: object) -> None:
+        """Stop counting the request when it has been answered."""
+        with self._lock:
+            self.count -= 1
+
+
+class FakeGWWHandler(BaseHTTPRequestHandler):
+    """Request handler mimicking the GWW API reservoir time series endpoints.
+
+    Only reservoirs with an id from 1 up to and including `n_reservoirs` have data, when `n_reservoirs` is set.
+    Requests including one of the `failing_ids` are answered with a server error. To inject faults, a fraction
+    `error_rate` of the requests is answered with a 503 error, and requests beyond `capacity` concurrent requests are
+    rejected with a 429 error. The requests being served are counted in `in_flight`.
+    """
+
+    protocol_version = "HTTP/1.1"
+    latency: float = 0.0
+    failing_ids: frozenset[int] = frozenset()
+    n_reservoirs: int | None = None
+    error_rate: float = 0.0
+    slots: threading.BoundedSemaphore | None = None
+    in_flight: InFlight = InFlight()
+
+    def do_GET(self) -> None:
+        """Serve a request, injecting throttling and errors."""
+        with self.in_flight:
+            self._serve()
+
+    def _serve(self) -> None:
+        if self.slots is not None and not self.slots.acquire(blocking=False):
+            self._send_json(429, {"detail": "Too Many Requests"})
+            return
+        try:
+            time.sleep(self.latency)
+            if random.random() < self.error_rate:  # noqa: S311
+                self._send_json(503, {"detail": "Service Unavailable"})
+                return
+            self._serve_ts()
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+
+    def _serve_ts(self) -> None:
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        if len(parts) == 4 and parts[0] == "reservoir" and parts[2] == "ts":  # noqa: PLR2004
+            reservoir_ids = [int(parts[1])]
+        elif parts == ["ts"]:
+            reservoir_ids = [int(x) for x in query.get("reservoir_ids", [])]
+        else:
+            self._send_json(404, {"detail": "Not Found"})
+            return
+        if self.failing_ids.intersection(reservoir_ids):
+            self._send_json(500, {"detail": "Internal Server Error"})
+            return
+        if self.n_reservoirs is not None:
+            reservoir_ids = [fid for fid in reservoir_ids if 1 <= fid <= self.n_reservoirs]
+        start = datetime.strptime(query["start"][0], DATE_FORMAT)  # noqa: DTZ007
+        stop = datetime.strptime(query["stop"][0], DATE_FORMAT)  # noqa: DTZ007
+        if parts == ["ts"]:
+            variable = query["variable_name"][0]
+            source_data = {str(fid): monthly_series(fid, start, stop, variable) for fid in reservoir_ids}
+            self._send_json(200, {"source_data": {k: v for k, v in source_data.items() if v} or None})
+        elif not reservoir_ids:
+            self._send_json(200, [])
+        elif parts[3].endswith("_monthly"):
+            self._send_json(200, monthly_series(reservoir_ids[0], start, stop, parts[3]))
+        else:
+            self._send_json(200, synthetic_series(reservoir_ids[0], start, stop, parts[3]))
+
+    def _send_json(self, status: int, body: list | dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        """Silence the per-request access log."""
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    latency: float = 0.0,
+    failing_ids: set[int] | None = None,
+    error_rate: float = 0.0,
+    capacity: int | None = None,
+    n_reservoirs: int | None = None,
+) -> ThreadingHTTPServer:
+    """Start the fake GWW API in a background thread.
+
+    Parameters
+    ----------
+    host : str, optional
+        host to bind to, by default "127.0.0.1"
+    port : int, optional
+        port to bind to, by default 0 which picks a free port
+    latency : float, optional
+        seconds to wait before answering each request, by default 0.0
+    failing_ids : set[int] | None, optional
+        reservoir ids for which every request fails with a server error, by default None
+    error_rate : float, optional
+        fraction of requests that randomly fail with a 503 error, by default 0.0
+    capacity : int | None, optional
+        maximum number of concurrent requests, further requests fail with a 429 error. By default None, which serves
+        any number of concurrent requests
+    n_reservoirs : int | None, optional
+        number of reservoirs with data, with ids from 1 up to and including `n_reservoirs`. By default None, which
+        serves data for any reservoir id
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        the running server, call `shutdown()` to stop it
+
+    """
+    attributes = {
+        "latency": latency,
+        "failing_ids": frozenset(failing_ids or ()),
+        "n_reservoirs": n_reservoirs,
+        "error_rate": error_rate,
+        "slots": threading.BoundedSemaphore(capacity) if capacity else None,
+        "in_flight": InFlight(),
+    }
+    handler = type("Handler", (FakeGWWHandler,), attributes)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info("Serving fake GWW API on http://%s:%s", *server.server_address[:2])
+    return server
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--host", default="127.0.0.1", help="Host to bind the fake API to")
+parser.add_argument("--port", type=int, default=8000, help="Port to bind the fake API to")
+parser.add_argument("--latency", type=float, default=0.2, help="Seconds to wait before answering each request")
+parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with a 503 error")
+parser.add_argument("--capacity", type=int, help="Maximum number of concurrent requests before answering with 429")
+parser.add_argument("--reservoirs", type=int, help="Number of reservoirs with data, by default any reservoir id")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    server = serve(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        capacity=args.capacity,
+        n_reservoirs=args.reservoirs,
+    )
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
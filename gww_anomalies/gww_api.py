@@ -2,36 +2,297 @@
 
 from __future__ import annotations
 
-import logging
+import os
+import random
+import threading
 import time
-from datetime import datetime
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, TypeVar
 
+import numpy as np
 import requests
-import tqdm
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
 
+from gww_anomalies.decode import decode_source_data, loads
+from gww_anomalies.defaults import DEFAULT_CONCURRENCY
+from gww_anomalies.kernel import observations_to_arrays
+from gww_anomalies.log import setup_log
+from gww_anomalies.metrics import metrics
 from gww_anomalies.utils import get_month_interval
 
-base_url = "https://api.globalwaterwatch.earth"
+if TYPE_CHECKING:
+    from collections.abc import Callable, Collection, Iterator
+
+    from gww_anomalies.cache import TimeSeriesCache
+
+logger = setup_log(__name__)
+
+T = TypeVar("T")
+
+base_url = os.environ.get("GWW_API_URL", "https://api.globalwaterwatch.earth")
+
+REQUEST_TIMEOUT: int = 120
+DEFAULT_BATCH_SIZE: int = 50
+MAX_BATCH_SIZE: int = 1000
+TARGET_RESPONSE_TIME: float = 10.0
+MAX_RESPONSE_BYTES: int = 10_000_000
+INITIAL_CONCURRENCY: int = 4
+MAX_RETRIES: int = 5
+BACKOFF_BASE: float = 0.5
+MAX_BACKOFF: float = 30.0
+OVERLOAD_STATUS: frozenset[int] = frozenset({429})
+TRANSIENT_STATUS: frozenset[int] = frozenset({429, 502, 503, 504})
+RETRY_STATUS: frozenset[int] = TRANSIENT_STATUS | {500}
+
+_session: requests.Session | None = None
+_session_pool_size: int = 0
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size: int = DEFAULT_CONCURRENCY) -> requests.Session:
+    """Get the shared HTTP session used for all API calls.
+
+    The session keeps connections alive between requests. When a larger connection pool than the current one is
+    requested, the adapters are replaced so that every worker thread can hold its own connection.
+
+    Parameters
+    ----------
+    pool_size : int, optional
+        minimum number of pooled connections per host, by default DEFAULT_CONCURRENCY
+
+    """
+    global _session, _session_pool_size  # noqa: PLW0603
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+        if pool_size > _session_pool_size:
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+            _session_pool_size = pool_size
+        return _session
+
+
+class AIMDLimiter:
+    """Limit the number of requests in flight with additive increase and multiplicative decrease (AIMD).
+
+    The limit starts at `initial` and grows by one for every successful response until the API signals the first
+    overload. From then on it grows by one per `limit` successful responses, roughly one per round trip, as long as
+    responses take less than `target_latency` seconds. On an overload response (429) the limit is multiplied
+    by `decrease`, at most once per round of requests in flight, so that one burst of rejections halves the limit once.
+
+    Parameters
+    ----------
+    initial : int, optional
+        initial number of requests in flight, by default INITIAL_CONCURRENCY
+    minimum : int, optional
+        minimum number of requests in flight, by default 1
+    maximum : int, optional
+        maximum number of requests in flight, by default DEFAULT_CONCURRENCY
+    target_latency : float, optional
+        response time in seconds up to which the limit is increased, by default TARGET_RESPONSE_TIME
+    decrease : float, optional
+        factor to multiply the limit with on overload, by default 0.5
+
+    """
+
+    def __init__(
+        self,
+        initial: int = INITIAL_CONCURRENCY,
+        minimum: int = 1,
+        maximum: int = DEFAULT_CONCURRENCY,
+        target_latency: float = TARGET_RESPONSE_TIME,
+        decrease: float = 0.5,
+    ) -> None:
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.decrease = decrease
+        self.in_flight = 0
+        self._slow_start = True
+        self._generation = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> int:
+        """Wait until a request may be sent, returning a token to pass to `release`."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            return self._generation
+
+    def release(self, token: int, latency: float, overloaded: bool = False) -> None:
+        """Release the slot of a completed request and adapt the limit to its latency and outcome."""
+        with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                # only requests sent after the last decrease may decrease the limit again
+                if token == self._generation:
+                    self.limit = max(float(self.minimum), self.limit * self.decrease)
+                    self._generation += 1
+                    self._slow_start = False
+            elif latency <= self.target_latency:
+                self.limit = min(float(self.maximum), self.limit + (1.0 if self._slow_start else 1.0 / self.limit))
+            self._condition.notify_all()
+
+
+def _backoff(attempt: int, response: requests.Response | None) -> float:
+    # exponential backoff with full jitter, waiting at least as long as the API asks for
+    delay = random.uniform(0, min(MAX_BACKOFF, BACKOFF_BASE * 2**attempt))  # noqa: S311
+    retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+    return max(delay, float(retry_after)) if retry_after.isdigit() else delay
+
+
+def _get(
+    session: requests.Session,
+    url: str,
+    params: dict,
+    limiter: AIMDLimiter | None = None,
+    retry_status: frozenset[int] = RETRY_STATUS,
+) -> requests.Response:
+    """Send a GET request, retrying connection errors and `retry_status` responses up to MAX_RETRIES times.
+
+    Retries wait with exponential backoff and full jitter. When a limiter is given, every attempt waits for a slot of
+    the limiter and reports its latency and whether the API was overloaded. Every attempt is recorded in the run
+    metrics. The `elapsed` time of the returned response is the latency of its own attempt, including reading the
+    response, without the waits for the limiter and the backoff of earlier attempts.
+    """
+    attempt = 0
+    # every attempt returns, raises or retries, and the last attempt never retries
+    while True:
+        token = limiter.acquire() if limiter is not None else 0
+        t0 = time.perf_counter()
+        r = None
+        try:
+            r = session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+        finally:
+            latency = time.perf_counter() - t0
+            if limiter is not None:
+                overloaded = r is None or r.status_code in OVERLOAD_STATUS
+                limiter.release(token, latency, overloaded=overloaded)
+            metrics.record_request(
+                latency, r.status_code if r is not None else None, len(r.content) if r is not None else 0
+            )
+        if r is not None and (r.status_code not in retry_status or attempt == MAX_RETRIES):
+            r.raise_for_status()
+            r.elapsed = timedelta(seconds=latency)
+            return r
+        delay = _backoff(attempt, r)
+        reason = r.status_code if r is not None else "connection error"
+        logger.debug("Retrying %s in %.2f seconds after %s", url, delay, reason)
+        time.sleep(delay)
+        attempt += 1
 
 
 # base functions for API calls such as retrieval of time series
-def get_reservoir_ts(reservoir_id: str, start: datetime, stop: datetime, var_name: str | None = None) -> dict:
-    """Get time series data for reservoir with given ID."""
+def get_reservoir_ts(
+    reservoir_id: str,
+    start: datetime,
+    stop: datetime,
+    var_name: str | None = None,
+    session: requests.Session | None = None,
+    cache: TimeSeriesCache | None = None,
+    limiter: AIMDLimiter | None = None,
+) -> dict:
+    """Get time series data for reservoir with given ID.
+
+    When a cache is given, only the months that are not in the cache are requested from the API. Failed requests are
+    retried with backoff, and requests wait for a slot of the `limiter` when one is given.
+    """
+    if cache is not None:
+        cached, span = cache.plan(reservoir_id, var_name, start, stop)
+        if span is None:
+            return cached
+        reservoir_ts = get_reservoir_ts(
+            reservoir_id,
+            span[0],
+            span[1],
+            var_name=var_name,
+            session=session,
+            limiter=limiter,
+        )
+        reservoir_ts = cache.store(reservoir_id, var_name, span[0], span[1], reservoir_ts)
+        return sorted(cached + reservoir_ts, key=lambda obs: obs["t"])
+    session = session or get_session()
     url = f"{base_url}/reservoir/{reservoir_id}/ts/{var_name}"
     params = {"start": start.strftime("%Y-%m-%dT%H:%M:%S"), "stop": stop.strftime("%Y-%m-%dT%H:%M:%S")}
-    r = requests.get(url, params=params, timeout=120)
-    return r.json()
+    return loads(_get(session, url, params, limiter).content)
+
+
+def get_reservoirs_ts(
+    reservoir_ids: list[int],
+    start: datetime,
+    stop: datetime,
+    var_name: str | None = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    cache: TimeSeriesCache | None = None,
+) -> dict[int, list[dict]]:
+    """Get time series data for multiple reservoirs using concurrent requests.
+
+    The number of requests in flight is adapted to the API with an `AIMDLimiter`, up to `concurrency` requests.
+    Reservoirs that still fail after retrying are logged and left out of the result, see `failed_reservoirs`.
+
+    Parameters
+    ----------
+    reservoir_ids : list[int]
+        feature ids of the reservoirs
+    start : datetime
+        start date time of the retrieval
+    stop : datetime
+        end date time of the retrieval
+    var_name : str, optional
+        variable to retrieve from API
+    concurrency : int, optional
+        number of requests in flight at the same time, by default DEFAULT_CONCURRENCY
+    cache : TimeSeriesCache | None, optional
+        cache to consult before requesting time series from the API, by default None
+
+    Returns
+    -------
+    dict[int, list[dict]]
+        time series per reservoir id, failed reservoirs are left out
+
+    """
+    session = get_session(concurrency)
+    limiter = AIMDLimiter(maximum=concurrency)
+    reservoir_ts = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(get_reservoir_ts, fid, start, stop, var_name, session, cache, limiter): fid
+            for fid in reservoir_ids
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            try:
+                reservoir_ts[futures[future]] = future.result()
+            except (requests.RequestException, ValueError) as err:
+                logger.warning("Failed to retrieve time series for reservoir %s: %s", futures[future], err)
+    return reservoir_ts
+
+
+def failed_reservoirs(reservoir_ids: list[int], reservoirs_ts: Collection[int]) -> list[int]:
+    """Get the reservoirs for which the retrieval failed, to retry them later.
+
+    `reservoirs_ts` holds the ids of the retrieved reservoirs, such as the time series per retrieved reservoir id.
+    """
+    return [fid for fid in reservoir_ids if fid not in reservoirs_ts]
 
 
 def get_multi_reservoir_ts(
-    reservoir_ids: list[str],
+    reservoir_ids: list[int],
     start: datetime,
     stop: datetime,
     variable: str = "surface_water_area",
+    session: requests.Session | None = None,
 ) -> dict:
-    """Get time series data for multiple reservoirs.
+    """Get monthly aggregated time series data for multiple reservoirs in one request.
 
-    reservoir_ids : int, list[int]
+    reservoir_ids : list[int]
         At least one id of reservoir(s)
     start : datetime
         start date time of the retrieval
@@ -39,8 +300,23 @@ def get_multi_reservoir_ts(
         end date time of the retrieval
     variable : str, optional
         variable to retrieve from API (default: "surface_water_area")
+    session : requests.Session, optional
+        session to send the request with, by default the shared session
 
     """
+    return loads(_multi_reservoir_request(reservoir_ids, start, stop, variable, session).content)
+
+
+def _multi_reservoir_request(
+    reservoir_ids: list[int],
+    start: datetime,
+    stop: datetime,
+    variable: str,
+    session: requests.Session | None = None,
+    limiter: AIMDLimiter | None = None,
+    retry_status: frozenset[int] = RETRY_STATUS,
+) -> requests.Response:
+    session = session or get_session()
     url = f"{base_url}/ts"
     params = {
         "variable_name": variable,
@@ -49,32 +325,291 @@ def get_multi_reservoir_ts(
         "reservoir_ids": reservoir_ids,
         "agg_period": "monthly",
     }
-    return requests.get(url, params=params)
+    return _get(session, url, params, limiter, retry_status)
+
+
+class AdaptiveBatchSizer:
+    """Size batches of reservoirs per `/ts` request from observed response times and payload sizes.
+
+    After every response the time and bytes per reservoir are estimated, and the next batch is sized so that a
+    response is expected to take `target_time` seconds and stay below `max_bytes`. Batches grow at most by a factor
+    two per response but shrink immediately.
+    """
 
+    def __init__(
+        self,
+        initial: int = DEFAULT_BATCH_SIZE,
+        minimum: int = 1,
+        maximum: int = MAX_BATCH_SIZE,
+        target_time: float = TARGET_RESPONSE_TIME,
+        max_bytes: int = MAX_RESPONSE_BYTES,
+    ) -> None:
+        self.size = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_time = target_time
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
 
-def get_reservoirs_per_interval(res_ids, curdate=datetime.utcnow(), interval=10, max_nr=None):
-    start, stop = get_month_interval()
+    def update(self, n_reservoirs: int, elapsed: float, nbytes: int) -> None:
+        """Update the batch size with the response time and size of a batch of `n_reservoirs`."""
+        time_per_reservoir = max(elapsed, 1e-6) / n_reservoirs
+        bytes_per_reservoir = max(nbytes, 1) / n_reservoirs
+        optimal = min(self.target_time / time_per_reservoir, self.max_bytes / bytes_per_reservoir)
+        with self._lock:
+            size = min(int(optimal), 2 * self.size)
+            self.size = max(self.minimum, min(size, self.maximum))
+
+
+def _get_batches(
+    reservoir_ids: list[int],
+    start: datetime,
+    stop: datetime,
+    variable: str,
+    concurrency: int,
+    batch_size: int,
+    decode: Callable[[bytes], T],
+) -> Iterator[tuple[list[int], T]]:
+    """Request batches of reservoirs from the `/ts` endpoint and yield every batch with its decoded response.
+
+    Responses are decoded with `decode` in the worker threads as soon as they arrive. A batch whose request or
+    decoding fails is split in two, and a failing single reservoir is logged and skipped.
+    """
+    session = get_session(concurrency)
+    limiter = AIMDLimiter(maximum=concurrency)
+    sizer = AdaptiveBatchSizer(initial=batch_size)
+    pending = deque(reservoir_ids)
+    split_batches: deque[list[int]] = deque()
+
+    def fetch_batch(batch: list[int]) -> T:
+        # a failing batch is split rather than retried, unless the failure is transient
+        retry_status = RETRY_STATUS if len(batch) == 1 else TRANSIENT_STATUS
+        r = _multi_reservoir_request(batch, start, stop, variable, session, limiter, retry_status)
+        # the latency of the request itself, so that waiting for the limiter or a backoff does not shrink the batches
+        sizer.update(len(batch), r.elapsed.total_seconds(), len(r.content))
+        return decode(r.content)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor, tqdm(total=len(reservoir_ids)) as progress:
+        futures = {}
+        while pending or split_batches or futures:
+            while len(futures) < concurrency and (pending or split_batches):
+                if split_batches:
+                    batch = split_batches.popleft()
+                else:
+                    batch = [pending.popleft() for _ in range(min(sizer.size, len(pending)))]
+                futures[executor.submit(fetch_batch, batch)] = batch
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = futures.pop(future)
+                try:
+                    decoded = future.result()
+                except (requests.RequestException, ValueError, KeyError) as err:
+                    if len(batch) == 1:
+                        logger.warning("Failed to retrieve time series for reservoir %s: %s", batch[0], err)
+                        progress.update(1)
+                        continue
+                    half = len(batch) // 2
+                    split_batches.extend([batch[:half], batch[half:]])
+                    continue
+                progress.update(len(batch))
+                yield batch, decoded
+
+
+def get_reservoirs_ts_batched(
+    reservoir_ids: list[int],
+    start: datetime,
+    stop: datetime,
+    variable: str = "surface_water_area",
+    concurrency: int = DEFAULT_CONCURRENCY,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> dict[int, list[dict]]:
+    """Get monthly time series for many reservoirs using batched requests to the `/ts` endpoint.
+
+    Batches are sized adaptively with an `AdaptiveBatchSizer` and the number of requests in flight with an
+    `AIMDLimiter`. Requests that fail because the API is overloaded or unavailable are retried with backoff. When a
+    batch request fails otherwise, the batch is split in two and both halves are retried, so that a failing reservoir
+    is isolated and skipped instead of failing the whole retrieval.
+
+    Parameters
+    ----------
+    reservoir_ids : list[int]
+        feature ids of the reservoirs
+    start : datetime
+        start date time of the retrieval
+    stop : datetime
+        end date time of the retrieval
+    variable : str, optional
+        variable to retrieve from API (default: "surface_water_area")
+    concurrency : int, optional
+        number of batch requests in flight at the same time, by default DEFAULT_CONCURRENCY
+    batch_size : int, optional
+        number of reservoirs in the first batches, by default DEFAULT_BATCH_SIZE
+
+    Returns
+    -------
+    dict[int, list[dict]]
+        time series per reservoir id, reservoirs without data have an empty list and failed reservoirs are left out
+
+    """
+    reservoir_ts = {}
+    batches = _get_batches(
+        reservoir_ids, start, stop, variable, concurrency, batch_size, lambda body: loads(body)["source_data"] or {}
+    )
+    for batch, source_data in batches:
+        for fid in batch:
+            reservoir_ts[fid] = source_data.get(str(fid), [])
+    return reservoir_ts
+
+
+def get_observations_batched(
+    reservoir_ids: list[int],
+    start: datetime,
+    stop: datetime,
+    variable: str = "surface_water_area",
+    concurrency: int = DEFAULT_CONCURRENCY,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Get monthly time series for many reservoirs as one columnar table, using batched requests to `/ts`.
+
+    Like `get_reservoirs_ts_batched`, but every response is decoded to arrays with `decode_source_data` as soon as it
+    arrives, so that no more than the responses in flight are held as Python objects.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+        int32 ids of the retrieved reservoirs, including those without data, and the int32 reservoir ids, datetime64
+        times and float64 values of all observations. Failed reservoirs are left out
+
+    """
+    retrieved = [np.empty(0, dtype=np.int32)]
+    columns = [(np.empty(0, dtype=np.int32), np.empty(0, dtype="datetime64[s]"), np.empty(0, dtype=np.float64))]
+    for batch, (_, fid, time_, value) in _get_batches(
+        reservoir_ids, start, stop, variable, concurrency, batch_size, decode_source_data
+    ):
+        batch = np.asarray(batch, dtype=np.int32)
+        in_batch = np.isin(fid, batch)
+        retrieved.append(batch)
+        columns.append((fid[in_batch], time_[in_batch], value[in_batch]))
+    return np.concatenate(retrieved), *(np.concatenate(column) for column in zip(*columns, strict=True))
+
+
+def get_reservoirs_per_interval(
+    res_ids: list[int],
+    curdate: datetime | None = None,
+    interval: int = 10,
+    max_nr: int | None = None,
+) -> dict[str, list[dict]]:
+    """Get the time series of the month before `curdate` for reservoirs in fixed batches of `interval` reservoirs."""
+    start, stop = get_month_interval(curdate)
     # count the time to read data
-    t1 = time.time()
+    t1 = time.perf_counter()
 
     ts = {}
-    if max_nr is None:
-        ns = range(0, int(len(res_ids)), interval)
-    else:
-        # limit to amount of available reservoirs
-        max_nr = int(min(len(res_ids), max_nr))
-        ns = range(0, max_nr, interval)
+    # limit to amount of available reservoirs
+    max_nr = len(res_ids) if max_nr is None else min(len(res_ids), max_nr)
+    ns = range(0, max_nr, interval)
     log_msg = f"Reading {max_nr} reservoirs for datetime {start} until {stop} in batches of {interval}"
-    logging.info(log_msg)
+    logger.info(log_msg)
     for n in tqdm(ns):
-        r = get_multi_reservoir_ts(res_ids[n : n + interval], start=start, stop=stop)
-        data = r.json()
+        data = get_multi_reservoir_ts(res_ids[n : min(n + interval, max_nr)], start=start, stop=stop)
         if data["source_data"] is None:
-            logging.warning("Warning, this interval contained no source data")
+            logger.warning("Warning, this interval contained no source data")
         else:
             ts.update(data["source_data"])
-    t2 = time.time()
+    t2 = time.perf_counter()
+    metrics.record_stage("fetch", t2 - t1)
 
-    log_msg = f"Reading month data for {len(res_ids[:interval])} reservoirs took {t2 - t1} seconds."
-    logging.info(log_msg)
+    log_msg = f"Reading month data for {max_nr} reservoirs took {t2 - t1} seconds."
+    logger.info(log_msg)
     return ts
+
+
+def fetch_reservoirs_ts(
+    reservoir_ids: list[int],
+    start: datetime,
+    stop: datetime,
+    var_name: str = "surface_water_area",
+    concurrency: int = DEFAULT_CONCURRENCY,
+    batch_size: int | None = None,
+    cache: TimeSeriesCache | None = None,
+) -> dict[int, list[dict]]:
+    """Get time series for many reservoirs, one reservoir per request or in batches of reservoirs per request.
+
+    Batches are retrieved from the `/ts` endpoint, which aggregates the time series to monthly values. In the cache
+    these are stored as the `{var_name}_monthly` variable.
+
+    Parameters
+    ----------
+    reservoir_ids : list[int]
+        feature ids of the reservoirs
+    start : datetime
+        start date time of the retrieval
+    stop : datetime
+        end date time of the retrieval
+    var_name : str, optional
+        variable to retrieve from API (default: "surface_water_area")
+    concurrency : int, optional
+        number of requests in flight at the same time, by default DEFAULT_CONCURRENCY
+    batch_size : int | None, optional
+        initial number of reservoirs per `/ts` request, by default None which requests every reservoir separately
+    cache : TimeSeriesCache | None, optional
+        cache to consult before requesting time series from the API, by default None
+
+    Returns
+    -------
+    dict[int, list[dict]]
+        time series per reservoir id
+
+    """
+    if not batch_size:
+        return get_reservoirs_ts(reservoir_ids, start, stop, var_name=var_name, concurrency=concurrency, cache=cache)
+    if cache is None:
+        return get_reservoirs_ts_batched(
+            reservoir_ids, start, stop, variable=var_name, concurrency=concurrency, batch_size=batch_size
+        )
+    cache_variable = f"{var_name}_monthly"
+    reservoir_ts, spans = cache.cached_spans(reservoir_ids, cache_variable, start, stop)
+    for (span_start, span_stop), span_ids in spans.items():
+        fetched = get_reservoirs_ts_batched(
+            span_ids, span_start, span_stop, variable=var_name, concurrency=concurrency, batch_size=batch_size
+        )
+        for fid in span_ids:
+            if fid not in fetched:
+                del reservoir_ts[fid]
+                continue
+            fetched_ts = cache.store(fid, cache_variable, span_start, span_stop, fetched[fid])
+            reservoir_ts[fid] = sorted(reservoir_ts[fid] + fetched_ts, key=lambda obs: obs["t"])
+    return reservoir_ts
+
+
+def fetch_observations(
+    reservoir_ids: list[int],
+    start: datetime,
+    stop: datetime,
+    var_name: str = "surface_water_area",
+    concurrency: int = DEFAULT_CONCURRENCY,
+    batch_size: int | None = None,
+    cache: TimeSeriesCache | None = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Get time series for many reservoirs as one columnar table, see `fetch_reservoirs_ts` for the parameters.
+
+    Batches retrieved without cache are decoded straight to arrays with `get_observations_batched`. Otherwise the
+    time series are retrieved with `fetch_reservoirs_ts` and converted with `observations_to_arrays`.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+        int32 ids of the retrieved reservoirs, including those without data, and the int32 reservoir ids, datetime64
+        times and float64 values of all observations. Failed reservoirs are left out, see `failed_reservoirs`
+
+    """
+    if batch_size and cache is None:
+        return get_observations_batched(
+            reservoir_ids, start, stop, variable=var_name, concurrency=concurrency, batch_size=batch_size
+        )
+    reservoirs_ts = fetch_reservoirs_ts(
+        reservoir_ids, start, stop, var_name=var_name, concurrency=concurrency, batch_size=batch_size, cache=cache
+    )
+    fid, time_, value = observations_to_arrays(reservoirs_ts)
+    retrieved = np.fromiter(reservoirs_ts, dtype=np.int32, count=len(reservoirs_ts))
+    return retrieved, fid.astype(np.int32), time_, value
@@ -0,0 +1,264 @@
+"""Vectorized computation of monthly surface water areas and anomalies for many reservoirs at once."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+MONTHS: range = range(1, 13)
+
+
+def observations_to_arrays(reservoirs_ts: dict[int, list[dict]]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Flatten time series per reservoir to flat arrays of reservoir id, time and value.
+
+    Parameters
+    ----------
+    reservoirs_ts : dict[int, list[dict]]
+        time series per reservoir id, as returned by the GWW API
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]
+        int64 reservoir ids, datetime64 times and float64 values of all observations
+
+    """
+    counts = [len(ts) for ts in reservoirs_ts.values()]
+    n = sum(counts)
+    fid = np.repeat(np.fromiter(reservoirs_ts.keys(), dtype=np.int64, count=len(counts)), counts)
+    time = np.array([obs["t"] for ts in reservoirs_ts.values() for obs in ts], dtype="datetime64[s]")
+    value = np.fromiter(
+        (np.nan if obs["value"] is None else obs["value"] for ts in reservoirs_ts.values() for obs in ts),
+        dtype=np.float64,
+        count=n,
+    )
+    return fid, time, value
+
+
+def monthly_means(
+    fid: np.ndarray,
+    time: np.ndarray,
+    value: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Average observations per reservoir and calendar month with a group-by on integer keys.
+
+    Observations without a finite value are ignored.
+
+    Parameters
+    ----------
+    fid : np.ndarray
+        reservoir id of every observation
+    time : np.ndarray
+        datetime64 time of every observation
+    value : np.ndarray
+        value of every observation
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]
+        reservoir ids, datetime64[M] months and mean values of every reservoir-month, sorted by reservoir and month
+
+    """
+    valid = np.isfinite(value)
+    fid, value = fid[valid], value[valid]
+    month = time[valid].astype("datetime64[M]").astype(np.int64)
+    month_offset = month.min() if len(month) else 0
+    n_months = month.max() - month_offset + 1 if len(month) else 1
+    keys = fid.astype(np.int64) * n_months + (month - month_offset)
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    sums = np.bincount(inverse, weights=value, minlength=len(unique_keys))
+    counts = np.bincount(inverse, minlength=len(unique_keys))
+    unique_fid, unique_month = np.divmod(unique_keys, n_months)
+    return unique_fid, (unique_month + month_offset).astype("datetime64[M]"), sums / counts
+
+
+class ClimatologyIndex:
+    """Climatology parameters ordered by reservoir id for vectorized lookups.
+
+    The index can hold a subset of the calendar months, for runs that only need the climatology of some months.
+    Parameters that are already sorted by reservoir id are used as they are, so that memory-mapped float32 arrays are
+    not copied.
+
+    Parameters
+    ----------
+    fid : np.ndarray
+        reservoir ids
+    mean : np.ndarray
+        (reservoir x month) array with the climatological mean of every month in `months`
+    std : np.ndarray
+        (reservoir x month) array with the climatological standard deviation of every month in `months`
+    months : Sequence[int], optional
+        calendar months of the columns of `mean` and `std`, by default MONTHS
+
+    """
+
+    def __init__(self, fid: np.ndarray, mean: np.ndarray, std: np.ndarray, months: Sequence[int] = MONTHS) -> None:
+        fid = np.asarray(fid, dtype=np.int64)
+        mean, std = np.asarray(mean), np.asarray(std)
+        if not np.all(fid[:-1] <= fid[1:]):
+            order = np.argsort(fid, kind="stable")
+            fid, mean, std = fid[order], mean[order], std[order]
+        self.fid = fid
+        self.mean = mean
+        self.std = std
+        self.months = tuple(months)
+        self._columns = np.full(len(MONTHS) + 1, -1, dtype=np.int64)
+        self._columns[list(self.months)] = np.arange(len(self.months))
+
+    @classmethod
+    def from_dataframe(cls, climatologies: pd.DataFrame) -> ClimatologyIndex:
+        """Build the index from a climatologies dataframe with `fid`, `mean_{m}` and `std_{m}` columns."""
+        return cls(
+            fid=climatologies["fid"].to_numpy(),
+            mean=climatologies[[f"mean_{m}" for m in MONTHS]].to_numpy(),
+            std=climatologies[[f"std_{m}" for m in MONTHS]].to_numpy(),
+        )
+
+    def __len__(self) -> int:
+        """Get the number of reservoirs in the index."""
+        return len(self.fid)
+
+    def columns(self, calendar_months: np.ndarray) -> np.ndarray:
+        """Get the columns of `mean` and `std` holding the given calendar months (1-12)."""
+        columns = self._columns[np.asarray(calendar_months, dtype=np.int64)]
+        if (columns < 0).any():
+            missing = sorted(set(np.asarray(calendar_months)[columns < 0].tolist()))
+            err_msg = f"Climatology index holds no parameters for calendar months {missing}"
+            raise ValueError(err_msg)
+        return columns
+
+    def locate(self, fids: np.ndarray) -> np.ndarray:
+        """Get the positions of reservoir ids in the index, or -1 for reservoirs without climatology."""
+        fids = np.asarray(fids, dtype=np.int64)
+        positions = np.searchsorted(self.fid, fids)
+        positions[positions == len(self.fid)] = 0
+        found = self.fid[positions] == fids if len(self.fid) else np.zeros(len(fids), dtype=bool)
+        return np.where(found, positions, -1)
+
+
+def standardize(fid: np.ndarray, time: np.ndarray, value: np.ndarray, climatology: ClimatologyIndex) -> np.ndarray:
+    """Standardize values with the climatological mean and standard deviation of their reservoir and calendar month.
+
+    Parameters
+    ----------
+    fid : np.ndarray
+        reservoir id of every value
+    time : np.ndarray
+        datetime64 time of every value
+    value : np.ndarray
+        values to standardize
+    climatology : ClimatologyIndex
+        climatology parameters of the reservoirs
+
+    Returns
+    -------
+    np.ndarray
+        anomaly of every value, NaN for reservoirs without climatology
+
+    """
+    positions = climatology.locate(fid)
+    found = positions >= 0
+    columns = climatology.columns(np.asarray(time)[found].astype("datetime64[M]").astype(np.int64) % 12 + 1)
+    anomaly = np.full(len(positions), np.nan)
+    mean = climatology.mean[positions[found], columns]
+    std = climatology.std[positions[found], columns]
+    anomaly[found] = (np.asarray(value)[found] - mean) / std
+    return anomaly
+
+
+def compute_anomalies(
+    fid: np.ndarray,
+    time: np.ndarray,
+    value: np.ndarray,
+    climatology: ClimatologyIndex,
+) -> pd.DataFrame:
+    """Compute the monthly surface water area and its anomaly for every reservoir-month in a single pass.
+
+    The anomaly is the monthly mean surface water area standardized with the climatological mean and standard
+    deviation of the same calendar month. Reservoirs without climatology are left out.
+
+    Parameters
+    ----------
+    fid : np.ndarray
+        reservoir id of every observation
+    time : np.ndarray
+        datetime64 time of every observation
+    value : np.ndarray
+        surface water area of every observation
+    climatology : ClimatologyIndex
+        climatology parameters of the reservoirs
+
+    Returns
+    -------
+    pd.DataFrame
+        dataframe with `fid`, `month`, `anomaly` and `monthly_surface_area` columns
+
+    """
+    fids, months, monthly_surface_area = monthly_means(fid, time, value)
+    found = climatology.locate(fids) >= 0
+    fids, months, monthly_surface_area = fids[found], months[found], monthly_surface_area[found]
+    return pd.DataFrame(
+        {
+            "fid": fids,
+            "month": months.astype("datetime64[s]"),
+            "anomaly": standardize(fids, months, monthly_surface_area, climatology),
+            "monthly_surface_area": monthly_surface_area,
+        },
+    )
+
+
+def anomaly_cube(
+    fid: np.ndarray,
+    time: np.ndarray,
+    value: np.ndarray,
+    climatology: ClimatologyIndex,
+    start: np.datetime64 | None = None,
+    stop: np.datetime64 | None = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Compute the monthly surface water area and anomaly series of all reservoirs as (reservoir x month) arrays.
+
+    The reservoir-months are computed with `compute_anomalies` and scattered into arrays with a row per reservoir with
+    climatology and observations and a column per month, so that the history of a reservoir is a row and a month
+    across all reservoirs is a column. Months without observations are NaN.
+
+    Parameters
+    ----------
+    fid : np.ndarray
+        reservoir id of every observation
+    time : np.ndarray
+        datetime64 time of every observation
+    value : np.ndarray
+        surface water area of every observation
+    climatology : ClimatologyIndex
+        climatology parameters of the reservoirs, holding all calendar months of the period
+    start : np.datetime64 | None, optional
+        first month of the columns, by default the first month with observations
+    stop : np.datetime64 | None, optional
+        month after the last month of the columns, by default the month after the last month with observations
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+        sorted reservoir ids of the rows, datetime64[M] months of the columns, and the float64 monthly surface water
+        area and anomaly arrays
+
+    """
+    anomalies_df = compute_anomalies(fid, time, value, climatology)
+    months = anomalies_df["month"].to_numpy().astype("datetime64[M]")
+    if start is None:
+        start = months.min() if len(months) else np.datetime64(0, "M")
+    if stop is None:
+        stop = months.max() + 1 if len(months) else np.datetime64(start, "M")
+    start, stop = np.datetime64(start, "M"), np.datetime64(stop, "M")
+    in_period = (months >= start) & (months < stop)
+    fids, rows = np.unique(anomalies_df["fid"].to_numpy()[in_period], return_inverse=True)
+    columns = (months[in_period] - start).astype(np.int64)
+    shape = (len(fids), max(int((stop - start).astype(np.int64)), 0))
+    monthly_surface_area, anomaly = np.full(shape, np.nan), np.full(shape, np.nan)
+    monthly_surface_area[rows, columns] = anomalies_df["monthly_surface_area"].to_numpy()[in_period]
+    anomaly[rows, columns] = anomalies_df["anomaly"].to_numpy()[in_period]
+    return fids, np.arange(start, stop), monthly_surface_area, anomaly
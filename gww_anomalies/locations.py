@@ -0,0 +1,135 @@
+"""Indexed GeoParquet cache of the reservoir locations for reading the geometries of a few reservoirs quickly."""
+
+from __future__ import annotations
+
+import json
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from gww_anomalies import CACHE_PATH
+from gww_anomalies.log import setup_log
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Sequence
+    from pathlib import Path
+
+    import geopandas as gpd
+
+logger = setup_log(__name__)
+
+LOCATIONS_CACHE: Path = CACHE_PATH / "reservoirs-locations.parquet"
+ROW_GROUP_SIZE: int = 10_000
+_SOURCE_KEY = b"gww_anomalies:source"
+
+
+def _source_fingerprint(locations_path: Path) -> bytes:
+    stat = locations_path.stat()
+    return json.dumps([str(locations_path.resolve()), stat.st_size, stat.st_mtime_ns]).encode()
+
+
+class LocationsIndex:
+    """Reservoir locations sorted by fid in a GeoParquet file, with the fid range of every row group as index.
+
+    The GeoParquet file is converted once from the reservoir locations file and converted again when that file
+    changes. Reading the geometries of a set of reservoirs only reads the row groups that can hold them.
+
+    Parameters
+    ----------
+    locations_path : Path
+        reservoir locations file with a `feature_id` column
+    cache_path : Path, optional
+        location of the GeoParquet file, by default LOCATIONS_CACHE
+
+    """
+
+    def __init__(self, locations_path: Path, cache_path: Path = LOCATIONS_CACHE) -> None:
+        self.locations_path = locations_path
+        self.cache_path = cache_path
+        fingerprint = _source_fingerprint(locations_path)
+        if not cache_path.exists() or pq.read_schema(cache_path).metadata.get(_SOURCE_KEY) != fingerprint:
+            self._convert(fingerprint)
+        self._file = pq.ParquetFile(cache_path)
+        self.crs = json.loads(self._file.schema_arrow.metadata[b"geo"])["columns"]["geometry"]["crs"]
+        fid_column = self._file.schema_arrow.get_field_index("fid")
+        row_groups = [self._file.metadata.row_group(i) for i in range(self._file.num_row_groups)]
+        self.min_fid = np.array([rg.column(fid_column).statistics.min for rg in row_groups], dtype=np.int64)
+        self.max_fid = np.array([rg.column(fid_column).statistics.max for rg in row_groups], dtype=np.int64)
+
+    def _convert(self, fingerprint: bytes) -> None:
+        import geopandas as gpd
+
+        logger.info("Converting reservoir locations %s to %s", self.locations_path, self.cache_path)
+        locations = gpd.read_file(self.locations_path).rename(columns={"feature_id": "fid"})
+        locations = locations.sort_values("fid", ignore_index=True)
+        table = pa.Table.from_pandas(
+            pd.DataFrame(locations).assign(geometry=locations.geometry.to_wkb()),
+            preserve_index=False,
+        )
+        table = table.replace_schema_metadata({b"geo": geoparquet_metadata(locations), _SOURCE_KEY: fingerprint})
+        # write to a temporary file first, so that an interrupted conversion does not leave a partial cache behind
+        tmp_path = self.cache_path.with_suffix(".tmp")
+        pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE, write_statistics=["fid"])
+        tmp_path.replace(self.cache_path)
+
+    def row_groups(self, fids: np.ndarray) -> list[int]:
+        """Get the row groups that can hold the given reservoir ids."""
+        fids = np.asarray(fids, dtype=np.int64)
+        groups = np.searchsorted(self.max_fid, fids)
+        in_file = groups < len(self.max_fid)
+        groups = groups[in_file]
+        return np.unique(groups[self.min_fid[groups] <= fids[in_file]]).tolist()
+
+    def read(self, fids: list[int], columns: list[str] | None = None) -> gpd.GeoDataFrame:
+        """Read the locations of the given reservoirs.
+
+        Parameters
+        ----------
+        fids : list[int]
+            feature ids of the reservoirs
+        columns : list[str] | None, optional
+            columns to read next to `fid` and `geometry`, by default None which reads no other columns
+
+        Returns
+        -------
+        gpd.GeoDataFrame
+            locations of the reservoirs that are in the locations file, sorted by fid
+
+        """
+        import geopandas as gpd
+
+        fids = np.unique(np.asarray(fids, dtype=np.int64))
+        columns = ["fid", *(columns or []), "geometry"]
+        table = self._file.read_row_groups(self.row_groups(fids), columns=columns)
+        locations = table.filter(pc.is_in(table["fid"], value_set=pa.array(fids))).to_pandas()
+        geometry = gpd.GeoSeries.from_wkb(locations.pop("geometry"), crs=self.crs)
+        return gpd.GeoDataFrame(locations, geometry=geometry)
+
+    def fids(self) -> list[int]:
+        """Get the feature ids of all reservoirs in the locations file."""
+        return self._file.read(columns=["fid"])["fid"].to_pylist()
+
+
+def geoparquet_metadata(
+    locations: gpd.GeoDataFrame,
+    geometry_types: Iterable[str] | None = None,
+    bbox: Sequence[float] | None = None,
+) -> bytes:
+    """Get the GeoParquet `geo` metadata of a GeoDataFrame with WKB encoded geometries.
+
+    The geometry types and bounding box are those of `locations`, unless they are given, such as those of all chunks
+    of a file written in chunks.
+    """
+    crs = locations.crs.to_json_dict() if locations.crs else None
+    if geometry_types is None:
+        geometry_types = locations.geom_type.dropna()
+    if bbox is None and not locations.empty:
+        bbox = locations.total_bounds
+    column = {"encoding": "WKB", "crs": crs, "geometry_types": sorted(set(geometry_types))}
+    if bbox is not None:
+        column["bbox"] = [float(bound) for bound in bbox]
+    return json.dumps({"version": "1.0.0", "primary_column": "geometry", "columns": {"geometry": column}}).encode()
@@ -1,4 +1,5 @@
 """Set up consistent logging across application."""
+
 import logging
 import sys
 
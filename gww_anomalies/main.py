@@ -6,13 +6,23 @@ import logging
 from pathlib import Path
 from typing import TYPE_CHECKING
 
-import geopandas as gpd
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
 
-from gww_anomalies.gww_api import get_reservoir_ts
+from gww_anomalies.cache import TimeSeriesCache
+from gww_anomalies.climatology_store import CLIMATOLOGY_CACHE, ClimatologyStore
+from gww_anomalies.cube import AnomalyCube
+from gww_anomalies.defaults import DEFAULT_CHUNK_SIZE
+from gww_anomalies.gww_api import DEFAULT_CONCURRENCY, failed_reservoirs, fetch_observations
+from gww_anomalies.kernel import ClimatologyIndex, compute_anomalies
 from gww_anomalies.log import setup_log
-from gww_anomalies.utils import get_month_interval
+from gww_anomalies.manifest import RunManifest
+from gww_anomalies.metrics import metrics
+from gww_anomalies.output import write_anomaly_chunks
+from gww_anomalies.regions import write_region_anomalies
+from gww_anomalies.sharding import shard_fids, shard_name
+from gww_anomalies.standard_index import DistributionIndex, standard_index
+from gww_anomalies.utils import anomalies_name, get_calendar_months, get_month_interval, get_month_range
 
 if TYPE_CHECKING:
     from datetime import datetime
@@ -26,10 +36,54 @@ def run(
     reservoir_list: list[int] | None = None,
     month: datetime | None = None,
     as_vector: bool | None = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    batch_size: int | None = None,
+    use_cache: bool = True,
+    start_month: datetime | None = None,
+    end_month: datetime | None = None,
+    output_format: str | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    resume: bool = False,
+    prometheus_path: Path | None = None,
+    shard: tuple[int, int] | None = None,
+    standardized_index: bool = False,
+    regions_path: Path | None = None,
+    region_column: str | None = None,
+    cube_path: Path | None = None,
 ) -> Path:
     """Calculate anomalies for given list of reservoir ids and writes to a CSV or vector file.
 
     If no reservoir ids are supplied, anomalies are calculated for all the reservoirs present in the climatologies file.
+    When `start_month` and `end_month` are given, the time series of every reservoir is retrieved once for the whole
+    range and the anomalies of all months in the range are written to a single file keyed by fid and month.
+
+    The reservoirs are processed in chunks of `chunk_size` reservoirs. The anomalies of every chunk are written to a
+    part file next to the output as soon as the chunk completes, and a run manifest records the completed chunks, so
+    that an interrupted run can be resumed with `resume`. When all chunks are completed, the parts are written to the
+    anomalies file one by one and removed. Reservoirs for which retrieving the time series keeps failing are written
+    to a `_failed.txt` reservoir ids file next to the output, which can be passed as reservoir ids file to retry them.
+    The other reservoirs without anomalies, such as reservoirs without observations in the period, are written to a
+    `_no_data.txt` reservoir ids file, so that missing reservoirs can be told apart from them.
+
+    Only the climatologies of the calendar months in the period are read. With `use_cache`, they are read from a
+    compact, memory-mapped copy of the climatologies file in the user cache directory.
+
+    With `shard` (i, n), only the reservoirs of the i-th of n shards are processed, see `shard_fids`, and written to a
+    shard file named after `anomalies_name` with a `_shard_<i>_of_<n>` suffix. The shard files of all n shards are
+    combined with `merge_shards`.
+
+    With `standardized_index`, a `standardized_index` column is written next to the anomalies: the monthly surface
+    water area transformed to a standard normal quantile with the distribution and probability of zero fitted per
+    reservoir and calendar month in the climatologies file, see `standard_index`.
+
+    With `regions_path` and `region_column`, the anomalies are also aggregated to the regions of a polygon layer, such
+    as countries or river basins, and written to a `_regions.csv` file next to the output, see `aggregate_anomalies`.
+
+    With `cube_path`, the monthly surface water area and anomalies are also written to the reservoir-months of a dense
+    anomaly cube, which holds the anomalies of all runs for queries across months, see `AnomalyCube`.
+
+    The time spent per stage, the requests to the GWW API, the use of the time series cache and the failed reservoirs
+    are recorded in the run metrics, which are written to a `_report.json` run report next to the output.
 
     Parameters
     ----------
@@ -42,97 +96,318 @@ def run(
     month : datetime | None, optional
         datetime
     as_vector: bool | None, optional
-        return the anomalies dataframe as a GeoJSON file
+        return the anomalies dataframe as a GeoJSON file, when no `output_format` is given
+    concurrency : int, optional
+        number of concurrent requests to the GWW API, by default DEFAULT_CONCURRENCY
+    batch_size : int | None, optional
+        initial number of reservoirs fetched per request, by default None which fetches reservoirs one by one
+    use_cache : bool, optional
+        read and store the retrieved time series in the local time series cache, by default True
+    start_month : datetime | None, optional
+        first month of a range of months to calculate anomalies for, by default None
+    end_month : datetime | None, optional
+        last month (inclusive) of a range of months to calculate anomalies for, by default None
+    output_format : str | None, optional
+        format of the anomalies file, one of "csv", "geojson", "geoparquet", "fgb" or "arrow". By default None, which
+        writes GeoJSON when `as_vector` is set and CSV otherwise
+    chunk_size : int, optional
+        number of reservoirs per chunk, by default DEFAULT_CHUNK_SIZE
+    resume : bool, optional
+        skip the chunks completed by an earlier, interrupted run with the same parameters, by default False
+    prometheus_path : Path | None, optional
+        also write the run metrics to this file in the Prometheus text format, by default None
+    shard : tuple[int, int] | None, optional
+        0-based index and number of shards, to process only the reservoirs of that shard. By default None, which
+        processes all reservoirs
+    standardized_index : bool, optional
+        also calculate the standardized index of every reservoir-month, by default False
+    regions_path : Path | None, optional
+        polygon layer of the regions to aggregate the anomalies to, by default None
+    region_column : str | None, optional
+        column of the polygon layer with the name or code of every region, required with `regions_path`
+    cube_path : Path | None, optional
+        directory of the anomaly cube to write the anomalies to, by default None
 
     """
+    if regions_path is not None and region_column is None:
+        err_msg = "A region column is required to aggregate the anomalies to regions"
+        raise ValueError(err_msg)
+    metrics.reset()
+    if start_month is not None or end_month is not None:
+        start, stop = get_month_range(start_month, end_month)
+        output_name = anomalies_name(start, stop, month_range=True)
+        anomalies = calculate_monthly_anomalies
+    else:
+        start, stop = get_month_interval(month)
+        output_name = anomalies_name(start, stop)
+        anomalies = calculate_anomalies
     climatology_file = data_dir / "climatologies.parquet"
-    climatologies = pd.read_parquet(climatology_file)
+    with metrics.stage("climatology_load"):
+        store = ClimatologyStore(climatology_file, cache_dir=CLIMATOLOGY_CACHE if use_cache else None)
+        months = get_calendar_months(start, stop)
+        climatology = store.distribution_index(months) if standardized_index else store.index(months)
     if not reservoir_list:
         logger.info("No list of reservoirs given, calculating anomalies for all reservoirs that have climatology.")
-        reservoir_list = climatologies["fid"].to_list()
-
-    first_of_last_month, first_of_month = get_month_interval(month)
-    anomaly_df = calculate_anomalies(
-        climatologies=climatologies,
-        fids=reservoir_list,
-        start=first_of_last_month,
-        stop=first_of_month,
+        reservoir_list = climatology.fid.tolist()
+    if shard is not None:
+        reservoir_list = shard_fids(reservoir_list, *shard).tolist()
+        output_name = shard_name(output_name, *shard)
+        logger.info("Calculating anomalies for the %s reservoirs of shard %s of %s", len(reservoir_list), *shard)
+    output_format = output_format or ("geojson" if as_vector else "csv")
+    output_path = Path(output_dir) / output_name
+    manifest = RunManifest(
+        parts_dir=output_path.with_name(f"{output_name}_parts"),
+        fids=list(reservoir_list),
+        chunk_size=chunk_size,
+        parameters={
+            "start": start.isoformat(),
+            "stop": stop.isoformat(),
+            "output_format": output_format,
+            "standardized_index": standardized_index,
+        },
+        resume=resume,
     )
-    if not anomaly_df.empty:
-        output_path = Path(output_dir) / f"anomalies_{first_of_last_month.month}_{first_of_last_month.year}"
-        if as_vector:
-            output_path = _to_vector(anomalies_df=anomaly_df, output_path=output_path, data_dir=data_dir)
-        else:
-            output_path = output_path.with_suffix(".csv")
-            anomaly_df.to_csv(output_path)
-
+    cache = TimeSeriesCache() if use_cache else None
+    for chunk, fids in manifest.pending():
+        logger.info("Calculating anomalies for chunk %s of %s", chunk + 1, len(manifest.chunks))
+        dead_letters = []
+        anomaly_df = anomalies(
+            climatologies=climatology,
+            fids=fids,
+            start=start,
+            stop=stop,
+            concurrency=concurrency,
+            batch_size=batch_size,
+            cache=cache,
+            dead_letters=dead_letters,
+        )
+        manifest.complete(chunk, anomaly_df, failed=dead_letters)
+    _write_reservoir_lists(manifest, output_path, output_name)
+    if manifest.has_anomalies():
+        output_path = _write_outputs(
+            manifest,
+            output_path,
+            output_format,
+            data_dir,
+            month=start,
+            regions=(Path(regions_path), region_column) if regions_path is not None else None,
+            cube_path=cube_path,
+        )
         logging.info("Writing anomaly dataset to %s", output_path)
+    else:
+        logger.warning("No anomalies calculated for the given reservoirs")
+        output_path = None
+    manifest.remove()
+    report_path = Path(output_dir) / f"{output_name}_report.json"
+    metrics.write_json(
+        report_path,
+        parameters={**manifest.run, "concurrency": concurrency, "batch_size": batch_size, "use_cache": use_cache},
+        output_path=output_path,
+        failed=len(manifest.failed),
+        no_data=len(manifest.no_data),
+    )
+    logger.info("Wrote run report to %s", report_path)
+    if prometheus_path is not None:
+        metrics.write_prometheus(Path(prometheus_path))
+    return output_path
+
+
+def _write_reservoir_lists(manifest: RunManifest, output_path: Path, output_name: str) -> None:
+    """Write the reservoirs of a run for which the retrieval failed, and those without anomalies, next to the output."""
+    if manifest.failed:
+        failed_path = output_path.with_name(f"{output_name}_failed.txt")
+        failed_path.write_text(",".join(str(fid) for fid in manifest.failed))
+        logger.warning(
+            "Retrieving the time series failed for %s reservoirs, written to %s to retry later",
+            len(manifest.failed),
+            failed_path,
+        )
+    if manifest.no_data:
+        # the reservoirs without anomalies are listed so that `merge_shards` can tell them from missing reservoirs
+        no_data_path = output_path.with_name(f"{output_name}_no_data.txt")
+        no_data_path.write_text(",".join(str(fid) for fid in manifest.no_data))
+        logger.info("No anomalies calculated for %s reservoirs, written to %s", len(manifest.no_data), no_data_path)
+
+
+def _write_outputs(
+    manifest: RunManifest,
+    output_path: Path,
+    output_format: str,
+    data_dir: Path,
+    month: datetime,
+    regions: tuple[Path, str] | None = None,
+    cube_path: Path | None = None,
+) -> Path:
+    """Write the anomalies of the completed chunks to the anomalies file, the regions file and the anomaly cube.
+
+    Returns
+    -------
+    Path
+        path of the anomalies file
+
+    """
+    with metrics.stage("write"):
+        output_path = write_anomaly_chunks(
+            manifest.parts(),
+            output_path=output_path,
+            output_format=output_format,
+            data_dir=data_dir,
+        )
+    if regions is None and cube_path is None:
         return output_path
-    logger.warning("No anomalies calculated for the given reservoirs")
-    return None
+    anomalies_df = pd.concat(manifest.parts(), ignore_index=True)
+    if regions is not None:
+        with metrics.stage("aggregate"):
+            write_region_anomalies(anomalies_df, output_path, *regions, data_dir)
+    if cube_path is not None:
+        with metrics.stage("cube"):
+            AnomalyCube(cube_path).update(anomalies_df, month=None if "month" in anomalies_df else month)
+    return output_path
 
 
-def calculate_anomalies(climatologies: pd.DataFrame, fids: list[int], start: datetime, stop: datetime) -> pd.DataFrame:
+def calculate_anomalies(
+    climatologies: pd.DataFrame | ClimatologyIndex,
+    fids: list[int],
+    start: datetime,
+    stop: datetime,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    batch_size: int | None = None,
+    cache: TimeSeriesCache | None = None,
+    dead_letters: list[int] | None = None,
+) -> pd.DataFrame:
     """Calculate reservoir anomalies based on reservoir climatology.
 
     Parameters
     ----------
-    climatologies : pd.DataFrame
-        dataframe containing climatologies of reservoirs
+    climatologies : pd.DataFrame | ClimatologyIndex
+        dataframe containing climatologies of reservoirs, or an index of the climatologies of the months needed
     fids : list[int]
         list of feature ids for reservoirs
     start : datetime
         start date to calculate anomalies for
     stop : datetime
         end date to calculate anomalies
+    concurrency : int, optional
+        number of concurrent requests to the GWW API, by default DEFAULT_CONCURRENCY
+    batch_size : int | None, optional
+        initial number of reservoirs fetched per request, adapted to the response times and sizes of the API. By
+        default None, which fetches reservoirs one by one
+    cache : TimeSeriesCache | None, optional
+        cache to consult before requesting time series from the API, by default None
+    dead_letters : list[int] | None, optional
+        list to add the reservoirs to for which retrieving the time series failed, by default None
 
     Returns
     -------
     pd.DataFrame
-        dataframe containing the anomalies and surface water area for the given time period.
+        dataframe containing the anomalies and surface water area for the given time period, and the standardized
+        indices when `climatologies` is a DistributionIndex.
+
+    """
+    anomalies_df = calculate_monthly_anomalies(
+        climatologies=climatologies,
+        fids=fids,
+        start=start,
+        stop=stop,
+        concurrency=concurrency,
+        batch_size=batch_size,
+        cache=cache,
+        dead_letters=dead_letters,
+    )
+    if anomalies_df is None:
+        return None
+    columns = ["fid", "anomaly", "standardized_index", "monthly_surface_area"]
+    return anomalies_df[[column for column in columns if column in anomalies_df.columns]]
+
+
+def calculate_monthly_anomalies(
+    climatologies: pd.DataFrame | ClimatologyIndex,
+    fids: list[int],
+    start: datetime,
+    stop: datetime,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    batch_size: int | None = None,
+    cache: TimeSeriesCache | None = None,
+    dead_letters: list[int] | None = None,
+) -> pd.DataFrame:
+    """Calculate reservoir anomalies for every month in a period, retrieving each reservoir's time series once.
+
+    Parameters
+    ----------
+    climatologies : pd.DataFrame | ClimatologyIndex
+        dataframe containing climatologies of reservoirs, or an index of the climatologies of the months needed. With
+        a DistributionIndex, the standardized indices are calculated as well
+    fids : list[int]
+        list of feature ids for reservoirs
+    start : datetime
+        first day of the first month to calculate anomalies for
+    stop : datetime
+        first day of the month after the last month to calculate anomalies for
+    concurrency : int, optional
+        number of concurrent requests to the GWW API, by default DEFAULT_CONCURRENCY
+    batch_size : int | None, optional
+        initial number of reservoirs fetched per request, adapted to the response times and sizes of the API. By
+        default None, which fetches reservoirs one by one
+    cache : TimeSeriesCache | None, optional
+        cache to consult before requesting time series from the API, by default None
+    dead_letters : list[int] | None, optional
+        list to add the reservoirs to for which retrieving the time series failed, by default None
+
+    Returns
+    -------
+    pd.DataFrame
+        long-format dataframe containing the anomalies and surface water area per fid and month, and the
+        standardized indices when `climatologies` is a DistributionIndex.
 
     """
-    month = start.month
-    reservoir_surface_areas = []
     logging.info(
         "Retrieving surface water area for %s reservoirs for the period of %s - %s",
         len(fids),
         start,
         stop,
     )
-    for fid in tqdm(fids):
-        if fid not in climatologies["fid"].to_numpy():
-            warning_msg = f"reservoir {fid} not found in climatologies dataset!"
-            logger.warning(warning_msg)
-            continue
-        reservoir_ts = get_reservoir_ts(
-            reservoir_id=fid,
+    climatology = (
+        climatologies if isinstance(climatologies, ClimatologyIndex) else ClimatologyIndex.from_dataframe(climatologies)
+    )
+    fids = np.asarray(fids, dtype=np.int64)
+    has_climatology = climatology.locate(fids) >= 0
+    for fid in fids[~has_climatology]:
+        warning_msg = f"reservoir {fid} not found in climatologies dataset!"
+        logger.warning(warning_msg)
+    fids = fids[has_climatology].tolist()
+    with metrics.stage("fetch"):
+        retrieved, fid, time, value = fetch_observations(
+            reservoir_ids=fids,
             start=start,
             stop=stop,
             var_name="surface_water_area",
+            concurrency=concurrency,
+            batch_size=batch_size,
+            cache=cache,
         )
-        if not reservoir_ts:
-            logging.info("No reservoir timeseries found for resevoir with id %s.", fid)
-            continue
-        monthly_surface_area = sum([x["value"] for x in reservoir_ts]) / len(reservoir_ts)
-        reservoir_surface_areas.append({"fid": fid, "monthly_surface_area": monthly_surface_area})
-    reservoir_surface_areas_df = pd.DataFrame(reservoir_surface_areas)
-    if reservoir_surface_areas_df.empty:
+    failed = failed_reservoirs(fids, set(retrieved.tolist()))
+    metrics.record_reservoirs(len(fids), len(failed))
+    if failed:
+        logger.warning("Retrieving the time series failed for %s reservoirs", len(failed))
+        if dead_letters is not None:
+            dead_letters.extend(failed)
+    for empty_fid in np.setdiff1d(retrieved, fid).tolist():
+        logging.info("No reservoir timeseries found for resevoir with id %s.", empty_fid)
+    with metrics.stage("compute"):
+        in_period = (time >= np.datetime64(start)) & (time < np.datetime64(stop))
+        anomalies_df = compute_anomalies(fid[in_period], time[in_period], value[in_period], climatology)
+        if isinstance(climatology, DistributionIndex):
+            anomalies_df.insert(
+                anomalies_df.columns.get_loc("anomaly") + 1,
+                "standardized_index",
+                standard_index(
+                    anomalies_df["fid"].to_numpy(),
+                    anomalies_df["month"].to_numpy(),
+                    anomalies_df["monthly_surface_area"].to_numpy(),
+                    climatology,
+                ),
+            )
+    if anomalies_df.empty:
         logging.warning("No surface water area found for all reservoirs of interest.")
         return None
-    anomalies_df = reservoir_surface_areas_df.merge(climatologies, on="fid", how="inner")
-    anomalies_df["anomaly"] = (anomalies_df["monthly_surface_area"] - anomalies_df[f"mean_{month}"]) / anomalies_df[
-        f"std_{month}"
-    ]
-    return anomalies_df[["fid", "anomaly", "monthly_surface_area"]]
-
-
-def _to_vector(anomalies_df: pd.DataFrame, output_path: Path, data_dir: Path) -> str:
-    reservoir_locations_path = data_dir / "reservoirs-locations-v1.0.gpkg"
-    reservoir_locations = gpd.read_file(reservoir_locations_path)
-    reservoir_locations = reservoir_locations.rename(columns={"feature_id": "fid"})
-    anomalies_gdf = reservoir_locations.merge(anomalies_df, on="fid", how="inner")
-    anomalies_gdf = anomalies_gdf[["fid", "anomaly", "monthly_surface_area", "geometry"]]
-    output_path = output_path.with_suffix(".geojson")
-    anomalies_gdf.to_file(output_path)
-    return output_path
+    return anomalies_df
@@ -0,0 +1,125 @@
+"""Run manifest recording the completed chunks of a chunked anomaly run, for resuming interrupted runs."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import shutil
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+from gww_anomalies.log import setup_log
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from pathlib import Path
+
+logger = setup_log(__name__)
+
+
+class RunManifest:
+    """Chunks of an anomaly run and the anomalies of the chunks completed so far.
+
+    The anomalies of every completed chunk are written to a parquet part file in `parts_dir`, after which the chunk is
+    recorded as completed in `manifest.json` in the same directory. A run is resumed from the manifest only when it
+    was made for the same reservoirs, chunk size and parameters.
+
+    Parameters
+    ----------
+    parts_dir : Path
+        directory of the part files and the manifest
+    fids : list[int]
+        feature ids of all reservoirs of the run
+    chunk_size : int
+        number of reservoirs per chunk
+    parameters : dict
+        other parameters of the run that determine its result, such as the period
+    resume : bool, optional
+        resume from an existing manifest, by default False which starts a new run
+
+    """
+
+    def __init__(
+        self,
+        parts_dir: Path,
+        fids: list[int],
+        chunk_size: int,
+        parameters: dict,
+        resume: bool = False,
+    ) -> None:
+        self.parts_dir = parts_dir
+        self.chunks = [fids[i : i + chunk_size] for i in range(0, len(fids), chunk_size)]
+        self.run = {
+            "n_reservoirs": len(fids),
+            "chunk_size": chunk_size,
+            "reservoirs_sha256": hashlib.sha256(np.asarray(fids, dtype=np.int64).tobytes()).hexdigest(),
+            **parameters,
+        }
+        self.completed: list[int] = []
+        self.failed: list[int] = []
+        self.no_data: list[int] = []
+        manifest_path = parts_dir / "manifest.json"
+        if resume and manifest_path.exists():
+            manifest = json.loads(manifest_path.read_text())
+            if manifest["run"] != self.run:
+                err_msg = (
+                    f"Run manifest in {parts_dir} belongs to a run with other reservoirs, chunk size or parameters,"
+                    " remove it or run without resuming to start a new run"
+                )
+                raise ValueError(err_msg)
+            self.completed = manifest["completed"]
+            self.failed = manifest["failed"]
+            self.no_data = manifest.get("no_data", [])
+            logger.info("Resuming run, %s of %s chunks already completed", len(self.completed), len(self.chunks))
+        else:
+            shutil.rmtree(parts_dir, ignore_errors=True)
+            parts_dir.mkdir(parents=True)
+            self._write()
+
+    def _write(self) -> None:
+        # write to a temporary file first, so that an interrupted write does not corrupt the manifest
+        tmp_path = self.parts_dir / "manifest.tmp"
+        manifest = {"run": self.run, "completed": self.completed, "failed": self.failed, "no_data": self.no_data}
+        tmp_path.write_text(json.dumps(manifest))
+        tmp_path.replace(self.parts_dir / "manifest.json")
+
+    def _part_path(self, chunk: int) -> Path:
+        return self.parts_dir / f"part_{chunk:05d}.parquet"
+
+    def pending(self) -> Iterator[tuple[int, list[int]]]:
+        """Iterate over the number and reservoir ids of the chunks that are not completed yet."""
+        completed = set(self.completed)
+        for chunk, fids in enumerate(self.chunks):
+            if chunk not in completed:
+                yield chunk, fids
+
+    def complete(self, chunk: int, anomalies_df: pd.DataFrame | None, failed: list[int] | None = None) -> None:
+        """Write the anomalies of a chunk, or nothing if none were calculated, and record the chunk as completed.
+
+        The reservoirs of the chunk for which retrieving the time series failed are recorded in `failed`, and the other
+        reservoirs without anomalies, such as reservoirs without observations in the period, in `no_data`.
+        """
+        accounted = set(failed or [])
+        if anomalies_df is not None and not anomalies_df.empty:
+            anomalies_df.to_parquet(self._part_path(chunk), index=False)
+            accounted.update(anomalies_df["fid"].tolist())
+        self.completed.append(chunk)
+        self.failed.extend(failed or [])
+        self.no_data.extend(fid for fid in self.chunks[chunk] if fid not in accounted)
+        self._write()
+
+    def parts(self) -> Iterator[pd.DataFrame]:
+        """Iterate over the anomalies of the completed chunks in chunk order, reading one part at a time."""
+        for chunk in sorted(self.completed):
+            if self._part_path(chunk).exists():
+                yield pd.read_parquet(self._part_path(chunk))
+
+    def has_anomalies(self) -> bool:
+        """Check if anomalies were calculated for any of the completed chunks."""
+        return any(self._part_path(chunk).exists() for chunk in self.completed)
+
+    def remove(self) -> None:
+        """Remove the part files and the manifest."""
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
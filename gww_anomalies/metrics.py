@@ -0,0 +1,164 @@
+"""Metrics of an anomaly run: stage timings, API requests, cache use and failures."""
+
+from __future__ import annotations
+
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from pathlib import Path
+
+LATENCY_BUCKETS: tuple[float, ...] = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+PROMETHEUS_PREFIX: str = "gww_anomalies"
+
+
+class RunMetrics:
+    """Thread-safe collector of the metrics of a run.
+
+    Stage timings add up, so that a stage run once per chunk reports its total time. Every request attempt to the GWW
+    API is counted by status, with `"error"` for connection errors and timeouts, and its latency is recorded in a
+    histogram with the upper bounds in `buckets` plus one bucket for slower requests. Cache hits and misses count
+    reservoir months found in or missing from the time series cache.
+
+    Parameters
+    ----------
+    buckets : tuple[float, ...], optional
+        upper bounds in seconds of the latency histogram buckets, by default LATENCY_BUCKETS
+
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Clear all metrics, to start collecting the metrics of a new run."""
+        with self._lock:
+            self.started = time.time()
+            self.stages: dict[str, float] = {}
+            self.requests: dict[str, int] = {}
+            self.response_bytes = 0
+            self.latency_counts = [0] * (len(self.buckets) + 1)
+            self.latency_sum = 0.0
+            self.cache_hits = 0
+            self.cache_misses = 0
+            self.reservoirs = 0
+            self.failed_reservoirs = 0
+
+    def record_stage(self, stage: str, seconds: float) -> None:
+        """Add `seconds` to the time spent in `stage`."""
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """Time the block as part of `stage`."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, time.perf_counter() - t0)
+
+    def record_request(self, latency: float, status: int | None, nbytes: int = 0) -> None:
+        """Record a request attempt, with status None for a request that failed without a response."""
+        key = "error" if status is None else str(status)
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.response_bytes += nbytes
+            self.latency_counts[bisect.bisect_left(self.buckets, latency)] += 1
+            self.latency_sum += latency
+
+    def record_cache(self, hits: int, misses: int) -> None:
+        """Record the number of months found in and missing from the time series cache."""
+        with self._lock:
+            self.cache_hits += hits
+            self.cache_misses += misses
+
+    def record_reservoirs(self, n_reservoirs: int, n_failed: int = 0) -> None:
+        """Record the number of reservoirs processed and the number of those for which the retrieval failed."""
+        with self._lock:
+            self.reservoirs += n_reservoirs
+            self.failed_reservoirs += n_failed
+
+    def to_dict(self) -> dict:
+        """Get the metrics as a JSON serializable dictionary."""
+        with self._lock:
+            n_requests = sum(self.requests.values())
+            return {
+                "seconds": time.time() - self.started,
+                "stages": dict(self.stages),
+                "reservoirs": self.reservoirs,
+                "failed_reservoirs": self.failed_reservoirs,
+                "requests": {
+                    "count": n_requests,
+                    "by_status": dict(sorted(self.requests.items())),
+                    "response_bytes": self.response_bytes,
+                    "latency_seconds": {
+                        "sum": self.latency_sum,
+                        "mean": self.latency_sum / n_requests if n_requests else None,
+                        "buckets": {
+                            str(bound): count
+                            for bound, count in zip([*self.buckets, "+Inf"], self.latency_counts, strict=True)
+                        },
+                    },
+                },
+                "cache": {"hits": self.cache_hits, "misses": self.cache_misses},
+            }
+
+    def write_json(self, path: Path, **run_info: object) -> None:
+        """Write the metrics to a JSON run report, together with information on the run such as its parameters."""
+        path.write_text(json.dumps({**run_info, "metrics": self.to_dict()}, indent=2, default=str))
+
+    def write_prometheus(self, path: Path) -> None:
+        """Write the metrics in the Prometheus text format, for the textfile collector of the node exporter."""
+        report = self.to_dict()
+        p = PROMETHEUS_PREFIX
+        lines = [
+            f"# HELP {p}_run_seconds Duration of the run.",
+            f"# TYPE {p}_run_seconds gauge",
+            f"{p}_run_seconds {report['seconds']}",
+            f"# HELP {p}_stage_seconds Time spent per stage of the run.",
+            f"# TYPE {p}_stage_seconds gauge",
+            *(f'{p}_stage_seconds{{stage="{stage}"}} {seconds}' for stage, seconds in report["stages"].items()),
+            f"# HELP {p}_reservoirs Reservoirs processed in the run.",
+            f"# TYPE {p}_reservoirs gauge",
+            f"{p}_reservoirs {report['reservoirs']}",
+            f"# HELP {p}_failed_reservoirs Reservoirs for which retrieving the time series failed.",
+            f"# TYPE {p}_failed_reservoirs gauge",
+            f"{p}_failed_reservoirs {report['failed_reservoirs']}",
+            f"# HELP {p}_requests_total Requests sent to the GWW API, by response status.",
+            f"# TYPE {p}_requests_total counter",
+            *(f'{p}_requests_total{{status="{s}"}} {n}' for s, n in report["requests"]["by_status"].items()),
+            f"# HELP {p}_response_bytes_total Bytes received from the GWW API.",
+            f"# TYPE {p}_response_bytes_total counter",
+            f"{p}_response_bytes_total {report['requests']['response_bytes']}",
+            f"# HELP {p}_request_duration_seconds Latency of requests to the GWW API.",
+            f"# TYPE {p}_request_duration_seconds histogram",
+        ]
+        cumulative = 0
+        for bound, count in report["requests"]["latency_seconds"]["buckets"].items():
+            cumulative += count
+            lines.append(f'{p}_request_duration_seconds_bucket{{le="{bound}"}} {cumulative}')
+        lines += [
+            f"{p}_request_duration_seconds_sum {report['requests']['latency_seconds']['sum']}",
+            f"{p}_request_duration_seconds_count {report['requests']['count']}",
+            f"# HELP {p}_cache_hits_total Reservoir months read from the time series cache.",
+            f"# TYPE {p}_cache_hits_total counter",
+            f"{p}_cache_hits_total {report['cache']['hits']}",
+            f"# HELP {p}_cache_misses_total Reservoir months missing from the time series cache.",
+            f"# TYPE {p}_cache_misses_total counter",
+            f"{p}_cache_misses_total {report['cache']['misses']}",
+        ]
+        # write to a temporary file first, so that the collector never reads a partially written file
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_text("\n".join(lines) + "\n")
+        tmp_path.replace(path)
+
+
+metrics = RunMetrics()
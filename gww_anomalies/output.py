@@ -0,0 +1,257 @@
+"""Writers for the anomaly datasets in tabular and vector formats."""
+
+from __future__ import annotations
+
+import json
+from contextlib import ExitStack
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from gww_anomalies.defaults import FORMATS
+from gww_anomalies.locations import LocationsIndex, geoparquet_metadata
+from gww_anomalies.log import setup_log
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator, Sequence
+    from pathlib import Path
+
+    import geopandas as gpd
+
+logger = setup_log(__name__)
+
+VECTOR_FORMATS: tuple[str, ...] = ("geojson", "geoparquet", "fgb")
+PATCHABLE_FORMATS: tuple[str, ...] = ("geoparquet", "arrow")
+COMPRESSION: str = "zstd"
+
+
+def typed_columns(anomalies_df: pd.DataFrame) -> pd.DataFrame:
+    """Cast the anomalies to the compact column types of the columnar formats: int32 fids and float32 anomalies."""
+    dtypes = {"fid": np.int32, "anomaly": np.float32, "standardized_index": np.float32}
+    return anomalies_df.astype({column: dtype for column, dtype in dtypes.items() if column in anomalies_df.columns})
+
+
+def with_geometries(anomalies_df: pd.DataFrame, data_dir: Path) -> gpd.GeoDataFrame:
+    """Join the reservoir locations to the anomalies, leaving out reservoirs without a location.
+
+    The fids of the locations are int64, so the anomalies are cast with `typed_columns` after the join.
+    """
+    locations = LocationsIndex(data_dir / "reservoirs-locations-v1.0.gpkg")
+    reservoir_locations = locations.read(anomalies_df["fid"].unique())
+    anomalies_gdf = reservoir_locations.merge(anomalies_df, on="fid", how="inner")
+    return anomalies_gdf[[*anomalies_df.columns, "geometry"]]
+
+
+def _located_chunks(anomaly_chunks: Iterable[pd.DataFrame], data_dir: Path) -> Iterator[gpd.GeoDataFrame]:
+    """Join chunks of anomalies to the reservoir locations, skipping chunks without located reservoirs.
+
+    When no chunk has a located reservoir, the last (empty) chunk is yielded, so that a file without rows is written.
+    """
+    anomalies_gdf = None
+    n_rows = 0
+    for anomalies_df in anomaly_chunks:
+        anomalies_gdf = with_geometries(anomalies_df, data_dir)
+        if not anomalies_gdf.empty:
+            n_rows += len(anomalies_gdf)
+            yield anomalies_gdf
+    if not n_rows and anomalies_gdf is not None:
+        yield anomalies_gdf
+
+
+def _union_bbox(bbox: Sequence[float] | None, anomalies_gdf: gpd.GeoDataFrame) -> Sequence[float] | None:
+    """Extend a bounding box with the geometries of a GeoDataFrame, or get theirs when `bbox` is None."""
+    if anomalies_gdf.empty:
+        return bbox
+    bounds = anomalies_gdf.total_bounds
+    if bbox is None:
+        return bounds
+    return [*np.minimum(bbox[:2], bounds[:2]), *np.maximum(bbox[2:], bounds[2:])]
+
+
+def _to_table(anomalies_gdf: gpd.GeoDataFrame) -> pa.Table:
+    return pa.Table.from_pandas(
+        pd.DataFrame(anomalies_gdf).assign(geometry=anomalies_gdf.geometry.to_wkb()),
+        preserve_index=False,
+    )
+
+
+def write_anomalies(anomalies_df: pd.DataFrame, output_path: Path, output_format: str, data_dir: Path) -> Path:
+    """Write the anomalies to a file.
+
+    Parameters
+    ----------
+    anomalies_df : pd.DataFrame
+        anomalies with at least `fid` and `anomaly` columns
+    output_path : Path
+        path of the file to write, without suffix
+    output_format : str
+        one of FORMATS. GeoParquet, FlatGeobuf and Arrow IPC files hold int32 fids and float32 anomalies, the
+        GeoParquet and Arrow IPC files are compressed with COMPRESSION and the FlatGeobuf file has a spatial index
+    data_dir : Path
+        directory with the reservoir locations file, used by the vector formats
+
+    Returns
+    -------
+    Path
+        path of the written file
+
+    """
+    return write_anomaly_chunks([anomalies_df], output_path, output_format, data_dir)
+
+
+def write_anomaly_chunks(
+    anomaly_chunks: Iterable[pd.DataFrame],
+    output_path: Path,
+    output_format: str,
+    data_dir: Path,
+) -> Path:
+    """Write chunks of anomalies to a file one after the other, holding only one chunk in memory.
+
+    Parameters
+    ----------
+    anomaly_chunks : Iterable[pd.DataFrame]
+        chunks of anomalies with the same columns, including at least `fid` and `anomaly`
+    output_path : Path
+        path of the file to write, without suffix
+    output_format : str
+        one of FORMATS, see `write_anomalies`
+    data_dir : Path
+        directory with the reservoir locations file, used by the vector formats
+
+    Returns
+    -------
+    Path
+        path of the written file
+
+    """
+    if output_format not in FORMATS:
+        err_msg = f"Unknown output format {output_format}, should be one of {', '.join(FORMATS)}"
+        raise ValueError(err_msg)
+    output_path = output_path.with_suffix(FORMATS[output_format])
+    if output_format in VECTOR_FORMATS:
+        anomaly_chunks = _located_chunks(anomaly_chunks, data_dir)
+    if output_format == "geoparquet":
+        return _write_geoparquet_chunks(anomaly_chunks, output_path)
+    with ExitStack() as stack:
+        writer = None
+        n_rows = 0
+        for anomalies_df in anomaly_chunks:
+            if output_format == "csv":
+                anomalies_df.set_axis(range(n_rows, n_rows + len(anomalies_df))).to_csv(
+                    output_path,
+                    mode="a" if n_rows else "w",
+                    header=not n_rows,
+                )
+            elif output_format == "arrow":
+                table = pa.Table.from_pandas(typed_columns(anomalies_df), preserve_index=False)
+                if writer is None:
+                    sink = stack.enter_context(pa.OSFile(str(output_path), "wb"))
+                    options = pa.ipc.IpcWriteOptions(compression=COMPRESSION)
+                    writer = stack.enter_context(pa.ipc.new_file(sink, table.schema, options=options))
+                writer.write_table(table)
+            elif output_format == "geojson":
+                anomalies_df.to_file(output_path, mode="a" if n_rows else "w")
+            else:
+                options = {"driver": "FlatGeobuf", "spatial_index": True}
+                typed_columns(anomalies_df).to_file(output_path, mode="a" if n_rows else "w", **options)
+            n_rows += len(anomalies_df)
+    return output_path
+
+
+def _write_geoparquet_chunks(anomaly_chunks: Iterable[gpd.GeoDataFrame], output_path: Path) -> Path:
+    """Write chunks of located anomalies to a GeoParquet file, with the `geo` metadata of all chunks."""
+    with ExitStack() as stack:
+        writer = None
+        geometry_types: set[str] = set()
+        bbox = None
+        for located_gdf in anomaly_chunks:
+            anomalies_gdf = typed_columns(located_gdf)
+            table = _to_table(anomalies_gdf).replace_schema_metadata()
+            if writer is None:
+                # without the stored Arrow schema, the `geo` metadata of all chunks can be added when closing
+                writer = stack.enter_context(
+                    pq.ParquetWriter(output_path, table.schema, compression=COMPRESSION, store_schema=False),
+                )
+            writer.write_table(table)
+            geometry_types.update(anomalies_gdf.geom_type.dropna())
+            bbox = _union_bbox(bbox, anomalies_gdf)
+            metadata = geoparquet_metadata(anomalies_gdf, geometry_types=geometry_types, bbox=bbox)
+        if writer is not None:
+            writer.add_key_value_metadata({"geo": metadata})
+    return output_path
+
+
+def replace_anomalies(
+    anomalies_df: pd.DataFrame,
+    fids: Iterable[int],
+    output_path: Path,
+    output_format: str,
+    data_dir: Path,
+) -> Path:
+    """Replace the rows of some reservoirs in an existing GeoParquet or Arrow IPC anomalies file.
+
+    The rows of the reservoirs `fids` are dropped from the file and the rows of `anomalies_df` are added, so that only
+    the new rows are typed and joined to their geometries. The other rows are copied from the file as they are. The
+    compressed columns cannot be patched in place, so the file is rewritten to a temporary file that replaces it.
+
+    Parameters
+    ----------
+    anomalies_df : pd.DataFrame
+        new anomalies of the reservoirs, with the columns of the file except `geometry`
+    fids : Iterable[int]
+        reservoir ids whose rows are replaced, including those without new anomalies, whose rows are dropped
+    output_path : Path
+        path of the file, with or without suffix
+    output_format : str
+        one of PATCHABLE_FORMATS
+    data_dir : Path
+        directory with the reservoir locations file, used by GeoParquet
+
+    Returns
+    -------
+    Path
+        path of the file
+
+    """
+    if output_format not in PATCHABLE_FORMATS:
+        err_msg = f"Rows can only be replaced in {', '.join(PATCHABLE_FORMATS)} files, not in {output_format} files"
+        raise ValueError(err_msg)
+    output_path = output_path.with_suffix(FORMATS[output_format])
+    if output_format == "arrow":
+        with pa.OSFile(str(output_path)) as source:
+            table = pa.ipc.open_file(source).read_all()
+    else:
+        table = pq.read_table(output_path)
+    replaced = pc.is_in(table["fid"], value_set=pa.array(list(fids), type=table.schema.field("fid").type))
+    tables = [table.filter(pc.invert(replaced))]
+    if not anomalies_df.empty:
+        if output_format == "arrow":
+            new = pa.Table.from_pandas(typed_columns(anomalies_df), preserve_index=False)
+        else:
+            anomalies_gdf = typed_columns(with_geometries(anomalies_df, data_dir))
+            new = _to_table(anomalies_gdf)
+            # the geometry types and bounding box of the file are extended with those of the new rows
+            geometry = json.loads(table.schema.metadata[b"geo"])["columns"]["geometry"]
+            metadata = geoparquet_metadata(
+                anomalies_gdf,
+                geometry_types={*geometry["geometry_types"], *anomalies_gdf.geom_type.dropna()},
+                bbox=_union_bbox(geometry.get("bbox"), anomalies_gdf),
+            )
+            table = table.replace_schema_metadata({b"geo": metadata})
+        tables.append(new.select(table.schema.names).cast(table.schema))
+    table = pa.concat_tables(tables)
+    table = table.sort_by("fid")
+    # write to a temporary file first, so that an interrupted write keeps the previous file
+    tmp_path = output_path.with_name(f"{output_path.name}.tmp")
+    if output_format == "arrow":
+        options = pa.ipc.IpcWriteOptions(compression=COMPRESSION)
+        with pa.OSFile(str(tmp_path), "wb") as sink, pa.ipc.new_file(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, tmp_path, compression=COMPRESSION)
+    tmp_path.replace(output_path)
+    return output_path
@@ -0,0 +1,253 @@
+"""Scheduled refresh of anomaly files that only recomputes the reservoirs whose time series changed."""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from gww_anomalies.climatology_store import CLIMATOLOGY_CACHE, ClimatologyStore
+from gww_anomalies.defaults import DEFAULT_CONCURRENCY, FORMATS
+from gww_anomalies.gww_api import failed_reservoirs, fetch_reservoirs_ts
+from gww_anomalies.kernel import compute_anomalies, observations_to_arrays
+from gww_anomalies.log import setup_log
+from gww_anomalies.metrics import metrics
+from gww_anomalies.output import PATCHABLE_FORMATS, replace_anomalies, write_anomalies
+from gww_anomalies.utils import _add_months, _parse_reservoir_ids_file, get_month_interval
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+logger = setup_log(__name__)
+
+_CLIMATOLOGY_KEY = b"gww_anomalies:climatology"
+STATE_DTYPES: dict[str, str] = {
+    "fid": "int64",
+    "last_t": "object",
+    "digest": "object",
+    "anomaly": "float64",
+    "monthly_surface_area": "float64",
+}
+
+
+def series_fingerprints(reservoirs_ts: dict[int, list[dict]]) -> pd.DataFrame:
+    """Fingerprint the time series of every reservoir by its last observation time and a hash of its observations.
+
+    Returns
+    -------
+    pd.DataFrame
+        dataframe with `fid`, `last_t` and `digest` columns, `last_t` is empty for reservoirs without observations
+
+    """
+    rows = []
+    for fid, reservoir_ts in reservoirs_ts.items():
+        observations = sorted(((obs["t"], obs["value"]) for obs in reservoir_ts), key=lambda obs: obs[0])
+        digest = hashlib.blake2b(json.dumps(observations).encode(), digest_size=16).hexdigest()
+        rows.append((int(fid), observations[-1][0] if observations else "", digest))
+    return pd.DataFrame(rows, columns=["fid", "last_t", "digest"]).astype({"fid": np.int64})
+
+
+def _climatology_fingerprint(climatology_path: Path) -> bytes:
+    stat = climatology_path.stat()
+    return json.dumps([str(climatology_path.resolve()), stat.st_size, stat.st_mtime_ns]).encode()
+
+
+def _read_state(state_path: Path, climatology_fingerprint: bytes) -> pd.DataFrame:
+    empty = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in STATE_DTYPES.items()})
+    if not state_path.exists():
+        return empty
+    table = pq.read_table(state_path)
+    if (table.schema.metadata or {}).get(_CLIMATOLOGY_KEY) != climatology_fingerprint:
+        logger.info("The climatologies changed since the last refresh, recomputing all reservoirs")
+        return empty
+    return table.to_pandas()
+
+
+def _write_state(state: pd.DataFrame, state_path: Path, climatology_fingerprint: bytes) -> None:
+    table = pa.Table.from_pandas(state, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, _CLIMATOLOGY_KEY: climatology_fingerprint})
+    # write to a temporary file first, so that an interrupted refresh keeps the previous state
+    tmp_path = state_path.with_suffix(".tmp")
+    pq.write_table(table, tmp_path)
+    tmp_path.replace(state_path)
+
+
+def refresh(
+    output_dir: str | Path,
+    data_dir: Path,
+    month: datetime | None = None,
+    reservoir_list: list[int] | None = None,
+    output_format: str = "csv",
+    concurrency: int = DEFAULT_CONCURRENCY,
+    batch_size: int | None = None,
+    use_cache: bool = True,
+) -> list[int]:
+    """Refresh the anomalies file of a month, recomputing only the reservoirs whose time series changed.
+
+    The time series of all reservoirs are retrieved from the GWW API, bypassing the time series cache so that late
+    observations are seen, and fingerprinted with `series_fingerprints`. The fingerprints and anomalies are kept in a
+    `_state.parquet` file next to the anomalies file. Only reservoirs with a new or changed fingerprint are recomputed,
+    and their rows in the state are replaced. The anomalies file is only updated when a reservoir changed or the file
+    does not exist. In existing GeoParquet and Arrow IPC files, only the rows of the changed reservoirs are replaced
+    with `replace_anomalies`, which copies the other rows as they are but still rewrites the compressed file. CSV,
+    GeoJSON and FlatGeobuf files are rewritten from the state, joining all reservoirs to their locations again. All
+    reservoirs are recomputed when the climatologies file changed. Reservoirs for which the retrieval failed keep
+    their previous anomalies.
+
+    Parameters
+    ----------
+    output_dir : str | Path
+        directory of the anomalies file
+    data_dir : Path
+        directory with the climatologies and reservoir locations files
+    month : datetime | None, optional
+        anomalies are calculated for the month before this date, as in `run`, by default the current date
+    reservoir_list : list[int] | None, optional
+        list of reservoir ids, by default None which refreshes all reservoirs with climatology
+    output_format : str, optional
+        format of the anomalies file, one of FORMATS, by default "csv"
+    concurrency : int, optional
+        number of concurrent requests to the GWW API, by default DEFAULT_CONCURRENCY
+    batch_size : int | None, optional
+        initial number of reservoirs fetched per request, by default None which fetches reservoirs one by one
+    use_cache : bool, optional
+        read the climatologies from their memory-mapped copy in the user cache directory, by default True
+
+    Returns
+    -------
+    list[int]
+        reservoir ids whose anomalies were recomputed
+
+    """
+    start, stop = get_month_interval(month or datetime.now())
+    output_path = Path(output_dir) / f"anomalies_{start.month}_{start.year}"
+    state_path = output_path.with_name(f"{output_path.name}_state.parquet")
+    climatology_file = data_dir / "climatologies.parquet"
+    with metrics.stage("climatology_load"):
+        store = ClimatologyStore(climatology_file, cache_dir=CLIMATOLOGY_CACHE if use_cache else None)
+        climatology = store.index([start.month])
+    fids = np.asarray(reservoir_list if reservoir_list else climatology.fid, dtype=np.int64)
+    fids = fids[climatology.locate(fids) >= 0].tolist()
+    with metrics.stage("fetch"):
+        reservoirs_ts = fetch_reservoirs_ts(
+            reservoir_ids=fids,
+            start=start,
+            stop=stop,
+            concurrency=concurrency,
+            batch_size=batch_size,
+        )
+    failed = failed_reservoirs(fids, reservoirs_ts)
+    metrics.record_reservoirs(len(fids), len(failed))
+    if failed:
+        logger.warning("Retrieving the time series failed for %s reservoirs, keeping their anomalies", len(failed))
+
+    climatology_fingerprint = _climatology_fingerprint(climatology_file)
+    previous = _read_state(state_path, climatology_fingerprint)
+    previous = previous[previous["fid"].isin(fids)]
+    fingerprints = series_fingerprints(reservoirs_ts)
+    compared = fingerprints.merge(previous[["fid", "digest"]], on="fid", how="left", suffixes=("", "_previous"))
+    changed = np.sort(compared.loc[compared["digest"] != compared["digest_previous"], "fid"].to_numpy(dtype=np.int64))
+    logger.info("%s of %s reservoirs changed since the last refresh", len(changed), len(fingerprints))
+    output_file = output_path.with_suffix(FORMATS[output_format])
+    if len(changed) == 0 and output_file.exists():
+        return []
+
+    with metrics.stage("compute"):
+        fid, time_, value = observations_to_arrays({fid: reservoirs_ts[fid] for fid in changed.tolist()})
+        in_period = (time_ >= np.datetime64(start)) & (time_ < np.datetime64(stop))
+        anomalies_df = compute_anomalies(fid[in_period], time_[in_period], value[in_period], climatology)
+        recomputed = fingerprints[fingerprints["fid"].isin(changed)].merge(
+            anomalies_df[["fid", "anomaly", "monthly_surface_area"]],
+            on="fid",
+            how="left",
+        )
+        state = pd.concat(
+            [previous[~previous["fid"].isin(changed)], recomputed],
+            ignore_index=True,
+        ).sort_values("fid", ignore_index=True)
+    _write_state(state[list(STATE_DTYPES)].astype(STATE_DTYPES), state_path, climatology_fingerprint)
+
+    with metrics.stage("write"):
+        anomalies = state.loc[state["anomaly"].notna(), ["fid", "anomaly", "monthly_surface_area"]]
+        if output_format in PATCHABLE_FORMATS and output_file.exists():
+            changed_anomalies = anomalies[anomalies["fid"].isin(changed)].reset_index(drop=True)
+            output_file = replace_anomalies(changed_anomalies, changed, output_path, output_format, data_dir)
+            logger.info("Replaced the anomalies of %s reservoirs in %s", len(changed), output_file)
+        elif anomalies.empty:
+            logger.warning("No anomalies calculated for the given reservoirs")
+        else:
+            output_file = write_anomalies(anomalies.reset_index(drop=True), output_path, output_format, data_dir)
+            logger.info("Updated %s reservoirs in %s", len(changed), output_file)
+    return changed.tolist()
+
+
+def refresh_months(n_months: int, now: datetime | None = None) -> Iterator[datetime]:
+    """Iterate over dates that select the `n_months` latest months in `refresh`, latest month first."""
+    now = now or datetime.now()
+    for i in range(n_months):
+        yield _add_months(now, -i)
+
+
+parser = argparse.ArgumentParser(description="Refresh anomaly files, recomputing only reservoirs whose data changed.")
+parser.add_argument("-o", "--output-dir", help="Directory of the anomalies files, by default the data directory")
+parser.add_argument(
+    "-d",
+    "--data-dir",
+    help="Directory with the climatologies and reservoir locations files, by default ./gww-anomalies/data",
+)
+parser.add_argument("-r", "--reservoir_ids_file", help="Text file containing reservoir fids seperated by commas")
+parser.add_argument("-f", "--format", default="csv", choices=list(FORMATS), help="Format of the anomalies files")
+parser.add_argument(
+    "--months",
+    type=int,
+    default=1,
+    help="Number of latest months to refresh on every pass, by default 1. Late observations can change earlier months.",
+)
+parser.add_argument(
+    "--interval",
+    type=float,
+    help="Seconds between passes. By default a single pass is made, for running from a scheduler such as cron.",
+)
+parser.add_argument(
+    "-c",
+    "--concurrency",
+    type=int,
+    default=DEFAULT_CONCURRENCY,
+    help=f"Number of concurrent requests to the GWW API, by default {DEFAULT_CONCURRENCY}",
+)
+parser.add_argument("-b", "--batch-size", type=int, help="Fetch reservoirs in batches per request to the GWW API")
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Refresh the anomalies files once or every `--interval` seconds."""
+    args = parser.parse_args(argv)
+    data_dir = Path(args.data_dir) if args.data_dir else Path(__file__).parent.parent / "data"
+    output_dir = Path(args.output_dir) if args.output_dir else data_dir
+    fid_list = _parse_reservoir_ids_file(fp=args.reservoir_ids_file) if args.reservoir_ids_file else None
+    while True:
+        for month in refresh_months(args.months):
+            refresh(
+                output_dir,
+                data_dir,
+                month=month,
+                reservoir_list=fid_list,
+                output_format=args.format,
+                concurrency=args.concurrency,
+                batch_size=args.batch_size,
+            )
+        if args.interval is None:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
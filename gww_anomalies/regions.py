@@ -0,0 +1,279 @@
+"""Aggregation of reservoir anomalies to the regions of a polygon layer, such as countries or river basins."""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import hashlib
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from gww_anomalies import CACHE_PATH
+from gww_anomalies.defaults import FORMATS
+from gww_anomalies.locations import LocationsIndex, _source_fingerprint
+from gww_anomalies.log import setup_log
+from gww_anomalies.sharding import read_anomalies
+from gww_anomalies.utils import anomalies_name, get_month_interval, get_month_range, parse_date
+
+if TYPE_CHECKING:
+    import geopandas as gpd
+
+logger = setup_log(__name__)
+
+REGIONS_CACHE: Path = CACHE_PATH / "regions"
+_LOCATIONS_KEY = b"gww_anomalies:locations"
+
+
+def layer_hash(path: Path) -> str:
+    """Get the SHA-256 hash of the contents of a polygon layer and its sidecar files.
+
+    The sidecar files are the files next to the layer with the same name and another suffix, such as the `.dbf` file
+    with the attributes of a shapefile. For a layer that is a directory, such as a file geodatabase, all its files
+    are hashed.
+    """
+    path = Path(path)
+    if path.is_dir():
+        paths = sorted(p for p in path.rglob("*") if p.is_file())
+    else:
+        paths = sorted(p for p in path.parent.glob(f"{glob.escape(path.stem)}.*") if p.stem == path.stem)
+    digest = hashlib.sha256()
+    for file_path in paths:
+        digest.update(file_path.name.encode())
+        with file_path.open("rb") as f:
+            while block := f.read(1 << 20):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def join_regions(locations: gpd.GeoDataFrame, regions: gpd.GeoDataFrame, region_column: str) -> pd.DataFrame:
+    """Find the region of every reservoir location with a single query of an STRtree of the region polygons.
+
+    Reservoirs that intersect several regions, for example on a shared border, are assigned to the first of them in
+    the polygon layer. Reservoirs outside all regions are left out.
+
+    Parameters
+    ----------
+    locations : gpd.GeoDataFrame
+        reservoir locations with a `fid` column
+    regions : gpd.GeoDataFrame
+        region polygons
+    region_column : str
+        column of `regions` with the name or code of every region
+
+    Returns
+    -------
+    pd.DataFrame
+        dataframe with `fid` and `region` columns, sorted by fid
+
+    """
+    import shapely
+
+    if locations.crs is not None and regions.crs is not None and locations.crs != regions.crs:
+        locations = locations.to_crs(regions.crs)
+    tree = shapely.STRtree(regions.geometry.to_numpy())
+    location_index, region_index = tree.query(locations.geometry.to_numpy(), predicate="intersects")
+    order = np.lexsort((region_index, location_index))
+    location_index, first = np.unique(location_index[order], return_index=True)
+    mapping = pd.DataFrame(
+        {
+            "fid": locations["fid"].to_numpy()[location_index].astype(np.int64),
+            "region": regions[region_column].to_numpy()[region_index[order][first]],
+        },
+    )
+    return mapping.sort_values("fid", ignore_index=True)
+
+
+def region_mapping(
+    regions_path: Path,
+    region_column: str,
+    locations_path: Path,
+    cache_dir: Path | None = None,
+) -> pd.DataFrame:
+    """Get the region of every reservoir, joining the polygon layer to the reservoir locations only once.
+
+    The mapping is cached in `cache_dir` under the hash of the polygon layer and its sidecar files, see `layer_hash`,
+    and the region column, so that later runs with the same layer skip the spatial join. The mapping is joined again
+    when the reservoir locations file changes.
+
+    Parameters
+    ----------
+    regions_path : Path
+        polygon layer of the regions, in any format readable by GeoPandas
+    region_column : str
+        column of the polygon layer with the name or code of every region
+    locations_path : Path
+        reservoir locations file
+    cache_dir : Path | None, optional
+        directory of the cached mappings, by default None which uses REGIONS_CACHE
+
+    Returns
+    -------
+    pd.DataFrame
+        dataframe with `fid` and `region` columns, sorted by fid
+
+    """
+    cache_dir = REGIONS_CACHE if cache_dir is None else Path(cache_dir)
+    cache_path = cache_dir / f"{layer_hash(regions_path)}_{region_column}.parquet"
+    fingerprint = _source_fingerprint(locations_path)
+    if cache_path.exists():
+        table = pq.read_table(cache_path)
+        if (table.schema.metadata or {}).get(_LOCATIONS_KEY) == fingerprint:
+            return table.to_pandas()
+    import geopandas as gpd
+
+    logger.info("Joining the regions of %s to the reservoir locations", regions_path)
+    regions = gpd.read_file(regions_path)
+    if region_column not in regions.columns:
+        err_msg = f"{regions_path} has no column '{region_column}', choose one of {', '.join(regions.columns)}"
+        raise ValueError(err_msg)
+    locations = LocationsIndex(locations_path)
+    mapping = join_regions(locations.read(locations.fids()), regions, region_column)
+    table = pa.Table.from_pandas(mapping, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, _LOCATIONS_KEY: fingerprint})
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # write to a temporary file first, so that an interrupted write does not leave a partial mapping behind
+    tmp_path = cache_path.with_suffix(".tmp")
+    pq.write_table(table, tmp_path)
+    tmp_path.replace(cache_path)
+    return mapping
+
+
+def aggregate_anomalies(anomalies_df: pd.DataFrame, mapping: pd.DataFrame) -> pd.DataFrame:
+    """Summarize the anomalies of the reservoirs per region, and per month when the anomalies have a `month` column.
+
+    The anomaly of a region is the mean of the anomalies of its reservoirs weighted by their monthly surface water
+    area, so that large reservoirs count more than small ones. Reservoirs with a negative anomaly are below normal.
+    Reservoirs without a region or without an anomaly are left out.
+
+    Parameters
+    ----------
+    anomalies_df : pd.DataFrame
+        anomalies with `fid`, `anomaly` and `monthly_surface_area` columns
+    mapping : pd.DataFrame
+        region of every reservoir, see `region_mapping`
+
+    Returns
+    -------
+    pd.DataFrame
+        dataframe with the `region` (and `month`), the number of reservoirs, their total monthly surface area, the
+        area-weighted mean anomaly and the number and percentage of reservoirs below normal, sorted by region
+
+    """
+    anomalies_df = anomalies_df.merge(mapping, on="fid", how="inner")
+    keys = ["region", "month"] if "month" in anomalies_df.columns else ["region"]
+    anomaly = anomalies_df["anomaly"].to_numpy(dtype=np.float64)
+    weight = anomalies_df["monthly_surface_area"].to_numpy(dtype=np.float64)
+    valid = np.isfinite(anomaly) & np.isfinite(weight)
+    sums = (
+        pd.DataFrame(
+            {
+                "n_reservoirs": valid.astype(np.int64),
+                "monthly_surface_area": np.where(valid, weight, 0),
+                "weighted_anomaly": np.where(valid, weight * anomaly, 0),
+                "below_normal": (valid & (anomaly < 0)).astype(np.int64),
+            },
+        )
+        .groupby([anomalies_df[key] for key in keys], sort=True)
+        .sum()
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sums["anomaly"] = sums.pop("weighted_anomaly") / sums["monthly_surface_area"]
+        sums["percent_below_normal"] = 100 * sums["below_normal"] / sums["n_reservoirs"]
+    columns = ["n_reservoirs", "monthly_surface_area", "anomaly", "below_normal", "percent_below_normal"]
+    return sums[columns].reset_index()
+
+
+def write_region_anomalies(
+    anomalies_df: pd.DataFrame,
+    output_path: Path,
+    regions_path: Path,
+    region_column: str,
+    data_dir: Path,
+) -> Path:
+    """Aggregate anomalies to the regions of a polygon layer and write them to a `_regions.csv` file.
+
+    Parameters
+    ----------
+    anomalies_df : pd.DataFrame
+        anomalies with `fid`, `anomaly` and `monthly_surface_area` columns
+    output_path : Path
+        path of the anomalies file, with or without suffix, next to which the regions file is written
+    regions_path : Path
+        polygon layer of the regions
+    region_column : str
+        column of the polygon layer with the name or code of every region
+    data_dir : Path
+        directory with the reservoir locations file
+
+    Returns
+    -------
+    Path
+        path of the regions file
+
+    """
+    mapping = region_mapping(regions_path, region_column, data_dir / "reservoirs-locations-v1.0.gpkg")
+    regions_df = aggregate_anomalies(anomalies_df, mapping)
+    regions_file = output_path.with_name(f"{Path(output_path).stem}_regions.csv")
+    regions_df.to_csv(regions_file)
+    logger.info("Wrote the anomalies of %s regions to %s", regions_df["region"].nunique(), regions_file)
+    return regions_file
+
+
+parser = argparse.ArgumentParser(description="Aggregate an anomalies file to the regions of a polygon layer.")
+parser.add_argument("regions", help="Polygon layer of the regions, such as countries or river basins")
+parser.add_argument("region_column", help="Column of the polygon layer with the name or code of every region")
+parser.add_argument(
+    "-o",
+    "--output-dir",
+    help="Directory with the anomalies file to write the regions file to, by default the data directory",
+)
+parser.add_argument(
+    "-d",
+    "--data-dir",
+    help="Directory with the reservoir locations file, by default ./gww-anomalies/data",
+)
+parser.add_argument(
+    "-m",
+    "--month",
+    help="Month of the anomalies file, in 'mm-dd-YYYY' format. By default the latest month is used.",
+)
+parser.add_argument("--start-month", help="Start month of the anomalies file, in 'mm-dd-YYYY' format")
+parser.add_argument("--end-month", help="End month of the anomalies file, in 'mm-dd-YYYY' format")
+parser.add_argument(
+    "-f",
+    "--format",
+    choices=list(FORMATS),
+    default="geojson",
+    help="Format of the anomalies file, by default GeoJSON",
+)
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Aggregate an anomalies file to regions from the command line."""
+    args = parser.parse_args(argv)
+    data_dir = Path(args.data_dir) if args.data_dir else Path(__file__).parent.parent / "data"
+    if bool(args.start_month) != bool(args.end_month):
+        parser.error("--start-month and --end-month must be given together")
+    if args.start_month:
+        start, stop = get_month_range(parse_date(args.start_month), parse_date(args.end_month))
+        output_name = anomalies_name(start, stop, month_range=True)
+    else:
+        start, stop = get_month_interval(parse_date(args.month) if args.month else None)
+        output_name = anomalies_name(start, stop)
+    output_path = (Path(args.output_dir) if args.output_dir else data_dir) / output_name
+    write_region_anomalies(
+        read_anomalies(output_path.with_suffix(FORMATS[args.format]), args.format),
+        output_path,
+        Path(args.regions),
+        args.region_column,
+        data_dir,
+    )
+
+
+if __name__ == "__main__":
+    main()
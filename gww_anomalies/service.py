@@ -0,0 +1,357 @@
+"""Long-running HTTP service answering anomaly requests for single reservoirs from in-memory state."""
+
+from __future__ import annotations
+
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import TYPE_CHECKING
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from gww_anomalies.cache import TimeSeriesCache
+from gww_anomalies.climatology_store import CLIMATOLOGY_CACHE, ClimatologyStore
+from gww_anomalies.defaults import DEFAULT_CONCURRENCY
+from gww_anomalies.gww_api import fetch_observations
+from gww_anomalies.kernel import compute_anomalies
+from gww_anomalies.log import setup_log
+from gww_anomalies.utils import get_month_range
+
+if TYPE_CHECKING:
+    from collections.abc import Hashable
+
+logger = setup_log(__name__)
+
+DEFAULT_TTL: float = 3600.0
+DEFAULT_MAX_ENTRIES: int = 100_000
+DEFAULT_MAX_WAIT: float = 0.01
+REQUEST_TIMEOUT: float = 300.0
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe least recently used cache whose entries expire `ttl` seconds after they were stored.
+
+    Parameters
+    ----------
+    max_entries : int, optional
+        number of entries after which the least recently used entry is evicted, by default DEFAULT_MAX_ENTRIES
+    ttl : float, optional
+        seconds an entry stays valid, by default DEFAULT_TTL
+
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float, object]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Get the number of entries, including expired entries that were not looked up since they expired."""
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: object = None) -> object:
+        """Get the value of `key`, or `default` when it is not cached or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, value: object) -> None:
+        """Store `value` under `key`, evicting the least recently used entry when the cache is full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class AnomalyService:
+    """Anomalies of single reservoirs, computed from climatologies and locations that are loaded once.
+
+    Requests that miss the result cache are collected for `max_wait` seconds, so that concurrent requests are answered
+    with one upstream retrieval per month. Concurrent requests for the same reservoir and month share the retrieval.
+    Computed anomalies, including the absence of data, are kept in a `TTLCache`.
+
+    Parameters
+    ----------
+    data_dir : Path
+        directory with the climatologies file and optionally the reservoir locations file
+    use_cache : bool, optional
+        read the climatologies from their memory-mapped copy and the time series through the time series cache, by
+        default True
+    concurrency : int, optional
+        number of concurrent requests to the GWW API, by default DEFAULT_CONCURRENCY
+    batch_size : int | None, optional
+        initial number of reservoirs per `/ts` request, by default None which requests every reservoir separately
+    ttl : float, optional
+        seconds a computed anomaly stays valid, by default DEFAULT_TTL
+    max_entries : int, optional
+        number of computed anomalies to keep, by default DEFAULT_MAX_ENTRIES
+    max_wait : float, optional
+        seconds to collect concurrent requests before retrieving their time series, by default DEFAULT_MAX_WAIT
+
+    """
+
+    def __init__(
+        self,
+        data_dir: Path,
+        use_cache: bool = True,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        batch_size: int | None = None,
+        ttl: float = DEFAULT_TTL,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_wait: float = DEFAULT_MAX_WAIT,
+    ) -> None:
+        store = ClimatologyStore(data_dir / "climatologies.parquet", CLIMATOLOGY_CACHE if use_cache else None)
+        self.climatology = store.index()
+        self.locations = self._load_locations(data_dir / "reservoirs-locations-v1.0.gpkg")
+        self.cache = TimeSeriesCache() if use_cache else None
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.results = TTLCache(max_entries=max_entries, ttl=ttl)
+        self._pending: dict[tuple[int, str], Future] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        threading.Thread(target=self._process_pending, daemon=True).start()
+        logger.info("Loaded the climatologies of %s reservoirs", len(self.climatology))
+
+    def _load_locations(self, locations_path: Path) -> dict[int, tuple[float, float]]:
+        if not locations_path.exists():
+            logger.warning("No reservoir locations file %s, answering without locations", locations_path)
+            return {}
+        from gww_anomalies.locations import LocationsIndex
+
+        locations = LocationsIndex(locations_path).read(self.climatology.fid).to_crs(4326)
+        points = locations.geometry.representative_point()
+        lon_lat = zip(points.x.tolist(), points.y.tolist(), strict=True)
+        return dict(zip(locations["fid"].tolist(), lon_lat, strict=True))
+
+    def has_climatology(self, fid: int) -> bool:
+        """Check if the reservoir has a climatology."""
+        return bool(self.climatology.locate([fid])[0] >= 0)
+
+    def anomaly(self, fid: int, month: datetime, timeout: float = REQUEST_TIMEOUT) -> dict | None:
+        """Get the anomaly of a reservoir in a month, or None when there are no observations in that month.
+
+        Parameters
+        ----------
+        fid : int
+            feature id of a reservoir with climatology
+        month : datetime
+            date in the month to get the anomaly of
+        timeout : float, optional
+            seconds to wait for the time series to be retrieved, by default REQUEST_TIMEOUT
+
+        Returns
+        -------
+        dict | None
+            the fid, month, anomaly and monthly surface area, and the location of the reservoir when known
+
+        """
+        key = (fid, f"{month.year:04d}-{month.month:02d}")
+        result = self.results.get(key, _MISSING)
+        if result is not _MISSING:
+            return result
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = Future()
+                self._wakeup.set()
+        return future.result(timeout=timeout)
+
+    def _process_pending(self) -> None:
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.max_wait)
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._wakeup.clear()
+            by_month: dict[str, dict[int, Future]] = {}
+            for (fid, month), future in pending.items():
+                by_month.setdefault(month, {})[fid] = future
+            for month, futures in by_month.items():
+                try:
+                    results = self._compute(list(futures), datetime.strptime(month, "%Y-%m"))  # noqa: DTZ007
+                except Exception as err:  # noqa: BLE001
+                    logger.warning("Failed to compute anomalies for %s reservoirs in %s: %s", len(futures), month, err)
+                    results = {fid: err for fid in futures}
+                for fid, future in futures.items():
+                    if isinstance(results[fid], Exception):
+                        future.set_exception(results[fid])
+                    else:
+                        future.set_result(results[fid])
+
+    def _compute(self, fids: list[int], month: datetime) -> dict[int, dict | Exception | None]:
+        start, stop = get_month_range(month, month)
+        retrieved, fid, time, value = fetch_observations(
+            reservoir_ids=fids,
+            start=start,
+            stop=stop,
+            concurrency=self.concurrency,
+            batch_size=self.batch_size,
+            cache=self.cache,
+        )
+        retrieved = set(retrieved.tolist())
+        in_period = (time >= np.datetime64(start)) & (time < np.datetime64(stop))
+        anomalies_df = compute_anomalies(fid[in_period], time[in_period], value[in_period], self.climatology)
+        anomalies = {}
+        for row in anomalies_df.itertuples(index=False):
+            fid = int(row.fid)
+            anomalies[fid] = {
+                "fid": fid,
+                "month": start.strftime("%Y-%m"),
+                "anomaly": float(row.anomaly),
+                "monthly_surface_area": float(row.monthly_surface_area),
+            }
+            if fid in self.locations:
+                anomalies[fid]["lon"], anomalies[fid]["lat"] = self.locations[fid]
+        results = {}
+        for fid in fids:
+            # reservoirs whose retrieval failed are not cached, so that they are retried by the next request
+            if fid not in retrieved:
+                results[fid] = LookupError(f"Retrieving the time series of reservoir {fid} failed")
+                continue
+            results[fid] = anomalies.get(fid)
+            self.results.put((fid, start.strftime("%Y-%m")), results[fid])
+        return results
+
+
+class AnomalyHandler(BaseHTTPRequestHandler):
+    """Request handler answering `GET /anomaly?fid=<fid>&month=<YYYY-MM>` with the anomaly of a reservoir as JSON."""
+
+    protocol_version = "HTTP/1.1"
+    # send small responses right away instead of waiting for the acknowledgement of the headers
+    disable_nagle_algorithm = True
+    service: AnomalyService
+
+    def do_GET(self) -> None:
+        """Serve an anomaly or health request."""
+        url = urlparse(self.path)
+        if url.path == "/health":
+            self._send_json(200, {"reservoirs": len(self.service.climatology), "cached": len(self.service.results)})
+            return
+        if url.path != "/anomaly":
+            self._send_json(404, {"detail": "Not Found"})
+            return
+        query = parse_qs(url.query)
+        try:
+            fid = int(query["fid"][0])
+            month = datetime.strptime(query["month"][0], "%Y-%m")  # noqa: DTZ007
+        except (KeyError, ValueError):
+            self._send_json(400, {"detail": "Expected a reservoir id 'fid' and a month 'month' in 'YYYY-MM' format"})
+            return
+        if not self.service.has_climatology(fid):
+            self._send_json(404, {"detail": f"Reservoir {fid} has no climatology"})
+            return
+        try:
+            result = self.service.anomaly(fid, month)
+        except Exception:  # noqa: BLE001
+            self._send_json(502, {"detail": f"Failed to retrieve the time series of reservoir {fid}"})
+            return
+        if result is None:
+            self._send_json(404, {"detail": f"No surface water area of reservoir {fid} in {month:%Y-%m}"})
+            return
+        self._send_json(200, result)
+
+    def _send_json(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        """Silence the per-request access log."""
+
+
+def serve(service: AnomalyService, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Start the anomaly service in a background thread.
+
+    Parameters
+    ----------
+    service : AnomalyService
+        service to answer the requests with
+    host : str, optional
+        host to bind to, by default "127.0.0.1"
+    port : int, optional
+        port to bind to, by default 0 which picks a free port
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        the running server, call `shutdown()` to stop it
+
+    """
+    handler = type("Handler", (AnomalyHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info("Serving anomalies on http://%s:%s", *server.server_address[:2])
+    return server
+
+
+parser = argparse.ArgumentParser(description="Serve reservoir anomalies over HTTP.")
+parser.add_argument("--host", default="127.0.0.1", help="Host to bind the service to")
+parser.add_argument("--port", type=int, default=8080, help="Port to bind the service to")
+parser.add_argument(
+    "-d",
+    "--data-dir",
+    help="Directory with the climatologies and reservoir locations files, by default ./gww-anomalies/data",
+)
+parser.add_argument(
+    "-c",
+    "--concurrency",
+    type=int,
+    default=DEFAULT_CONCURRENCY,
+    help=f"Number of concurrent requests to the GWW API, by default {DEFAULT_CONCURRENCY}",
+)
+parser.add_argument("-b", "--batch-size", type=int, help="Fetch reservoirs in batches per request to the GWW API")
+parser.add_argument("--ttl", type=float, default=DEFAULT_TTL, help="Seconds a computed anomaly is cached")
+parser.add_argument("--max-entries", type=int, default=DEFAULT_MAX_ENTRIES, help="Number of anomalies to cache")
+parser.add_argument(
+    "--cache",
+    help="Use the memory-mapped climatologies and the local time series cache",
+    action=argparse.BooleanOptionalAction,
+    default=True,
+)
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Run the anomaly service until interrupted."""
+    args = parser.parse_args(argv)
+    data_dir = Path(args.data_dir) if args.data_dir else Path(__file__).parent.parent / "data"
+    service = AnomalyService(
+        data_dir,
+        use_cache=args.cache,
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        ttl=args.ttl,
+        max_entries=args.max_entries,
+    )
+    server = serve(service, host=args.host, port=args.port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""Deterministic sharding of the reservoirs across nodes and merging of the shard outputs."""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from gww_anomalies.defaults import FORMATS
+from gww_anomalies.log import setup_log
+from gww_anomalies.output import write_anomalies
+from gww_anomalies.utils import (
+    _parse_reservoir_ids_file,
+    anomalies_name,
+    get_month_interval,
+    get_month_range,
+    parse_date,
+)
+
+logger = setup_log(__name__)
+
+# multiplier of the Fibonacci hash spreading consecutive fids evenly over the shards
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def shard_of(fids: list[int] | np.ndarray, n_shards: int) -> np.ndarray:
+    """Get the 0-based shard of every reservoir id, with a hash that does not depend on the platform or the run."""
+    hashes = np.asarray(fids, dtype=np.int64).astype(np.uint64) * _HASH_MULTIPLIER
+    return ((hashes >> np.uint64(32)) % np.uint64(n_shards)).astype(np.int64)
+
+
+def shard_fids(fids: list[int] | np.ndarray, index: int, n_shards: int) -> np.ndarray:
+    """Get the reservoir ids that belong to the shard `index` of `n_shards` shards, in their original order."""
+    fids = np.asarray(fids, dtype=np.int64)
+    return fids[shard_of(fids, n_shards) == index]
+
+
+def shard_name(output_name: str, index: int, n_shards: int) -> str:
+    """Get the name of the anomalies file of a shard from the name of the merged anomalies file."""
+    return f"{output_name}_shard_{index}_of_{n_shards}"
+
+
+def read_anomalies(path: Path, output_format: str) -> pd.DataFrame:
+    """Read an anomalies file written by `write_anomalies`, without geometries."""
+    if output_format == "csv":
+        return pd.read_csv(path, index_col=0)
+    if output_format == "arrow":
+        with pa.memory_map(str(path)) as source:
+            return pa.ipc.open_file(source).read_pandas()
+    if output_format == "geoparquet":
+        columns = [name for name in pq.read_schema(path).names if name != "geometry"]
+        return pq.read_table(path, columns=columns).to_pandas()
+    import geopandas as gpd
+
+    return pd.DataFrame(gpd.read_file(path, ignore_geometry=True))
+
+
+def merge_shards(
+    output_dir: str | Path,
+    output_name: str,
+    n_shards: int,
+    output_format: str,
+    data_dir: Path,
+    remove: bool = False,
+    fids: list[int] | np.ndarray | None = None,
+) -> Path:
+    """Merge the anomalies files of all shards into the anomalies file of the whole run.
+
+    Before merging, the shards are verified: the files of all shards must exist, every reservoir must belong to the
+    shard it was written by, no reservoir (or reservoir and month) may occur twice and every reservoir of the run must
+    be in the anomalies files, or in the `_failed.txt` or `_no_data.txt` files of the shards, which list the reservoirs
+    for which retrieving the time series failed and those without anomalies in the period. Vector formats are written
+    with the geometries of the reservoir locations file, like the shards. The reservoir ids of the `_failed.txt` and
+    `_no_data.txt` files of the shards are combined in one `_failed.txt` and one `_no_data.txt` file.
+
+    Parameters
+    ----------
+    output_dir : str | Path
+        directory of the shard files and the merged file
+    output_name : str
+        name of the merged file without suffix, see `anomalies_name`
+    n_shards : int
+        number of shards
+    output_format : str
+        format of the shard files and the merged file, one of FORMATS
+    data_dir : Path
+        directory with the reservoir locations file, used by the vector formats
+    remove : bool, optional
+        remove the shard files after merging, by default False
+    fids : list[int] | np.ndarray | None, optional
+        reservoir ids of the whole run, by default None which takes the reservoirs of the climatologies file in
+        `data_dir`, like `run` without a reservoir list
+
+    Returns
+    -------
+    Path
+        path of the merged file
+
+    Raises
+    ------
+    ValueError
+        if a shard file is missing, a reservoir is in the wrong shard, a reservoir occurs more than once or a
+        reservoir of the run is missing
+
+    """
+    output_path = Path(output_dir) / output_name
+    shard_paths = [
+        output_path.with_name(shard_name(output_name, i, n_shards)).with_suffix(FORMATS[output_format])
+        for i in range(n_shards)
+    ]
+    missing = [str(path) for path in shard_paths if not path.exists()]
+    if missing:
+        err_msg = f"Missing the anomalies files of {len(missing)} of {n_shards} shards: {', '.join(missing)}"
+        raise ValueError(err_msg)
+    shards = []
+    for i, path in enumerate(shard_paths):
+        anomalies_df = read_anomalies(path, output_format)
+        misplaced = anomalies_df["fid"][shard_of(anomalies_df["fid"], n_shards) != i]
+        if len(misplaced):
+            err_msg = f"{path} holds {len(misplaced)} reservoirs of other shards, e.g. {misplaced.iloc[0]}"
+            raise ValueError(err_msg)
+        shards.append(anomalies_df)
+    anomalies_df = pd.concat(shards, ignore_index=True)
+    keys = ["fid", "month"] if "month" in anomalies_df.columns else ["fid"]
+    duplicated = anomalies_df.duplicated(keys)
+    if duplicated.any():
+        err_msg = f"{duplicated.sum()} reservoirs occur more than once, e.g. {anomalies_df['fid'][duplicated].iloc[0]}"
+        raise ValueError(err_msg)
+    failed_paths = [path.with_name(f"{path.stem}_failed.txt") for path in shard_paths]
+    failed = _read_fids(failed_paths)
+    no_data_paths = [path.with_name(f"{path.stem}_no_data.txt") for path in shard_paths]
+    no_data = _read_fids(no_data_paths)
+    if fids is None:
+        fids = pq.read_table(Path(data_dir) / "climatologies.parquet", columns=["fid"])["fid"].to_numpy()
+    accounted = np.concatenate([anomalies_df["fid"].to_numpy(dtype=np.int64), failed, no_data])
+    missing = np.setdiff1d(np.asarray(fids, dtype=np.int64), accounted)
+    if len(missing):
+        err_msg = (
+            f"{len(missing)} reservoirs are neither in the anomalies files nor in the _failed.txt or _no_data.txt"
+            f" files of the shards, e.g. {missing[0]}"
+        )
+        raise ValueError(err_msg)
+
+    anomalies_df = anomalies_df.sort_values(keys, ignore_index=True)
+    merged_path = write_anomalies(anomalies_df, output_path, output_format, data_dir)
+    logger.info("Merged %s anomalies of %s shards to %s", len(anomalies_df), n_shards, merged_path)
+    if len(failed):
+        output_path.with_name(f"{output_name}_failed.txt").write_text(",".join(str(fid) for fid in failed))
+        logger.warning("Retrieving the time series failed for %s reservoirs of the shards", len(failed))
+    if len(no_data):
+        output_path.with_name(f"{output_name}_no_data.txt").write_text(",".join(str(fid) for fid in no_data))
+        logger.info("No anomalies were calculated for %s reservoirs of the shards", len(no_data))
+    if remove:
+        for path in [*shard_paths, *failed_paths, *no_data_paths]:
+            path.unlink(missing_ok=True)
+    return merged_path
+
+
+def _read_fids(paths: list[Path]) -> np.ndarray:
+    """Read the reservoir ids of the comma-separated reservoir ids files that exist of `paths`."""
+    return np.array(
+        [int(fid) for path in paths if path.exists() for fid in path.read_text().split(",") if fid.strip()],
+        dtype=np.int64,
+    )
+
+
+parser = argparse.ArgumentParser(description="Combine the anomalies files of the shards of a sharded run.")
+subparsers = parser.add_subparsers(dest="command", required=True)
+merge_parser = subparsers.add_parser("merge", help="Verify and merge the anomalies files of all shards")
+merge_parser.add_argument("-n", "--shards", type=int, required=True, help="Number of shards of the run")
+merge_parser.add_argument(
+    "-o",
+    "--output-dir",
+    help="Directory with the shard files to write the merged file to, by default the data directory",
+)
+merge_parser.add_argument(
+    "-d",
+    "--data-dir",
+    help="Directory with the reservoir locations file, by default ./gww-anomalies/data",
+)
+merge_parser.add_argument(
+    "-m",
+    "--month",
+    help="Month the shards were run with, in 'mm-dd-YYYY' format. By default the latest month is used.",
+)
+merge_parser.add_argument("--start-month", help="Start month the shards were run with, in 'mm-dd-YYYY' format")
+merge_parser.add_argument("--end-month", help="End month the shards were run with, in 'mm-dd-YYYY' format")
+merge_parser.add_argument(
+    "-f",
+    "--format",
+    choices=list(FORMATS),
+    default="geojson",
+    help="Format of the shard files and the merged file, by default GeoJSON",
+)
+merge_parser.add_argument(
+    "-r",
+    "--reservoir_ids_file",
+    help="Text file with the reservoir fids the shards were run with, by default the reservoirs of the climatologies"
+    " file",
+)
+merge_parser.add_argument("--remove-shards", action="store_true", help="Remove the shard files after merging")
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Merge the shard outputs from the command line."""
+    args = parser.parse_args(argv)
+    data_dir = Path(args.data_dir) if args.data_dir else Path(__file__).parent.parent / "data"
+    if bool(args.start_month) != bool(args.end_month):
+        merge_parser.error("--start-month and --end-month must be given together")
+    if args.start_month:
+        start, stop = get_month_range(parse_date(args.start_month), parse_date(args.end_month))
+        output_name = anomalies_name(start, stop, month_range=True)
+    else:
+        start, stop = get_month_interval(parse_date(args.month) if args.month else None)
+        output_name = anomalies_name(start, stop)
+    merge_shards(
+        output_dir=args.output_dir or data_dir,
+        output_name=output_name,
+        n_shards=args.shards,
+        output_format=args.format,
+        data_dir=data_dir,
+        remove=args.remove_shards,
+        fids=_parse_reservoir_ids_file(fp=args.reservoir_ids_file) if args.reservoir_ids_file else None,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Standardized indices of the surface water area from distributions fitted per reservoir and calendar month."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from gww_anomalies.climatology import DIST_PARAMETERS
+from gww_anomalies.kernel import MONTHS, ClimatologyIndex
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Sequence
+
+    import pandas as pd
+
+# the probabilities are clipped to [MIN_PROBABILITY, 1 - MIN_PROBABILITY], bounding the index to about +-4.75
+MIN_PROBABILITY: float = 1e-6
+
+
+def climatology_dist(columns: Iterable[str]) -> str:
+    """Get the distribution of a climatologies table from its columns, "norm" when it only holds means and stds."""
+    columns = set(columns)
+    for dist, parameters in DIST_PARAMETERS.items():
+        if dist != "norm" and f"{parameters[0]}_1" in columns:
+            return dist
+    return "norm"
+
+
+class DistributionIndex(ClimatologyIndex):
+    """Climatology index that also holds the fitted distribution and probability of zero per reservoir-month.
+
+    Parameters
+    ----------
+    fid : np.ndarray
+        reservoir ids
+    mean : np.ndarray
+        (reservoir x month) array with the climatological mean of every month in `months`
+    std : np.ndarray
+        (reservoir x month) array with the climatological standard deviation of every month in `months`
+    dist : str
+        distribution fitted per reservoir and calendar month, one of "norm", "gamma" or "genextreme"
+    parameters : dict[str, np.ndarray]
+        (reservoir x month) array per parameter of the distribution, not needed for "norm"
+    p_zero : np.ndarray | None, optional
+        (reservoir x month) array with the probability of a zero value, by default None which assumes no zero values
+    months : Sequence[int], optional
+        calendar months of the columns of the arrays, by default MONTHS
+
+    """
+
+    def __init__(
+        self,
+        fid: np.ndarray,
+        mean: np.ndarray,
+        std: np.ndarray,
+        dist: str,
+        parameters: dict[str, np.ndarray] | None = None,
+        p_zero: np.ndarray | None = None,
+        months: Sequence[int] = MONTHS,
+    ) -> None:
+        if dist not in DIST_PARAMETERS:
+            err_msg = f"Distribution should be one of {', '.join(DIST_PARAMETERS)}, not '{dist}'"
+            raise ValueError(err_msg)
+        fid = np.asarray(fid, dtype=np.int64)
+        mean, std = np.asarray(mean), np.asarray(std)
+        parameters = {"mean": mean, "std": std} | {name: np.asarray(p) for name, p in (parameters or {}).items()}
+        missing = [name for name in DIST_PARAMETERS[dist] if name not in parameters]
+        if missing:
+            err_msg = f"Missing the {dist} parameters {', '.join(missing)}"
+            raise ValueError(err_msg)
+        p_zero = np.zeros(mean.shape) if p_zero is None else np.asarray(p_zero)
+        if not np.all(fid[:-1] <= fid[1:]):
+            order = np.argsort(fid, kind="stable")
+            fid, p_zero = fid[order], p_zero[order]
+            parameters = {name: p[order] for name, p in parameters.items()}
+        super().__init__(fid, parameters["mean"], parameters["std"], months=months)
+        self.dist = dist
+        self.parameters = {name: parameters[name] for name in DIST_PARAMETERS[dist]}
+        self.p_zero = p_zero
+
+    @classmethod
+    def from_dataframe(cls, climatologies: pd.DataFrame) -> DistributionIndex:
+        """Build the index from a climatologies dataframe, with the distribution given by its columns."""
+        dist = climatology_dist(climatologies.columns)
+        p_zero_columns = [f"p_zero_{m}" for m in MONTHS]
+        return cls(
+            fid=climatologies["fid"].to_numpy(),
+            mean=climatologies[[f"mean_{m}" for m in MONTHS]].to_numpy(),
+            std=climatologies[[f"std_{m}" for m in MONTHS]].to_numpy(),
+            dist=dist,
+            parameters={p: climatologies[[f"{p}_{m}" for m in MONTHS]].to_numpy() for p in DIST_PARAMETERS[dist]},
+            p_zero=climatologies[p_zero_columns].to_numpy() if p_zero_columns[0] in climatologies else None,
+        )
+
+
+def standard_index(fid: np.ndarray, time: np.ndarray, value: np.ndarray, index: DistributionIndex) -> np.ndarray:
+    """Transform values to standard normal quantiles of the distribution of their reservoir and calendar month.
+
+    The probability of every value is the cumulative distribution function of the distribution fitted to its
+    reservoir and calendar month, corrected for the probability of a zero value, after which it is transformed to the
+    standard normal distribution, like the standardized precipitation index. The distribution functions of all values
+    are evaluated in a single call of `scipy.stats`, which requires the `climatology` extras.
+
+    Parameters
+    ----------
+    fid : np.ndarray
+        reservoir id of every value
+    time : np.ndarray
+        datetime64 time of every value
+    value : np.ndarray
+        values to transform
+    index : DistributionIndex
+        fitted distributions of the reservoirs
+
+    Returns
+    -------
+    np.ndarray
+        standardized index of every value, NaN for reservoirs without climatology and for missing values
+
+    """
+    from scipy import stats
+
+    positions = index.locate(fid)
+    found = positions >= 0
+    columns = index.columns(np.asarray(time)[found].astype("datetime64[M]").astype(np.int64) % 12 + 1)
+    rows = positions[found]
+    value = np.asarray(value, dtype=np.float64)[found]
+    p_zero = index.p_zero[rows, columns]
+    parameters = [index.parameters[name][rows, columns] for name in DIST_PARAMETERS[index.dist]]
+    probability = p_zero + (1 - p_zero) * getattr(stats, index.dist).cdf(value, *parameters)
+    probability = np.where((value == 0) & (p_zero > 0), p_zero, probability)
+    standardized = np.full(len(positions), np.nan)
+    standardized[found] = stats.norm.ppf(np.clip(probability, MIN_PROBABILITY, 1 - MIN_PROBABILITY))
+    return standardized
@@ -6,17 +6,22 @@ import logging
 import os
 from datetime import datetime
 from pathlib import Path
-from urllib.request import urlretrieve
+from typing import TYPE_CHECKING
 
-import geopandas as gpd
-import pandas as pd
-from dateutil.relativedelta import relativedelta
+if TYPE_CHECKING:
+    import geopandas as gpd
 
 logger = logging.getLogger()
 
 CUR_DATE = datetime.now()
 
 
+def _add_months(date: datetime, months: int) -> datetime:
+    # first day of the month `months` months after the month of `date`
+    month = date.year * 12 + date.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1, 0, 0)
+
+
 def get_month_interval(date: None | datetime = None) -> tuple[datetime, datetime]:
     """Get the month's start and end date.
 
@@ -26,12 +31,56 @@ def get_month_interval(date: None | datetime = None) -> tuple[datetime, datetime
     if not date:
         date = CUR_DATE
     first_of_month = datetime(date.year, date.month, 1, 0, 0)
-    month = relativedelta(months=1)
-    first_of_last_month = first_of_month - month
+    first_of_last_month = _add_months(first_of_month, -1)
     return first_of_last_month, first_of_month
 
 
+def get_month_range(start_month: datetime | None, end_month: datetime | None) -> tuple[datetime, datetime]:
+    """Get the start and end date of a range of months.
+
+    start_month : datetime
+        datetime in the first month of the range
+    end_month : datetime
+        datetime in the last month of the range, the range includes this month
+
+    Returns
+    -------
+    tuple[datetime, datetime]
+        the first day of the first month and the first day of the month after the last month
+
+    """
+    if start_month is None or end_month is None:
+        err_msg = "Both a start and an end month are required for a range of months"
+        raise ValueError(err_msg)
+    start = datetime(start_month.year, start_month.month, 1, 0, 0)
+    stop = _add_months(end_month, 1)
+    if stop <= start:
+        err_msg = "The end month should not be before the start month"
+        raise ValueError(err_msg)
+    return start, stop
+
+
+def get_calendar_months(start: datetime, stop: datetime) -> list[int]:
+    """Get the calendar months (1-12) of the months from `start` up to `stop`, which is the first day of a month."""
+    months = []
+    month = datetime(start.year, start.month, 1, 0, 0)
+    while month < stop and len(months) < 12:  # noqa: PLR2004
+        months.append(month.month)
+        month = _add_months(month, 1)
+    return sorted(months)
+
+
+def anomalies_name(start: datetime, stop: datetime, month_range: bool = False) -> str:
+    """Get the name, without suffix, of the anomalies file of the month starting at `start` or of a range of months."""
+    if not month_range:
+        return f"anomalies_{start.month}_{start.year}"
+    last = get_month_interval(stop)[0]
+    return f"anomalies_{start.month}_{start.year}_{last.month}_{last.year}"
+
+
 def read_climatology(path, fmt, reservoir_id):
+    import pandas as pd
+
     fn = os.path.join(path, fmt.format(reservoir_id))
     df = pd.read_csv(fn, index_col="time")
     return df
@@ -90,6 +139,8 @@ def bodies_to_df(bodies):
 
 
     """
+    import pandas as pd
+
     dfs = {}
     for k, data in bodies.items():
         index = pd.DatetimeIndex([v["t"] for v in data])
@@ -100,29 +151,56 @@ def bodies_to_df(bodies):
 
 # anomaly computation
 def anomaly(df, df_clim):
-    """Returns
-    -------
-    df : DataFrame of dataset
-        column: reservoir_id
-        index: datetime of anomaly
-
-    """
-    # add common column for month
-    df_clim["month"] = df_clim.index
-    df["month"] = df.index.month
-    df_anom = df.merge(df_clim, on="month", how="left")
-    df_anom.index = df.index
-    df_anom.index.name = "time"
-    df_anom["anomaly"] = (df_anom["surface_area"] - df_anom["mean"]) / df_anom["std"]
-    df_anom.drop(columns=["mean", "std"], inplace=True)
-    return df_anom
+    """Compute the anomalies of the monthly surface water areas of one reservoir, see `anomalies_all`."""
+    return anomalies_all({0: df}, {0: df_clim})[0]
 
 
 def anomalies_all(dfs, dfs_clim):
-    # compute all anomalies for all reservoirs
-    for k in dfs:
-        dfs[k] = anomaly(dfs[k], dfs_clim[k])
-    return dfs
+    """Compute the anomalies of the monthly surface water areas of all reservoirs at once.
+
+    The series of all reservoirs are flattened to one long table and standardized in one vectorized operation with
+    `kernel.standardize`, instead of merging every series with its climatology. The inputs are not modified. For the
+    anomalies of observations retrieved from the GWW API, see `kernel.compute_anomalies` and `kernel.anomaly_cube`.
+
+    Parameters
+    ----------
+    dfs : dict[str, pd.DataFrame]
+        per reservoir id a dataframe indexed by time with a `surface_area` column
+    dfs_clim : dict[str, pd.DataFrame]
+        per reservoir id a dataframe indexed by calendar month (1-12) with `mean` and `std` columns
+
+    Returns
+    -------
+    dict[str, pd.DataFrame]
+        per reservoir id a dataframe indexed by time with `surface_area`, `month` and `anomaly` columns
+
+    """
+    import numpy as np
+    import pandas as pd
+
+    from gww_anomalies.kernel import MONTHS, ClimatologyIndex, standardize
+
+    keys = list(dfs)
+    if not keys:
+        return {}
+    counts = [len(dfs[k]) for k in keys]
+    anomalies_df = pd.concat([dfs[k][["surface_area"]] for k in keys])
+    anomalies_df.index.name = "time"
+    # reservoirs are identified by their position, so that the ids may be strings
+    climatology = ClimatologyIndex(
+        fid=np.arange(len(keys)),
+        mean=np.stack([dfs_clim[k]["mean"].reindex(MONTHS).to_numpy(dtype=float) for k in keys]),
+        std=np.stack([dfs_clim[k]["std"].reindex(MONTHS).to_numpy(dtype=float) for k in keys]),
+    )
+    anomalies_df["month"] = anomalies_df.index.month
+    anomalies_df["anomaly"] = standardize(
+        np.repeat(np.arange(len(keys)), counts),
+        anomalies_df.index.to_numpy().astype("datetime64[s]"),
+        anomalies_df["surface_area"].to_numpy(dtype=float),
+        climatology,
+    )
+    offsets = np.cumsum([0, *counts])
+    return {k: anomalies_df.iloc[offsets[i] : offsets[i + 1]] for i, k in enumerate(keys)}
 
 
 def parse_df_to_body():
@@ -140,6 +218,8 @@ def parse_df_to_body():
 def download_reservoir_geometries(
     reservoir_locations: str | Path,
 ) -> None:
+    from urllib.request import urlretrieve
+
     logging.info("Downloading reservoir locations file from global-water-watch bucket")
     urlretrieve(
         "https://storage.googleapis.com/global-water-watch/shp/reservoirs-locations-v1.0.gpkg",
@@ -162,6 +242,19 @@ def _parse_reservoir_ids_file(fp: Path | str) -> list[int]:
     return fid_list
 
 
+def parse_shard(shard_string: str) -> tuple[int, int]:
+    """Parse a shard 'i/n', the i-th (0-based) of n shards, from a shard string."""
+    try:
+        index, count = (int(x) for x in shard_string.split("/"))
+    except ValueError as err:
+        err_msg = "Incorrect shard format, should be 'i/n'"
+        raise ValueError(err_msg) from err
+    if not 0 <= index < count:
+        err_msg = f"Shard index {index} should be at least 0 and less than the number of shards {count}"
+        raise ValueError(err_msg)
+    return index, count
+
+
 def parse_date(date_string: str) -> datetime:
     """Parse date from date string."""
     date_format = "%m-%d-%Y"
@@ -0,0 +1,82 @@
+from datetime import datetime
+
+from gww_anomalies import gww_api
+from gww_anomalies.cache import TimeSeriesCache, split_months
+from gww_anomalies.fake_api import serve
+
+
+def test_split_months():
+    months = split_months(datetime(2020, 11, 15), datetime(2021, 2, 1))
+    assert [key for key, _, _ in months] == ["2020-11", "2020-12", "2021-01"]
+    assert months[0][1] == datetime(2020, 11, 15)
+    assert months[-1][2] == datetime(2021, 2, 1)
+
+
+def test_plan_and_store(tmp_path):
+    cache = TimeSeriesCache(tmp_path / "cache.sqlite")
+    start, stop = datetime(2020, 1, 1), datetime(2020, 4, 1)
+    cached, span = cache.plan(1, "var", start, stop)
+    assert cached == []
+    assert span == (start, stop)
+
+    observations = [{"t": "2020-01-05T00:00:00", "value": 1.0}, {"t": "2020-03-05T00:00:00", "value": 3.0}]
+    cache.store(1, "var", datetime(2020, 1, 1), datetime(2020, 3, 1), observations)
+    cached, span = cache.plan(1, "var", start, stop)
+    assert cached == observations[:1]
+    assert span == (datetime(2020, 3, 1), stop)
+
+    # months without observations are cached as well
+    cache.store(1, "var", datetime(2020, 3, 1), stop, observations[1:])
+    cached, span = cache.plan(1, "var", start, stop)
+    assert cached == observations
+    assert span is None
+
+
+def test_incomplete_months_are_not_cached(tmp_path):
+    cache = TimeSeriesCache(tmp_path / "cache.sqlite")
+    now = datetime.now()
+    cache.store(1, "var", datetime(now.year, now.month, 1), now, [])
+    _, span = cache.plan(1, "var", datetime(now.year, now.month, 1), now)
+    assert span is not None
+
+
+def test_recent_months_are_not_cached(tmp_path):
+    now = datetime.now()
+    month_stop = datetime(now.year, now.month, 1)
+    month_start = datetime(month_stop.year - (month_stop.month == 1), (month_stop.month - 2) % 12 + 1, 1)
+    # the previous month ended at most 31 days ago
+    cache = TimeSeriesCache(tmp_path / "cache.sqlite", settle_days=31)
+    cache.store(1, "var", month_start, month_stop, [])
+    assert cache.plan(1, "var", month_start, month_stop)[1] == (month_start, month_stop)
+
+    cache.settle_days = 0
+    cache.store(1, "var", month_start, month_stop, [])
+    assert cache.plan(1, "var", month_start, month_stop)[1] is None
+
+
+def test_evict(tmp_path):
+    cache = TimeSeriesCache(tmp_path / "cache.sqlite", max_bytes=10**9)
+    for fid in range(50):
+        observations = [{"t": f"2020-01-{day:02d}T00:00:00", "value": float(day)} for day in range(1, 29)]
+        cache.store(fid, "var", datetime(2020, 1, 1), datetime(2020, 2, 1), observations)
+    size = cache.size()
+    cache.max_bytes = size // 2
+    cache.evict()
+    assert cache.size() <= size // 2
+    # the least recently used reservoirs are evicted first
+    assert cache.plan(0, "var", datetime(2020, 1, 1), datetime(2020, 2, 1))[1] is not None
+    assert cache.plan(49, "var", datetime(2020, 1, 1), datetime(2020, 2, 1))[1] is None
+
+
+def test_get_reservoir_ts_cached(tmp_path, monkeypatch):
+    cache = TimeSeriesCache(tmp_path / "cache.sqlite")
+    server = serve()
+    monkeypatch.setattr(gww_api, "base_url", f"http://127.0.0.1:{server.server_address[1]}")
+    start, stop = datetime(2020, 1, 1), datetime(2020, 3, 1)
+    reservoir_ts = gww_api.get_reservoir_ts(1, start, stop, "surface_water_area", cache=cache)
+    server.shutdown()
+    server.server_close()
+    # with the API down, the time series is served from the cache
+    assert gww_api.get_reservoir_ts(1, start, stop, "surface_water_area", cache=cache) == [
+        {"t": obs["t"], "value": obs["value"]} for obs in reservoir_ts
+    ]
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from gww_anomalies.change_detection import best_breakpoints, change_points, pad
+
+
+def _series(rng, n_series):
+    series = []
+    for i in range(n_series):
+        n = rng.integers(7, 150)
+        values = rng.normal(1e8, 1e7, n)
+        if i % 2:
+            values[rng.integers(1, n) :] += rng.normal(0, 5e7)
+        series.append(values)
+    return series
+
+
+# breakpoints of `_series(np.random.default_rng(0), 50)` found by `ruptures.Dynp(model="l2").predict(n_bkps=1)`
+RUPTURES_BREAKPOINTS = [
+    15,
+    70,
+    10,
+    15,
+    25,
+    10,
+    30,
+    25,
+    15,
+    5,
+    100,
+    50,
+    135,
+    85,
+    70,
+    30,
+    20,
+    45,
+    35,
+    10,
+    5,
+    20,
+    5,
+    75,
+    20,
+    35,
+    15,
+    85,
+    5,
+    5,
+    20,
+    40,
+    45,
+    110,
+    60,
+    70,
+    65,
+    10,
+    130,
+    65,
+    5,
+    5,
+    60,
+    5,
+    15,
+    5,
+    80,
+    30,
+    50,
+    100,
+]
+
+
+def test_best_breakpoints_match_ruptures():
+    series = _series(np.random.default_rng(0), 50)
+    np.testing.assert_array_equal(best_breakpoints(*pad(series)), RUPTURES_BREAKPOINTS)
+
+
+def test_ruptures_breakpoints_fixture():
+    rpt = pytest.importorskip("ruptures")
+    series = _series(np.random.default_rng(0), 50)
+    assert [rpt.Dynp(model="l2").fit(s).predict(n_bkps=1)[0] for s in series] == RUPTURES_BREAKPOINTS
+
+
+def test_change_points_tolerance():
+    filled = np.concatenate([np.full(40, 10.0), np.full(60, 100.0)])
+    emptied = filled[::-1]
+    values, lengths = pad([filled, emptied, filled[:3]])
+    np.testing.assert_array_equal(best_breakpoints(values, lengths), [40, 60, 0])
+    # only an increase to more than 1 / tolerance times the earlier mean is a valid change
+    np.testing.assert_array_equal(change_points(values, lengths, tolerance=0.7), [40, 0, 0])
+    np.testing.assert_array_equal(change_points(values, lengths, tolerance=0.05), [0, 0, 0])
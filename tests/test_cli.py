@@ -0,0 +1,44 @@
+import subprocess
+import sys
+
+import pytest
+
+from gww_anomalies import cli
+
+# cumulative import time of the CLI module in microseconds, measured at about 20 ms
+IMPORT_TIME_BUDGET = 150_000
+HEAVY_MODULES = ("geopandas", "pandas", "numpy", "pyarrow", "requests", "tqdm", "scipy")
+
+
+def _import_times(module: str) -> dict[str, int]:
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_cli_import_time():
+    times = _import_times("gww_anomalies.cli")
+    assert not [module for module in HEAVY_MODULES if module in times]
+    assert times["gww_anomalies.cli"] < IMPORT_TIME_BUDGET
+
+
+def test_cli_argument_error(capsys):
+    with pytest.raises(SystemExit):
+        cli.main(["--start-month", "01-01-2021"])
+    with pytest.raises(SystemExit):
+        cli.main(["-m", "01-01-2021", "--start-month", "01-01-2021", "--end-month", "03-01-2021"])
+    assert "--month cannot be combined with --start-month/--end-month" in capsys.readouterr().err
+
+
+def test_csv_run_does_not_import_geopandas():
+    assert "geopandas" not in _import_times("gww_anomalies.main")
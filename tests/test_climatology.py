@@ -0,0 +1,173 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from gww_anomalies import gww_api
+from gww_anomalies.climatology import (
+    build_climatologies,
+    climatology_columns,
+    fit_climatologies,
+    reservoir_climatology,
+    statistics_path,
+    sufficient_statistics,
+    update_climatologies,
+)
+from gww_anomalies.fake_api import monthly_series, serve
+
+START, STOP = datetime(2000, 1, 1), datetime(2012, 1, 1)
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    server = serve()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setattr(gww_api, "base_url", url)
+    monkeypatch.setenv("GWW_API_URL", url)
+    yield server
+    server.shutdown()
+
+
+def test_reservoir_climatology():
+    reservoir_ts = monthly_series(1, START, STOP, "surface_water_area_monthly")
+    climatology = reservoir_climatology(1, reservoir_ts)
+    assert list(climatology) == climatology_columns("norm")
+    january = pd.DataFrame(reservoir_ts).iloc[::12]["value"]
+    assert climatology["mean_1"] == pytest.approx(january.mean())
+    assert climatology["std_1"] == pytest.approx(january.std(ddof=0))
+    assert reservoir_climatology(1, reservoir_ts[:50]) is None
+
+
+def test_build_climatologies_resumes(fake_api, tmp_path):
+    output_path = tmp_path / "climatologies.parquet"
+    checkpoint_dir = tmp_path / "shards"
+    fids = [1, 2, 3, 4, 5]
+    build_climatologies(fids, output_path, checkpoint_dir, START, STOP, processes=2, shard_size=2, use_cache=False)
+    climatologies = pd.read_parquet(output_path)
+    assert climatologies["fid"].tolist() == fids
+    assert sorted(p.name for p in checkpoint_dir.glob("shard_*.parquet")) == [
+        "shard_00000.parquet",
+        "shard_00001.parquet",
+        "shard_00002.parquet",
+    ]
+
+    # an interrupted build only recomputes the missing shards
+    (checkpoint_dir / "shard_00001.parquet").unlink()
+    output_path.unlink()
+    build_climatologies(fids, output_path, checkpoint_dir, START, STOP, processes=2, shard_size=2, use_cache=False)
+    pd.testing.assert_frame_equal(pd.read_parquet(output_path), climatologies)
+
+    with pytest.raises(ValueError, match="other reservoirs or shard size"):
+        build_climatologies(fids, output_path, checkpoint_dir, START, STOP, shard_size=3, use_cache=False)
+
+
+def test_build_climatologies_skips_failing_reservoirs(fake_api, tmp_path, monkeypatch):
+    monkeypatch.setattr(gww_api, "BACKOFF_BASE", 0.001)
+    fake_api.RequestHandlerClass.failing_ids = frozenset({2})
+    output_path = tmp_path / "climatologies.parquet"
+    build_climatologies([1, 2, 3], output_path, tmp_path / "shards", START, STOP, shard_size=2, use_cache=False)
+    assert pd.read_parquet(output_path)["fid"].tolist() == [1, 3]
+    assert (tmp_path / "climatologies_failed.txt").read_text() == "2"
+
+
+def test_update_climatologies(fake_api, tmp_path):
+    fids = [1, 2, 3]
+    output_path = tmp_path / "climatologies.parquet"
+    build_climatologies(fids, output_path, tmp_path / "shards", START, STOP, processes=1, use_cache=False)
+    climatologies = pd.read_parquet(output_path)
+    assert pd.read_parquet(statistics_path(output_path))["fid"].tolist() == fids
+
+    statistics = pd.read_parquet(statistics_path(output_path))
+    update_climatologies(output_path, datetime(2012, 1, 15), use_cache=False)
+    updated = pd.read_parquet(output_path)
+    january = np.array(
+        [monthly_series(fid, datetime(2012, 1, 1), datetime(2012, 2, 1), "")[0]["value"] for fid in fids],
+    )
+    n = statistics["count_1"].to_numpy()
+    mean = (statistics["mean_1"].to_numpy() * n + january) / (n + 1)
+    m2 = statistics["m2_1"].to_numpy() + n * (statistics["mean_1"].to_numpy() - january) ** 2 / (n + 1)
+    std = np.sqrt(m2 / (n + 1))
+    np.testing.assert_allclose(climatologies["mean_1"], statistics["mean_1"])
+    np.testing.assert_allclose(climatologies["std_1"], np.sqrt(statistics["m2_1"] / n))
+    np.testing.assert_allclose(updated["mean_1"], mean)
+    np.testing.assert_allclose(updated["std_1"], std)
+    unchanged = [column for column in climatologies.columns if column not in ("mean_1", "std_1")]
+    pd.testing.assert_frame_equal(updated[unchanged], climatologies[unchanged])
+
+    # a month that was already added is not added again
+    update_climatologies(output_path, datetime(2012, 1, 1), use_cache=False)
+    pd.testing.assert_frame_equal(pd.read_parquet(output_path), updated)
+
+
+def test_sufficient_statistics_keep_precision():
+    # with values far from zero, sum(x**2) / n - mean**2 cancels out to rounding noise
+    time = np.array(["2000-01", "2001-01", "2002-01"], dtype="datetime64[M]").astype("datetime64[s]")
+    value = np.array([1e9 + 1, 1e9 + 2, 1e9 + 3])
+    statistics = sufficient_statistics(np.ones(3, dtype=int), time, value)
+    assert statistics["count_1"].item() == 3
+    assert statistics["mean_1"].item() == 1e9 + 2
+    assert statistics["m2_1"].item() == pytest.approx(2)
+    assert statistics["m2_2"].item() == 0
+
+
+def test_update_climatologies_aligns_reservoirs(fake_api, tmp_path):
+    output_path = tmp_path / "climatologies.parquet"
+    build_climatologies([1, 2, 3], output_path, tmp_path / "shards", START, STOP, processes=1, use_cache=False)
+    expected_path = tmp_path / "expected" / "climatologies.parquet"
+    expected_path.parent.mkdir()
+    build_climatologies([1, 3], expected_path, tmp_path / "expected_shards", START, STOP, processes=1, use_cache=False)
+    update_climatologies(expected_path, datetime(2012, 1, 1), use_cache=False)
+    # reservoir 2 has statistics but no climatology, and the rows of the climatologies are in another order
+    climatologies = pd.read_parquet(output_path)
+    climatologies[climatologies["fid"] != 2].iloc[::-1].to_parquet(output_path)
+    update_climatologies(output_path, datetime(2012, 1, 1), use_cache=False)
+    updated = pd.read_parquet(output_path).sort_values("fid", ignore_index=True)
+    pd.testing.assert_frame_equal(updated, pd.read_parquet(expected_path))
+
+
+def _monthly_samples(n_reservoirs, n_years):
+    fid = np.repeat(np.arange(n_reservoirs), 12 * n_years)
+    months = np.arange(12 * n_years).astype("timedelta64[M]") + np.datetime64("2000-01")
+    return fid, np.tile(months, n_reservoirs).astype("datetime64[s]")
+
+
+def test_fit_climatologies_norm_matches_scipy():
+    pytest.importorskip("scipy")
+    rng = np.random.default_rng(0)
+    fid, time = _monthly_samples(5, 20)
+    value = rng.normal(1e6, 1e5, size=len(fid))
+    value[: 12 * 16] = np.nan  # reservoir 0 has only 4 samples per calendar month left
+    moments = fit_climatologies(fid, time, value)
+    scipy_fit = fit_climatologies(fid, time, value, method="scipy")
+    assert moments["fid"].tolist() == [1, 2, 3, 4]
+    pd.testing.assert_frame_equal(moments, scipy_fit)
+
+
+@pytest.mark.parametrize(
+    ("dist", "params"),
+    [("gamma", {"a": 5.0, "loc": 0.0, "scale": 2e5}), ("genextreme", {"c": 0.1, "loc": 1e6, "scale": 1e5})],
+)
+def test_fit_climatologies_recovers_parameters(dist, params):
+    stats = pytest.importorskip("scipy.stats")
+    fid, time = _monthly_samples(1, 5000)
+    value = getattr(stats, dist).rvs(size=len(fid), random_state=1, **params)
+    climatology = fit_climatologies(fid, time, value, dist=dist)
+    assert list(climatology.columns) == climatology_columns(dist)
+    for name, expected in params.items():
+        np.testing.assert_allclose(climatology[[f"{name}_{m}" for m in range(1, 13)]], expected, rtol=0.1, atol=0.02)
+
+
+def test_fit_climatologies_include_zero():
+    stats = pytest.importorskip("scipy.stats")
+    fid, time = _monthly_samples(1, 5000)
+    value = stats.gamma.rvs(size=len(fid), random_state=1, a=5.0, scale=2e5)
+    value[::5] = 0
+    climatology = fit_climatologies(fid, time, value, dist="gamma", include_zero=True)
+    assert list(climatology.columns) == climatology_columns("gamma", include_zero=True)
+    np.testing.assert_allclose(climatology[[f"p_zero_{m}" for m in range(1, 13)]], 0.2)
+    np.testing.assert_allclose(climatology[[f"a_{m}" for m in range(1, 13)]], 5.0, rtol=0.1)
+    # the means used for the anomalies include the zeros
+    np.testing.assert_allclose(climatology["mean_1"], value[time.astype("datetime64[M]").astype(int) % 12 == 0].mean())
+    with pytest.raises(ValueError, match="gamma and genextreme"):
+        fit_climatologies(fid, time, value, include_zero=True)
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from gww_anomalies.climatology_store import ClimatologyStore
+
+
+@pytest.fixture
+def climatology_path(tmp_path):
+    data = {"fid": [30, 10, 20]}
+    for m in range(1, 13):
+        data[f"mean_{m}"] = [3e6 + m, 1e6 + m, 2e6 + m]
+        data[f"std_{m}"] = [3e4, 1e4, 2e4]
+    path = tmp_path / "climatologies.parquet"
+    pd.DataFrame(data).to_parquet(path)
+    return path
+
+
+@pytest.mark.parametrize("memory_map", [False, True])
+def test_climatology_store(climatology_path, tmp_path, memory_map):
+    store = ClimatologyStore(climatology_path, cache_dir=tmp_path / "cache" if memory_map else None)
+    np.testing.assert_array_equal(store.fids(), [10, 20, 30])
+    index = store.index([12, 2])
+    assert index.months == (2, 12)
+    assert index.mean.shape == (3, 2)
+    np.testing.assert_array_equal(index.fid, [10, 20, 30])
+    np.testing.assert_allclose(index.mean[:, index.columns([12])[0]], [1e6 + 12, 2e6 + 12, 3e6 + 12])
+    np.testing.assert_allclose(index.std[index.locate([20])[0]], [2e4, 2e4])
+    assert index.mean.dtype == (np.float32 if memory_map else np.float64)
+    with pytest.raises(ValueError, match="calendar months"):
+        index.columns([1])
+
+
+def test_climatology_store_converts_changed_file(climatology_path, tmp_path):
+    ClimatologyStore(climatology_path, cache_dir=tmp_path / "cache")
+    pd.DataFrame({"fid": [5], **{f"{p}_{m}": [1.0] for p in ("mean", "std") for m in range(1, 13)}}).to_parquet(
+        climatology_path,
+    )
+    store = ClimatologyStore(climatology_path, cache_dir=tmp_path / "cache")
+    np.testing.assert_array_equal(store.fids(), [5])
+
+
+def test_distribution_index(climatology_path, tmp_path):
+    climatologies = pd.read_parquet(climatology_path)
+    for m in range(1, 13):
+        climatologies[f"a_{m}"] = [3.0, 1.0, 2.0]
+        climatologies[f"loc_{m}"] = 0.0
+        climatologies[f"scale_{m}"] = [3e5 + m, 1e5 + m, 2e5 + m]
+        climatologies[f"p_zero_{m}"] = [0.3, 0.1, 0.2]
+    climatologies.to_parquet(climatology_path)
+    index = ClimatologyStore(climatology_path, cache_dir=tmp_path / "cache").distribution_index([12, 2])
+    assert index.dist == "gamma"
+    assert index.months == (2, 12)
+    np.testing.assert_array_equal(index.fid, [10, 20, 30])
+    np.testing.assert_allclose(index.parameters["a"], [[1, 1], [2, 2], [3, 3]])
+    np.testing.assert_allclose(index.parameters["scale"][:, 1], [1e5 + 12, 2e5 + 12, 3e5 + 12])
+    np.testing.assert_allclose(index.p_zero[:, 0], [0.1, 0.2, 0.3])
+    np.testing.assert_allclose(index.mean[:, 0], [1e6 + 2, 2e6 + 2, 3e6 + 2])
@@ -0,0 +1,130 @@
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from gww_anomalies import gww_api
+from gww_anomalies.cube import AnomalyCube
+from gww_anomalies.fake_api import serve
+from gww_anomalies.main import run
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    server = serve()
+    monkeypatch.setattr(gww_api, "base_url", f"http://127.0.0.1:{server.server_address[1]}")
+    yield server
+    server.shutdown()
+
+
+def anomalies(fids, months):
+    fids, months = np.meshgrid(fids, pd.to_datetime(months))
+    fids, months = fids.ravel(), pd.DatetimeIndex(months.ravel())
+    return pd.DataFrame(
+        {
+            "fid": fids,
+            "month": months,
+            "anomaly": fids + months.month / 100,
+            "monthly_surface_area": fids * 1e6,
+        },
+    )
+
+
+def test_anomaly_cube(tmp_path):
+    cube = AnomalyCube(tmp_path / "cube")
+    assert cube.read().shape == (0, 0)
+    cube.update(anomalies([3, 1], ["2021-01-01", "2021-02-01"]))
+    # a new reservoir, an earlier month and an overwritten month
+    cube.update(anomalies([2], ["2020-11-01"]))
+    cube.update(anomalies([1], ["2021-02-01"]).assign(anomaly=-1.0))
+
+    cube = AnomalyCube(tmp_path / "cube")
+    np.testing.assert_array_equal(cube.fid, [1, 2, 3])
+    np.testing.assert_array_equal(cube.months, np.arange("2020-11", "2021-03", dtype="datetime64[M]"))
+    assert cube.read().shape == (4, 3)
+    np.testing.assert_allclose(cube.reservoir(1), [np.nan, np.nan, 1.01, -1.0])
+    np.testing.assert_allclose(cube.reservoir(3), [np.nan, np.nan, 3.01, 3.02], rtol=1e-6)
+    np.testing.assert_allclose(cube.month("2020-11"), [np.nan, 2.11, np.nan], rtol=1e-6)
+    np.testing.assert_allclose(cube.month(datetime(2021, 1, 1), "monthly_surface_area"), [1e6, np.nan, 3e6])
+    with pytest.raises(KeyError, match="Reservoir 4"):
+        cube.reservoir(4)
+    with pytest.raises(KeyError, match="Month 2021-03"):
+        cube.month("2021-03")
+
+
+def test_anomaly_cube_appends_months_in_place(tmp_path):
+    cube = AnomalyCube(tmp_path / "cube")
+    cube.update(anomalies([1, 2], ["2021-01-01"]))
+    inode = (tmp_path / "cube" / "anomaly.npy").stat().st_ino
+    for month in ("2021-02-01", "2021-03-01"):
+        cube.update(anomalies([1, 2], [month]))
+    # the months of a year are allocated at once, so appending a month does not rewrite the arrays
+    assert (tmp_path / "cube" / "anomaly.npy").stat().st_ino == inode
+    np.testing.assert_allclose(cube.month("2021-03"), [1.03, 2.03], rtol=1e-6)
+
+
+def test_anomaly_cube_interrupted_reallocation(tmp_path, monkeypatch):
+    cube = AnomalyCube(tmp_path / "cube")
+    cube.update(anomalies([1, 2], ["2021-01-01"]))
+
+    # interrupted before the metadata of the new arrays is written, the previous cube is kept
+    def interrupted_save(*_: object) -> None:
+        err_msg = "interrupted"
+        raise OSError(err_msg)
+
+    with monkeypatch.context() as m:
+        m.setattr(np, "save", interrupted_save)
+        with pytest.raises(OSError, match="interrupted"):
+            AnomalyCube(tmp_path / "cube").update(anomalies([3], ["2021-01-01"]))
+    cube = AnomalyCube(tmp_path / "cube")
+    np.testing.assert_array_equal(cube.fid, [1, 2])
+    np.testing.assert_allclose(cube.month("2021-01"), [1.01, 2.01], rtol=1e-6)
+
+    # interrupted after it, between moving the arrays and the fids into place, the reallocation is completed when
+    # the cube is opened again
+    replace = Path.replace
+
+    def interrupted_replace(path: Path, target: Path) -> Path:
+        if Path(target).name == "fid.npy":
+            err_msg = "interrupted"
+            raise OSError(err_msg)
+        return replace(path, target)
+
+    with monkeypatch.context() as m:
+        m.setattr(Path, "replace", interrupted_replace)
+        with pytest.raises(OSError, match="interrupted"):
+            AnomalyCube(tmp_path / "cube").update(anomalies([3], ["2021-01-01"]))
+    cube = AnomalyCube(tmp_path / "cube")
+    np.testing.assert_array_equal(cube.fid, [1, 2, 3])
+    # the values of the interrupted write itself are not in the cube
+    np.testing.assert_allclose(cube.month("2021-01"), [1.01, 2.01, np.nan], rtol=1e-6)
+    assert sorted(path.name for path in (tmp_path / "cube").iterdir()) == [
+        "anomaly.npy",
+        "cube.json",
+        "fid.npy",
+        "monthly_surface_area.npy",
+    ]
+
+
+def test_run_cube(fake_api, tmp_path):
+    data = {"fid": [1, 2, 3]}
+    for m in range(1, 13):
+        data[f"mean_{m}"] = [1e6, 2e6, 3e6]
+        data[f"std_{m}"] = [1e5, 1e5, 1e5]
+    pd.DataFrame(data).to_parquet(tmp_path / "climatologies.parquet")
+    for month in (datetime(2021, 2, 1), datetime(2021, 3, 1)):
+        run(
+            output_dir=tmp_path,
+            data_dir=tmp_path,
+            month=month,
+            output_format="csv",
+            use_cache=False,
+            cube_path=tmp_path / "cube",
+        )
+    cube = AnomalyCube(tmp_path / "cube")
+    np.testing.assert_array_equal(cube.fid, [1, 2, 3])
+    np.testing.assert_array_equal(cube.months, np.array(["2021-01", "2021-02"], dtype="datetime64[M]"))
+    anomalies_df = pd.read_csv(tmp_path / "anomalies_1_2021.csv", index_col=0)
+    np.testing.assert_allclose(cube.month("2021-01"), anomalies_df["anomaly"], rtol=1e-6)
@@ -0,0 +1,32 @@
+import json
+
+import numpy as np
+import pytest
+
+from gww_anomalies import decode
+from gww_anomalies.decode import decode_source_data
+
+
+@pytest.mark.parametrize("orjson", [decode.orjson, None])
+def test_decode_source_data(monkeypatch, orjson):
+    monkeypatch.setattr(decode, "orjson", orjson)
+    body = {
+        "source_data": {
+            "3": [{"t": "2020-01-05T00:00:00", "value": 1.0}, {"t": "2020-01-10T12:00:00", "value": None}],
+            "1": [{"t": "2020-02-05T00:00:00", "value": "2"}],
+            "2": [],
+        },
+    }
+    fids, fid, time, value = decode_source_data(json.dumps(body).encode())
+    assert fids.dtype == fid.dtype == np.int32
+    np.testing.assert_array_equal(fids, [3, 1, 2])
+    np.testing.assert_array_equal(fid, [3, 3, 1])
+    np.testing.assert_array_equal(time, np.array(["2020-01-05", "2020-01-10T12", "2020-02-05"], "datetime64[s]"))
+    np.testing.assert_array_equal(value, [1.0, np.nan, 2.0])
+
+
+def test_decode_source_data_without_data():
+    fids, fid, time, value = decode_source_data(b'{"source_data": null}')
+    assert len(fids) == len(fid) == len(time) == len(value) == 0
+    with pytest.raises(KeyError):
+        decode_source_data(b'{"detail": "Not Found"}')
@@ -0,0 +1,192 @@
+import time
+from datetime import datetime
+
+import numpy as np
+import pytest
+import requests
+
+from gww_anomalies import gww_api
+from gww_anomalies.fake_api import serve
+from gww_anomalies.kernel import observations_to_arrays
+
+LATENCY = 0.05
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    server = serve(latency=LATENCY)
+    host, port = server.server_address[:2]
+    monkeypatch.setattr(gww_api, "base_url", f"http://{host}:{port}")
+    yield server
+    server.shutdown()
+
+
+def test_get_reservoir_ts(fake_api):
+    reservoir_ts = gww_api.get_reservoir_ts(1, datetime(2020, 1, 1), datetime(2020, 2, 1), "surface_water_area")
+    assert len(reservoir_ts) == 7
+    assert set(reservoir_ts[0]) == {"t", "value", "name", "unit"}
+
+
+def test_get_reservoirs_ts_concurrent(fake_api):
+    fids = list(range(40))
+    reservoirs_ts = gww_api.get_reservoirs_ts(
+        fids,
+        datetime(2020, 1, 1),
+        datetime(2020, 2, 1),
+        "surface_water_area",
+        concurrency=20,
+    )
+    assert sorted(reservoirs_ts) == fids
+    assert all(len(ts) == 7 for ts in reservoirs_ts.values())
+    # the requests overlap instead of being sent one after the other
+    assert fake_api.RequestHandlerClass.in_flight.peak > 1
+
+
+def test_adaptive_batch_sizer():
+    sizer = gww_api.AdaptiveBatchSizer(initial=10, target_time=1.0, max_bytes=1000)
+    sizer.update(n_reservoirs=10, elapsed=0.1, nbytes=100)
+    assert sizer.size == 20
+    sizer.update(n_reservoirs=20, elapsed=4.0, nbytes=100)
+    assert sizer.size == 5
+    sizer.update(n_reservoirs=5, elapsed=0.01, nbytes=5000)
+    assert sizer.size == 1
+
+
+def test_get_reservoirs_ts_batched(monkeypatch):
+    monkeypatch.setattr(gww_api, "BACKOFF_BASE", 0.001)
+    server = serve(failing_ids={13})
+    monkeypatch.setattr(gww_api, "base_url", f"http://127.0.0.1:{server.server_address[1]}")
+    fids = list(range(100))
+    try:
+        reservoirs_ts = gww_api.get_reservoirs_ts_batched(
+            fids,
+            datetime(2020, 1, 1),
+            datetime(2020, 3, 1),
+            concurrency=4,
+            batch_size=10,
+        )
+    finally:
+        server.shutdown()
+    assert sorted(reservoirs_ts) == [fid for fid in fids if fid != 13]
+    assert all(len(ts) == 2 for ts in reservoirs_ts.values())
+
+
+def test_get_observations_batched(monkeypatch):
+    monkeypatch.setattr(gww_api, "BACKOFF_BASE", 0.001)
+    server = serve(failing_ids={13})
+    monkeypatch.setattr(gww_api, "base_url", f"http://127.0.0.1:{server.server_address[1]}")
+    fids = list(range(100))
+    try:
+        arguments = {"start": datetime(2020, 1, 1), "stop": datetime(2020, 3, 1), "concurrency": 4, "batch_size": 10}
+        retrieved, fid, time_, value = gww_api.get_observations_batched(fids, **arguments)
+        reservoirs_ts = gww_api.get_reservoirs_ts_batched(fids, **arguments)
+    finally:
+        server.shutdown()
+    assert sorted(retrieved.tolist()) == sorted(reservoirs_ts)
+    assert gww_api.failed_reservoirs(fids, set(retrieved.tolist())) == [13]
+    order = np.lexsort((time_, fid))
+    expected = observations_to_arrays(dict(sorted(reservoirs_ts.items())))
+    np.testing.assert_array_equal(fid[order], expected[0])
+    np.testing.assert_array_equal(time_[order], expected[1])
+    np.testing.assert_array_equal(value[order], expected[2])
+
+
+def test_aimd_limiter():
+    limiter = gww_api.AIMDLimiter(initial=4, maximum=10, target_latency=1.0)
+    tokens = [limiter.acquire() for _ in range(4)]
+    assert limiter.in_flight == 4
+    # slow start: one more request in flight per successful response
+    limiter.release(tokens.pop(), latency=0.1)
+    assert limiter.limit == 5
+    limiter.release(tokens.pop(), latency=2.0)
+    assert limiter.limit == 5
+    # a burst of overloads sent before the decrease halves the limit once
+    limiter.release(tokens.pop(), latency=0.1, overloaded=True)
+    limiter.release(tokens.pop(), latency=0.1, overloaded=True)
+    assert limiter.limit == 2.5
+    # after the first overload the limit grows by about one per round trip
+    limiter.release(limiter.acquire(), latency=0.1)
+    assert limiter.limit == pytest.approx(2.9)
+    assert limiter.in_flight == 0
+
+
+def test_get_reports_attempt_latency(monkeypatch):
+    monkeypatch.setattr(gww_api, "_backoff", lambda attempt, response: 0.2)  # noqa: ARG005
+    statuses = iter([429, 200])
+
+    class Session:
+        def get(self, url, params, timeout) -> requests.Response:  # noqa: ARG002
+            time.sleep(0.02)
+            response = requests.Response()
+            response.status_code = next(statuses)
+            response._content = b"[]"  # noqa: SLF001
+            return response
+
+    limiter = gww_api.AIMDLimiter(initial=1, maximum=1)
+    response = gww_api._get(Session(), "http://gww.test/ts", {}, limiter)  # noqa: SLF001
+    assert response.status_code == 200
+    # the backoff after the 429 response is not part of the latency of the retry
+    assert 0.02 <= response.elapsed.total_seconds() < 0.1
+
+
+def test_batch_sizer_ignores_client_side_waits(monkeypatch, mocker):
+    server = serve()
+    monkeypatch.setattr(gww_api, "base_url", f"http://127.0.0.1:{server.server_address[1]}")
+    multi_reservoir_request = gww_api._multi_reservoir_request  # noqa: SLF001
+
+    def queued_request(*args: object, **kwargs: object) -> requests.Response:
+        # waiting for the limiter or a backoff happens before the request is sent
+        time.sleep(0.2)
+        return multi_reservoir_request(*args, **kwargs)
+
+    mocker.patch.object(gww_api, "_multi_reservoir_request", side_effect=queued_request)
+    update = mocker.spy(gww_api.AdaptiveBatchSizer, "update")
+    try:
+        gww_api.get_reservoirs_ts_batched(
+            list(range(20)),
+            datetime(2020, 1, 1),
+            datetime(2020, 3, 1),
+            concurrency=2,
+            batch_size=5,
+        )
+    finally:
+        server.shutdown()
+    assert update.call_args_list
+    assert all(call.args[2] < 0.2 for call in update.call_args_list)
+
+
+def test_get_reservoirs_ts_retries_and_isolates_failures(monkeypatch):
+    monkeypatch.setattr(gww_api, "BACKOFF_BASE", 0.001)
+    server = serve(latency=0.01, failing_ids={7}, error_rate=0.2, capacity=4)
+    monkeypatch.setattr(gww_api, "base_url", f"http://127.0.0.1:{server.server_address[1]}")
+    fids = list(range(30))
+    try:
+        reservoirs_ts = gww_api.get_reservoirs_ts(
+            fids,
+            datetime(2020, 1, 1),
+            datetime(2020, 2, 1),
+            "surface_water_area",
+            concurrency=16,
+        )
+    finally:
+        server.shutdown()
+    assert gww_api.failed_reservoirs(fids, reservoirs_ts) == [7]
+    assert all(len(ts) == 7 for ts in reservoirs_ts.values())
+
+
+def test_fake_api_n_reservoirs(monkeypatch):
+    server = serve(n_reservoirs=5)
+    monkeypatch.setattr(gww_api, "base_url", f"http://127.0.0.1:{server.server_address[1]}")
+    try:
+        reservoirs_ts = gww_api.get_reservoirs_ts_batched(
+            list(range(10)),
+            datetime(2020, 1, 1),
+            datetime(2020, 3, 1),
+            concurrency=2,
+            batch_size=10,
+        )
+        reservoir_ts = gww_api.get_reservoir_ts(7, datetime(2020, 1, 1), datetime(2020, 2, 1), "surface_water_area")
+    finally:
+        server.shutdown()
+    assert sorted(fid for fid, ts in reservoirs_ts.items() if ts) == [1, 2, 3, 4, 5]
+    assert reservoir_ts == []
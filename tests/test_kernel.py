@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+from gww_anomalies.kernel import (
+    ClimatologyIndex,
+    anomaly_cube,
+    compute_anomalies,
+    monthly_means,
+    observations_to_arrays,
+    standardize,
+)
+
+
+def _climatologies(fids):
+    data = {"fid": fids}
+    for m in range(1, 13):
+        data[f"mean_{m}"] = [100.0 * m] * len(fids)
+        data[f"std_{m}"] = [10.0] * len(fids)
+    return pd.DataFrame(data)
+
+
+def test_observations_to_arrays():
+    fid, time, value = observations_to_arrays(
+        {
+            3: [{"t": "2020-01-05T00:00:00", "value": 1.0}, {"t": "2020-01-10T00:00:00", "value": None}],
+            1: [{"t": "2020-02-05T00:00:00", "value": 2.0}],
+            2: [],
+        },
+    )
+    np.testing.assert_array_equal(fid, [3, 3, 1])
+    assert time.dtype == np.dtype("datetime64[s]")
+    np.testing.assert_array_equal(value, [1.0, np.nan, 2.0])
+
+
+def test_monthly_means():
+    fid = np.array([2, 1, 2, 2, 1])
+    time = np.array(["2020-01-01", "2020-01-01", "2020-01-20", "2020-02-01", "1969-12-01"], dtype="datetime64[s]")
+    value = np.array([1.0, 5.0, 3.0, 7.0, np.nan])
+    fids, months, means = monthly_means(fid, time, value)
+    np.testing.assert_array_equal(fids, [1, 2, 2])
+    np.testing.assert_array_equal(months, np.array(["2020-01", "2020-01", "2020-02"], dtype="datetime64[M]"))
+    np.testing.assert_array_equal(means, [5.0, 2.0, 7.0])
+
+
+def test_climatology_index_locate():
+    index = ClimatologyIndex.from_dataframe(_climatologies([30, 10, 20]))
+    np.testing.assert_array_equal(index.fid, [10, 20, 30])
+    np.testing.assert_array_equal(index.locate([20, 40, 10, 5]), [1, -1, 0, -1])
+
+
+def test_compute_anomalies():
+    index = ClimatologyIndex.from_dataframe(_climatologies([1, 2]))
+    fid = np.array([1, 1, 2, 3])
+    time = np.array(["2020-03-01", "2020-03-11", "2020-12-01", "2020-03-01"], dtype="datetime64[s]")
+    value = np.array([290.0, 310.0, 1220.0, 1.0])
+    anomalies = compute_anomalies(fid, time, value, index)
+    assert anomalies["fid"].tolist() == [1, 2]
+    np.testing.assert_allclose(anomalies["monthly_surface_area"], [300.0, 1220.0])
+    np.testing.assert_allclose(anomalies["anomaly"], [0.0, 2.0])
+
+
+def test_standardize():
+    index = ClimatologyIndex.from_dataframe(_climatologies([1, 2]))
+    time = np.array(["2020-03-01", "2020-12-31", "2020-03-01"], dtype="datetime64[s]")
+    anomaly = standardize(np.array([1, 2, 3]), time, np.array([290.0, 1220.0, 1.0]), index)
+    np.testing.assert_allclose(anomaly, [-1.0, 2.0, np.nan])
+
+
+def test_anomaly_cube():
+    index = ClimatologyIndex.from_dataframe(_climatologies([1, 2]))
+    fid = np.array([2, 1, 1, 2, 3])
+    time = np.array(["2020-01-05", "2020-03-01", "2020-03-11", "2020-03-01", "2020-02-01"], dtype="datetime64[s]")
+    value = np.array([120.0, 290.0, 310.0, 310.0, 1.0])
+    fids, months, monthly_surface_area, anomaly = anomaly_cube(fid, time, value, index)
+    np.testing.assert_array_equal(fids, [1, 2])
+    np.testing.assert_array_equal(months, np.array(["2020-01", "2020-02", "2020-03"], dtype="datetime64[M]"))
+    np.testing.assert_allclose(monthly_surface_area, [[np.nan, np.nan, 300.0], [120.0, np.nan, 310.0]])
+    np.testing.assert_allclose(anomaly, [[np.nan, np.nan, 0.0], [2.0, np.nan, 1.0]])
+    # the history of every reservoir matches the long-format anomalies
+    anomalies = compute_anomalies(fid, time, value, index).dropna()
+    rows = np.searchsorted(fids, anomalies["fid"])
+    columns = np.searchsorted(months, anomalies["month"].to_numpy().astype("datetime64[M]"))
+    np.testing.assert_allclose(anomaly[rows, columns], anomalies["anomaly"])
+
+    period = {"start": np.datetime64("2020-03"), "stop": np.datetime64("2020-05")}
+    _, months, _, anomaly = anomaly_cube(fid, time, value, index, **period)
+    assert months.tolist() == [np.datetime64("2020-03"), np.datetime64("2020-04")]
+    np.testing.assert_allclose(anomaly, [[0.0, np.nan], [1.0, np.nan]])
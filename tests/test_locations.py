@@ -0,0 +1,50 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely import points
+
+from gww_anomalies import locations
+from gww_anomalies.locations import LocationsIndex
+
+
+@pytest.fixture
+def locations_file(tmp_path):
+    fids = np.random.default_rng(0).permutation(np.arange(1, 101))
+    reservoir_locations = gpd.GeoDataFrame(
+        {"feature_id": fids, "name": [f"reservoir {fid}" for fid in fids]},
+        geometry=points(fids, -fids),
+        crs="EPSG:4326",
+    )
+    path = tmp_path / "reservoirs-locations-v1.0.gpkg"
+    reservoir_locations.to_file(path)
+    return path
+
+
+def test_locations_index(locations_file, tmp_path, monkeypatch):
+    monkeypatch.setattr(locations, "ROW_GROUP_SIZE", 10)
+    index = LocationsIndex(locations_file, tmp_path / "locations.parquet")
+    assert index.fids() == list(range(1, 101))
+    assert index.row_groups([5, 7, 55, 1000]) == [0, 5]
+
+    reservoir_locations = index.read([55, 5, 1000])
+    assert reservoir_locations["fid"].tolist() == [5, 55]
+    assert list(reservoir_locations.columns) == ["fid", "geometry"]
+    assert reservoir_locations.geometry.x.tolist() == [5, 55]
+    assert reservoir_locations.crs == "EPSG:4326"
+    assert index.read([5], columns=["name"])["name"].tolist() == ["reservoir 5"]
+    assert index.read([]).empty
+
+
+def test_locations_index_reconverts_changed_file(locations_file, tmp_path):
+    cache_path = tmp_path / "locations.parquet"
+    LocationsIndex(locations_file, cache_path)
+    converted = cache_path.stat().st_mtime_ns
+    LocationsIndex(locations_file, cache_path)
+    assert cache_path.stat().st_mtime_ns == converted
+
+    stat = locations_file.stat()
+    os.utime(locations_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    LocationsIndex(locations_file, cache_path)
+    assert cache_path.stat().st_mtime_ns != converted
@@ -1,14 +1,38 @@
+import json
 import logging
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 
+import geopandas as gpd
 import pandas as pd
 import pytest
+from shapely import points
 
-from gww_anomalies.main import calculate_anomalies, run
+from gww_anomalies import gww_api, main, output
+from gww_anomalies.fake_api import serve
+from gww_anomalies.locations import LocationsIndex
+from gww_anomalies.main import calculate_anomalies, calculate_monthly_anomalies, run
 from gww_anomalies.utils import get_month_interval
 
 
+@pytest.fixture
+def fake_api(monkeypatch):
+    server = serve()
+    monkeypatch.setattr(gww_api, "base_url", f"http://127.0.0.1:{server.server_address[1]}")
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def climatologies():
+    data = {"fid": [1, 2, 3]}
+    for m in range(1, 13):
+        data[f"mean_{m}"] = [1e6, 2e6, 3e6]
+        data[f"std_{m}"] = [1e5, 1e5, 1e5]
+    return pd.DataFrame(data)
+
+
 def test_run(caplog, tmp_path, mocker):
     caplog.set_level(logging.INFO)
     output_path = run(output_dir=tmp_path, reservoir_list=[14299])
@@ -27,10 +51,124 @@ def test_calculate_anomalies():
 
     climatologies_df = pd.read_parquet(test_data)
     fid_list = [90249, 91611]
-    start, stop = get_month_interval(date= datetime(2020,1,1))
+    start, stop = get_month_interval(date=datetime(2020, 1, 1))
     anomalies = calculate_anomalies(climatologies_df, fid_list, start, stop)
     assert isinstance(anomalies, pd.DataFrame)
     assert len(anomalies) == 2
 
 
+def test_calculate_monthly_anomalies(fake_api, climatologies):
+    anomalies = calculate_monthly_anomalies(climatologies, [1, 2, 4], datetime(2020, 1, 1), datetime(2020, 4, 1))
+    assert anomalies["fid"].tolist() == [1, 1, 1, 2, 2, 2]
+    assert anomalies["month"].dt.month.tolist() == [1, 2, 3, 1, 2, 3]
+
+
+def test_run_month_range(fake_api, climatologies, tmp_path):
+    climatologies.to_parquet(tmp_path / "climatologies.parquet")
+    output_path = run(
+        output_dir=tmp_path,
+        data_dir=tmp_path,
+        start_month=datetime(2020, 11, 1),
+        end_month=datetime(2021, 2, 1),
+        as_vector=False,
+        use_cache=False,
+    )
+    assert output_path.name == "anomalies_11_2020_2_2021.csv"
+    anomalies = pd.read_csv(output_path)
+    assert len(anomalies) == 12
+    assert not anomalies.duplicated(["fid", "month"]).any()
+
+
+def test_run_as_vector(fake_api, climatologies, tmp_path, monkeypatch):
+    climatologies.to_parquet(tmp_path / "climatologies.parquet")
+    reservoir_locations = gpd.GeoDataFrame({"feature_id": [3, 2, 1]}, geometry=points([3, 2, 1], [0, 0, 0]), crs=4326)
+    reservoir_locations.to_file(tmp_path / "reservoirs-locations-v1.0.gpkg")
+    monkeypatch.setattr(output, "LocationsIndex", partial(LocationsIndex, cache_path=tmp_path / "locations.parquet"))
+    output_path = run(
+        output_dir=tmp_path,
+        data_dir=tmp_path,
+        reservoir_list=[1, 3, 4],
+        month=datetime(2021, 2, 1),
+        as_vector=True,
+        use_cache=False,
+    )
+    anomalies = gpd.read_file(output_path)
+    assert sorted(anomalies["fid"]) == [1, 3]
+    assert (tmp_path / "anomalies_1_2021_no_data.txt").read_text() == "4"
+    assert list(anomalies.columns) == ["fid", "anomaly", "monthly_surface_area", "geometry"]
+    assert sorted(anomalies.geometry.x) == [1, 3]
+
+
+def test_run_resume(fake_api, climatologies, tmp_path, mocker):
+    climatologies.to_parquet(tmp_path / "climatologies.parquet")
+    arguments = {
+        "output_dir": tmp_path,
+        "data_dir": tmp_path,
+        "month": datetime(2021, 2, 1),
+        "output_format": "csv",
+        "use_cache": False,
+        "chunk_size": 1,
+    }
+    fetch_observations = main.fetch_observations
+
+    def interrupted_fetch(reservoir_ids, **kwargs):
+        if reservoir_ids == [2]:
+            raise KeyboardInterrupt
+        return fetch_observations(reservoir_ids, **kwargs)
+
+    mocker.patch.object(main, "fetch_observations", side_effect=interrupted_fetch)
+    with pytest.raises(KeyboardInterrupt):
+        run(**arguments)
+    parts_dir = tmp_path / "anomalies_1_2021_parts"
+    assert [p.name for p in sorted(parts_dir.glob("part_*"))] == ["part_00000.parquet"]
+
+    mocker.patch.object(main, "fetch_observations", side_effect=fetch_observations)
+    spy = mocker.spy(main, "calculate_anomalies")
+    output_path = run(**arguments, resume=True)
+    assert [call.kwargs["fids"] for call in spy.call_args_list] == [[2], [3]]
+    anomalies = pd.read_csv(output_path, index_col=0)
+    assert anomalies["fid"].tolist() == [1, 2, 3]
+    assert anomalies.index.tolist() == [0, 1, 2]
+    assert not parts_dir.exists()
+
+
+def test_run_dead_letters(fake_api, climatologies, tmp_path, monkeypatch):
+    monkeypatch.setattr(gww_api, "BACKOFF_BASE", 0.001)
+    fake_api.RequestHandlerClass.failing_ids = frozenset({2})
+    climatologies.to_parquet(tmp_path / "climatologies.parquet")
+    output_path = run(
+        output_dir=tmp_path,
+        data_dir=tmp_path,
+        month=datetime(2021, 2, 1),
+        output_format="csv",
+        use_cache=False,
+        chunk_size=2,
+    )
+    assert pd.read_csv(output_path)["fid"].tolist() == [1, 3]
+    assert (tmp_path / "anomalies_1_2021_failed.txt").read_text() == "2"
+    report = json.loads((tmp_path / "anomalies_1_2021_report.json").read_text())
+    assert report["failed"] == 1
+    assert report["no_data"] == 0
+    assert not (tmp_path / "anomalies_1_2021_no_data.txt").exists()
+    assert report["metrics"]["failed_reservoirs"] == 1
+    assert report["metrics"]["requests"]["by_status"]["500"] > 0
+    assert set(report["metrics"]["stages"]) == {"climatology_load", "fetch", "compute", "write"}
+
 
+def test_run_standardized_index(fake_api, climatologies, tmp_path):
+    for m in range(1, 13):
+        climatologies[f"a_{m}"] = [100.0, 400.0, 900.0]
+        climatologies[f"loc_{m}"] = 0.0
+        climatologies[f"scale_{m}"] = 1e4
+    climatologies.to_parquet(tmp_path / "climatologies.parquet")
+    output_path = run(
+        output_dir=tmp_path,
+        data_dir=tmp_path,
+        month=datetime(2021, 2, 1),
+        output_format="csv",
+        use_cache=False,
+        standardized_index=True,
+    )
+    anomalies = pd.read_csv(output_path, index_col=0)
+    assert list(anomalies.columns) == ["fid", "anomaly", "standardized_index", "monthly_surface_area"]
+    assert anomalies["standardized_index"].notna().all()
@@ -0,0 +1,35 @@
+import json
+
+from gww_anomalies.metrics import RunMetrics
+
+
+def test_run_metrics(tmp_path):
+    metrics = RunMetrics(buckets=(0.1, 1.0))
+    with metrics.stage("fetch"):
+        pass
+    metrics.record_stage("fetch", 2.0)
+    metrics.record_request(0.05, 200, nbytes=100)
+    metrics.record_request(0.5, 503)
+    metrics.record_request(5.0, None)
+    metrics.record_cache(hits=3, misses=1)
+    metrics.record_reservoirs(10, 1)
+    report = metrics.to_dict()
+    assert report["stages"]["fetch"] >= 2.0
+    assert report["requests"]["count"] == 3
+    assert report["requests"]["by_status"] == {"200": 1, "503": 1, "error": 1}
+    assert report["requests"]["response_bytes"] == 100
+    assert report["requests"]["latency_seconds"]["buckets"] == {"0.1": 1, "1.0": 1, "+Inf": 1}
+    assert report["cache"] == {"hits": 3, "misses": 1}
+    assert (report["reservoirs"], report["failed_reservoirs"]) == (10, 1)
+
+    metrics.write_json(tmp_path / "report.json", parameters={"month": "2021-02"})
+    assert json.loads((tmp_path / "report.json").read_text())["metrics"]["requests"]["count"] == 3
+    metrics.write_prometheus(tmp_path / "metrics.prom")
+    text = (tmp_path / "metrics.prom").read_text()
+    assert 'gww_anomalies_requests_total{status="503"} 1' in text
+    assert 'gww_anomalies_request_duration_seconds_bucket{le="1.0"} 2' in text
+    assert 'gww_anomalies_request_duration_seconds_bucket{le="+Inf"} 3' in text
+    assert "gww_anomalies_cache_hits_total 3" in text
+
+    metrics.reset()
+    assert metrics.to_dict()["requests"]["count"] == 0
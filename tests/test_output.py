@@ -0,0 +1,113 @@
+import json
+from functools import partial
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyogrio
+import pytest
+from shapely import points
+
+from gww_anomalies import output
+from gww_anomalies.locations import LocationsIndex
+from gww_anomalies.output import (
+    FORMATS,
+    PATCHABLE_FORMATS,
+    VECTOR_FORMATS,
+    replace_anomalies,
+    write_anomalies,
+    write_anomaly_chunks,
+)
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    reservoir_locations = gpd.GeoDataFrame({"feature_id": [1, 2, 3]}, geometry=points([1, 2, 3], [0, 0, 0]), crs=4326)
+    reservoir_locations.to_file(tmp_path / "reservoirs-locations-v1.0.gpkg")
+    monkeypatch.setattr(output, "LocationsIndex", partial(LocationsIndex, cache_path=tmp_path / "locations.parquet"))
+    return tmp_path
+
+
+@pytest.fixture
+def anomalies_df():
+    return pd.DataFrame({"fid": [3, 1], "anomaly": [0.5, -1.25], "monthly_surface_area": [1e6, 2e6]})
+
+
+@pytest.mark.parametrize("output_format", list(FORMATS))
+def test_write_anomalies(anomalies_df, data_dir, tmp_path, output_format):
+    output_path = write_anomalies(anomalies_df, tmp_path / "anomalies", output_format, data_dir)
+    assert output_path == tmp_path / f"anomalies{FORMATS[output_format]}"
+    if output_format == "csv":
+        written = pd.read_csv(output_path, index_col=0)
+    elif output_format == "arrow":
+        with pa.memory_map(str(output_path)) as source:
+            table = pa.ipc.open_file(source).read_all()
+        assert table.schema.field("fid").type == pa.int32()
+        assert table.schema.field("anomaly").type == pa.float32()
+        written = table.to_pandas()
+    elif output_format in ("geoparquet", "fgb"):
+        if output_format == "geoparquet":
+            schema = pq.read_schema(output_path)
+            assert schema.field("fid").type == pa.int32()
+            assert schema.field("anomaly").type == pa.float32()
+            written = gpd.read_parquet(output_path)
+        else:
+            info = pyogrio.read_info(output_path)
+            fields = dict(zip(info["fields"], info["dtypes"], strict=True))
+            assert fields == {"fid": "int32", "anomaly": "float32", "monthly_surface_area": "float64"}
+            written = gpd.read_file(output_path)
+        assert sorted(written.geometry.x) == [1, 3]
+        written = written.sort_values("fid", ascending=False, ignore_index=True).drop(columns="geometry")
+    else:
+        written = gpd.read_file(output_path)
+        assert sorted(written.geometry.x) == [1, 3]
+        written = written.sort_values("fid", ascending=False, ignore_index=True).drop(columns="geometry")
+    assert written["fid"].tolist() == [3, 1]
+    np.testing.assert_allclose(written["anomaly"], anomalies_df["anomaly"])
+
+
+def test_write_anomalies_unknown_format(anomalies_df, data_dir, tmp_path):
+    with pytest.raises(ValueError, match="Unknown output format"):
+        write_anomalies(anomalies_df, tmp_path / "anomalies", "shp", data_dir)
+
+
+@pytest.mark.parametrize("output_format", VECTOR_FORMATS)
+def test_write_anomaly_chunks_without_locations(anomalies_df, data_dir, tmp_path, output_format):
+    # the reservoirs of the first chunk have no location
+    unlocated = pd.DataFrame({"fid": [7, 8], "anomaly": [1.0, 2.0], "monthly_surface_area": [1e6, 1e6]})
+    chunks = [unlocated, anomalies_df.iloc[:1], unlocated, anomalies_df.iloc[1:]]
+    output_path = write_anomaly_chunks(chunks, tmp_path / "anomalies", output_format, data_dir)
+    written = gpd.read_parquet(output_path) if output_format == "geoparquet" else gpd.read_file(output_path)
+    assert sorted(written["fid"]) == [1, 3]
+    if output_format == "geoparquet":
+        geo = json.loads(pq.read_schema(output_path).metadata[b"geo"])["columns"]["geometry"]
+        assert geo["geometry_types"] == ["Point"]
+        # the bounding box covers the geometries of all chunks
+        assert geo["bbox"] == [1, 0, 3, 0]
+
+    output_path = write_anomaly_chunks([unlocated], tmp_path / "empty", output_format, data_dir)
+    empty = gpd.read_parquet(output_path) if output_format == "geoparquet" else gpd.read_file(output_path)
+    assert empty.empty
+
+
+@pytest.mark.parametrize("output_format", PATCHABLE_FORMATS)
+def test_replace_anomalies(anomalies_df, data_dir, tmp_path, output_format):
+    output_path = write_anomalies(anomalies_df.sort_values("fid"), tmp_path / "anomalies", output_format, data_dir)
+    new = pd.DataFrame({"fid": [2, 3], "anomaly": [2.0, -0.5], "monthly_surface_area": [3e6, 4e6]})
+    # reservoir 1 has no new anomaly, so its row is dropped
+    assert replace_anomalies(new, [1, 2, 3], output_path, output_format, data_dir) == output_path
+    if output_format == "arrow":
+        with pa.memory_map(str(output_path)) as source:
+            table = pa.ipc.open_file(source).read_all()
+    else:
+        table = pq.read_table(output_path)
+        assert gpd.read_parquet(output_path).geometry.x.tolist() == [2, 3]
+    assert table.schema.field("fid").type == pa.int32()
+    assert table.schema.field("anomaly").type == pa.float32()
+    assert table["fid"].to_pylist() == [2, 3]
+    np.testing.assert_allclose(table["anomaly"].to_numpy(), [2.0, -0.5])
+
+    with pytest.raises(ValueError, match="Rows can only be replaced"):
+        replace_anomalies(new, [2], tmp_path / "anomalies", "csv", data_dir)
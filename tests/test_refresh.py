@@ -0,0 +1,101 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from gww_anomalies import gww_api, refresh
+from gww_anomalies.fake_api import serve
+from gww_anomalies.refresh import refresh_months, series_fingerprints
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    server = serve()
+    monkeypatch.setattr(gww_api, "base_url", f"http://127.0.0.1:{server.server_address[1]}")
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    data = {"fid": [1, 2, 3]}
+    for m in range(1, 13):
+        data[f"mean_{m}"] = [1e6, 2e6, 3e6]
+        data[f"std_{m}"] = [1e5, 1e5, 1e5]
+    pd.DataFrame(data).to_parquet(tmp_path / "climatologies.parquet")
+    return tmp_path
+
+
+def test_series_fingerprints():
+    observations = [{"t": "2021-01-06T00:00:00", "value": 2.0}, {"t": "2021-01-01T00:00:00", "value": 1.0}]
+    fingerprints = series_fingerprints({1: observations, 2: observations[::-1], 3: observations[1:], 4: []})
+    assert fingerprints["last_t"].tolist() == ["2021-01-06T00:00:00", "2021-01-06T00:00:00", "2021-01-01T00:00:00", ""]
+    digests = fingerprints["digest"].tolist()
+    assert digests[0] == digests[1]
+    assert len(set(digests)) == 3
+
+
+def test_refresh_months():
+    months = list(refresh_months(3, now=datetime(2021, 2, 15)))
+    assert months == [datetime(2021, 2, 1), datetime(2021, 1, 1), datetime(2020, 12, 1)]
+
+
+def test_refresh(fake_api, data_dir, mocker):
+    arguments = {"output_dir": data_dir, "data_dir": data_dir, "month": datetime(2021, 2, 1), "use_cache": False}
+    assert refresh.refresh(**arguments) == [1, 2, 3]
+    output_path = data_dir / "anomalies_1_2021.csv"
+    first = pd.read_csv(output_path, index_col=0)
+    assert first["fid"].tolist() == [1, 2, 3]
+
+    # nothing changed, so nothing is recomputed or rewritten
+    mtime = output_path.stat().st_mtime_ns
+    assert refresh.refresh(**arguments) == []
+    assert output_path.stat().st_mtime_ns == mtime
+
+    # a late observation for reservoir 2 only recomputes reservoir 2
+    fetch_reservoirs_ts = refresh.fetch_reservoirs_ts
+
+    def late_observation(**kwargs):
+        reservoirs_ts = fetch_reservoirs_ts(**kwargs)
+        reservoirs_ts[2] = [*reservoirs_ts[2], {"t": "2021-01-31T00:00:00", "value": 5e6}]
+        return reservoirs_ts
+
+    mocker.patch.object(refresh, "fetch_reservoirs_ts", side_effect=late_observation)
+    compute = mocker.spy(refresh, "compute_anomalies")
+    assert refresh.refresh(**arguments) == [2]
+    assert set(compute.call_args.args[0].tolist()) == {2}
+    patched = pd.read_csv(output_path, index_col=0)
+    assert patched["fid"].tolist() == [1, 2, 3]
+    assert patched.loc[patched["fid"] != 2, "anomaly"].tolist() == first.loc[first["fid"] != 2, "anomaly"].tolist()
+    assert patched.loc[patched["fid"] == 2, "anomaly"].item() > first.loc[first["fid"] == 2, "anomaly"].item()
+
+
+def test_refresh_replaces_rows(fake_api, data_dir, mocker):
+    arguments = {
+        "output_dir": data_dir,
+        "data_dir": data_dir,
+        "month": datetime(2021, 2, 1),
+        "output_format": "arrow",
+        "use_cache": False,
+    }
+    assert refresh.refresh(**arguments) == [1, 2, 3]
+    output_path = data_dir / "anomalies_1_2021.arrow"
+    first = pd.read_feather(output_path)
+
+    fetch_reservoirs_ts = refresh.fetch_reservoirs_ts
+
+    def late_observation(**kwargs):
+        reservoirs_ts = fetch_reservoirs_ts(**kwargs)
+        reservoirs_ts[2] = [*reservoirs_ts[2], {"t": "2021-01-31T00:00:00", "value": 5e6}]
+        return reservoirs_ts
+
+    mocker.patch.object(refresh, "fetch_reservoirs_ts", side_effect=late_observation)
+    write = mocker.spy(refresh, "write_anomalies")
+    replace = mocker.spy(refresh, "replace_anomalies")
+    assert refresh.refresh(**arguments) == [2]
+    write.assert_not_called()
+    assert replace.call_args.args[0]["fid"].tolist() == [2]
+    patched = pd.read_feather(output_path)
+    assert patched["fid"].tolist() == [1, 2, 3]
+    assert patched.loc[patched["fid"] != 2, "anomaly"].tolist() == first.loc[first["fid"] != 2, "anomaly"].tolist()
+    assert patched.loc[patched["fid"] == 2, "anomaly"].item() > first.loc[first["fid"] == 2, "anomaly"].item()
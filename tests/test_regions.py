@@ -0,0 +1,112 @@
+from datetime import datetime
+from functools import partial
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely import box, points
+
+from gww_anomalies import gww_api, output, regions
+from gww_anomalies.fake_api import serve
+from gww_anomalies.locations import LocationsIndex
+from gww_anomalies.main import run
+from gww_anomalies.regions import aggregate_anomalies, join_regions, region_mapping
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    # reservoirs 1-3 in region A, 4 on the border of A and B, 5 in B and 6 outside both
+    x = [0.5, 1.5, 1.0, 2.0, 3.0, 9.0]
+    reservoir_locations = gpd.GeoDataFrame({"feature_id": [1, 2, 3, 4, 5, 6]}, geometry=points(x, [0.5] * 6), crs=4326)
+    reservoir_locations.to_file(tmp_path / "reservoirs-locations-v1.0.gpkg")
+    gpd.GeoDataFrame({"name": ["A", "B"]}, geometry=[box(0, 0, 2, 1), box(2, 0, 4, 1)], crs=4326).to_file(
+        tmp_path / "regions.gpkg",
+    )
+    locations_index = partial(LocationsIndex, cache_path=tmp_path / "locations.parquet")
+    monkeypatch.setattr(output, "LocationsIndex", locations_index)
+    monkeypatch.setattr(regions, "LocationsIndex", locations_index)
+    monkeypatch.setattr(regions, "REGIONS_CACHE", tmp_path / "regions")
+    return tmp_path
+
+
+def test_join_regions(data_dir):
+    locations = gpd.read_file(data_dir / "reservoirs-locations-v1.0.gpkg").rename(columns={"feature_id": "fid"})
+    mapping = join_regions(locations.iloc[::-1], gpd.read_file(data_dir / "regions.gpkg").to_crs(3857), "name")
+    assert mapping["fid"].tolist() == [1, 2, 3, 4, 5]
+    assert mapping["region"].tolist() == ["A", "A", "A", "A", "B"]
+
+
+def test_region_mapping_is_cached(data_dir, mocker):
+    locations_path = data_dir / "reservoirs-locations-v1.0.gpkg"
+    mapping = region_mapping(data_dir / "regions.gpkg", "name", locations_path, cache_dir=data_dir / "regions")
+    join = mocker.patch.object(regions, "join_regions", wraps=regions.join_regions)
+    cached = region_mapping(data_dir / "regions.gpkg", "name", locations_path, cache_dir=data_dir / "regions")
+    pd.testing.assert_frame_equal(cached, mapping)
+    join.assert_not_called()
+    # another layer is joined again
+    gpd.read_file(data_dir / "regions.gpkg").iloc[::-1].to_file(data_dir / "regions.gpkg")
+    region_mapping(data_dir / "regions.gpkg", "name", locations_path, cache_dir=data_dir / "regions")
+    join.assert_called_once()
+    with pytest.raises(ValueError, match="has no column 'basin'"):
+        region_mapping(data_dir / "regions.gpkg", "basin", locations_path, cache_dir=data_dir / "regions")
+
+
+def test_region_mapping_hashes_sidecars(data_dir, mocker):
+    regions_gdf = gpd.read_file(data_dir / "regions.gpkg")
+    regions_gdf.to_file(data_dir / "regions.shp")
+    locations_path = data_dir / "reservoirs-locations-v1.0.gpkg"
+    region_mapping(data_dir / "regions.shp", "name", locations_path)
+    assert len(list((data_dir / "regions").glob("*_name.parquet"))) == 1
+    # renamed regions only change the attributes in the .dbf file
+    (data_dir / "renamed").mkdir()
+    regions_gdf.assign(name=["C", "D"]).to_file(data_dir / "renamed" / "regions.shp")
+    (data_dir / "renamed" / "regions.dbf").replace(data_dir / "regions.dbf")
+    mapping = region_mapping(data_dir / "regions.shp", "name", locations_path)
+    assert mapping["region"].tolist() == ["C", "C", "C", "C", "D"]
+
+
+def test_aggregate_anomalies():
+    mapping = pd.DataFrame({"fid": [1, 2, 3, 4], "region": ["A", "A", "A", "B"]})
+    anomalies_df = pd.DataFrame(
+        {
+            "fid": [1, 2, 3, 4, 5],
+            "anomaly": [-1.0, 2.0, np.nan, -0.5, 1.0],
+            "monthly_surface_area": [3e6, 1e6, 1e6, 2e6, 1e6],
+        },
+    )
+    regions_df = aggregate_anomalies(anomalies_df, mapping)
+    assert regions_df["region"].tolist() == ["A", "B"]
+    assert regions_df["n_reservoirs"].tolist() == [2, 1]
+    np.testing.assert_allclose(regions_df["monthly_surface_area"], [4e6, 2e6])
+    np.testing.assert_allclose(regions_df["anomaly"], [(-3 + 2) / 4, -0.5])
+    assert regions_df["below_normal"].tolist() == [1, 1]
+    np.testing.assert_allclose(regions_df["percent_below_normal"], [50, 100])
+
+    monthly = aggregate_anomalies(pd.concat([anomalies_df.assign(month=m) for m in (1, 2)]), mapping)
+    assert monthly[["region", "month"]].to_numpy().tolist() == [["A", 1], ["A", 2], ["B", 1], ["B", 2]]
+
+
+def test_run_regions(data_dir, monkeypatch):
+    server = serve()
+    monkeypatch.setattr(gww_api, "base_url", f"http://127.0.0.1:{server.server_address[1]}")
+    data = {"fid": [1, 2, 5]}
+    for m in range(1, 13):
+        data[f"mean_{m}"] = [1e6, 2e6, 3e6]
+        data[f"std_{m}"] = [1e5, 1e5, 1e5]
+    pd.DataFrame(data).to_parquet(data_dir / "climatologies.parquet")
+    try:
+        run(
+            output_dir=data_dir,
+            data_dir=data_dir,
+            month=datetime(2021, 2, 1),
+            output_format="csv",
+            use_cache=False,
+            regions_path=data_dir / "regions.gpkg",
+            region_column="name",
+        )
+    finally:
+        server.shutdown()
+    regions_df = pd.read_csv(data_dir / "anomalies_1_2021_regions.csv", index_col=0)
+    assert regions_df["region"].tolist() == ["A", "B"]
+    assert regions_df["n_reservoirs"].tolist() == [2, 1]
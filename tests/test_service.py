@@ -0,0 +1,81 @@
+import json
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+
+import geopandas as gpd
+import pandas as pd
+import pytest
+from shapely import points
+
+from gww_anomalies import gww_api, locations, service
+from gww_anomalies.fake_api import serve as serve_fake_api
+from gww_anomalies.service import AnomalyService, TTLCache, serve
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    server = serve_fake_api(latency=0.05)
+    monkeypatch.setattr(gww_api, "base_url", f"http://127.0.0.1:{server.server_address[1]}")
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    data = {"fid": [1, 2, 3]}
+    for m in range(1, 13):
+        data[f"mean_{m}"] = [1e6, 2e6, 3e6]
+        data[f"std_{m}"] = [1e5, 1e5, 1e5]
+    pd.DataFrame(data).to_parquet(tmp_path / "climatologies.parquet")
+    reservoir_locations = gpd.GeoDataFrame({"feature_id": [1, 2]}, geometry=points([5, 6], [50, 51]), crs=4326)
+    reservoir_locations.to_file(tmp_path / "reservoirs-locations-v1.0.gpkg")
+    locations_index = partial(locations.LocationsIndex, cache_path=tmp_path / "locations.parquet")
+    monkeypatch.setattr(locations, "LocationsIndex", locations_index)
+    return tmp_path
+
+
+def test_ttl_cache(monkeypatch):
+    cache = TTLCache(max_entries=2, ttl=10)
+    cache.put("a", 1)
+    cache.put("b", None)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    # "b" is the least recently used entry
+    assert cache.get("b", "missing") == "missing"
+    now = time.monotonic()
+    monkeypatch.setattr(service.time, "monotonic", lambda: now + 11)
+    assert cache.get("a") is None
+
+
+def test_anomaly_service(fake_api, data_dir, mocker):
+    anomaly_service = AnomalyService(data_dir, use_cache=False)
+    fetch = mocker.spy(service, "fetch_observations")
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda fid: anomaly_service.anomaly(fid, datetime(2021, 2, 1)), [1, 2, 3, 1]))
+    # the concurrent requests are answered with one retrieval
+    assert fetch.call_count == 1
+    assert sorted(fetch.call_args.kwargs["reservoir_ids"]) == [1, 2, 3]
+    assert [result["fid"] for result in results] == [1, 2, 3, 1]
+    assert results[0]["month"] == "2021-02"
+    assert (results[0]["lon"], results[0]["lat"]) == (5, 50)
+    assert "lon" not in results[2]
+    assert anomaly_service.anomaly(2, datetime(2021, 2, 15)) == results[1]
+    assert fetch.call_count == 1
+
+
+def test_serve(fake_api, data_dir):
+    server = serve(AnomalyService(data_dir, use_cache=False))
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(f"{url}/anomaly?fid=1&month=2021-02") as response:  # noqa: S310
+            assert json.load(response)["fid"] == 1
+        for query, status in [("fid=4&month=2021-02", 404), ("fid=1&month=02-2021", 400), ("fid=1", 400)]:
+            with pytest.raises(urllib.error.HTTPError) as err:
+                urllib.request.urlopen(f"{url}/anomaly?{query}")  # noqa: S310
+            assert err.value.code == status
+    finally:
+        server.shutdown()
@@ -0,0 +1,104 @@
+from functools import partial
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely import points
+
+from gww_anomalies import output
+from gww_anomalies.defaults import FORMATS
+from gww_anomalies.locations import LocationsIndex
+from gww_anomalies.output import write_anomalies
+from gww_anomalies.sharding import merge_shards, read_anomalies, shard_fids, shard_name, shard_of
+from gww_anomalies.utils import parse_shard
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    fids = list(range(1, 41))
+    reservoir_locations = gpd.GeoDataFrame({"feature_id": fids}, geometry=points(fids, [0] * len(fids)), crs=4326)
+    reservoir_locations.to_file(tmp_path / "reservoirs-locations-v1.0.gpkg")
+    monkeypatch.setattr(output, "LocationsIndex", partial(LocationsIndex, cache_path=tmp_path / "locations.parquet"))
+    return tmp_path
+
+
+def write_shards(anomalies_df, data_dir, n_shards, output_format):
+    for i in range(n_shards):
+        shard_df = anomalies_df[anomalies_df["fid"].isin(shard_fids(anomalies_df["fid"], i, n_shards))]
+        write_anomalies(shard_df, data_dir / shard_name("anomalies_1_2021", i, n_shards), output_format, data_dir)
+
+
+def test_shard_fids():
+    fids = np.arange(1, 10001)
+    shards = [shard_fids(fids, i, 4) for i in range(4)]
+    assert sorted(np.concatenate(shards).tolist()) == fids.tolist()
+    # the shards are balanced and do not depend on the other reservoirs
+    assert all(2300 < len(shard) < 2700 for shard in shards)
+    assert shard_fids(fids[::-1], 2, 4).tolist() == shards[2][::-1].tolist()
+    # the assignment is fixed, so that nodes running different versions or platforms agree on it
+    assert shard_of([1, 2, 3, 4, 5, 1000000], 4).tolist() == [1, 2, 0, 1, 3, 2]
+    assert shard_of([1, 2, 3], 1).tolist() == [0, 0, 0]
+
+
+def test_parse_shard():
+    assert parse_shard("1/4") == (1, 4)
+    for shard_string in ("4/4", "-1/4", "1", "a/b"):
+        with pytest.raises(ValueError, match="hard"):
+            parse_shard(shard_string)
+
+
+@pytest.mark.parametrize("output_format", list(FORMATS))
+def test_merge_shards(data_dir, output_format):
+    anomalies_df = pd.DataFrame({"fid": np.arange(1, 41), "anomaly": np.linspace(-2, 2, 40)})
+    write_shards(anomalies_df, data_dir, 3, output_format)
+    (data_dir / f"{shard_name('anomalies_1_2021', 1, 3)}_failed.txt").write_text("41,42")
+
+    merged_path = merge_shards(data_dir, "anomalies_1_2021", 3, output_format, data_dir, remove=True, fids=range(1, 43))
+    assert merged_path == data_dir / f"anomalies_1_2021{FORMATS[output_format]}"
+    # FlatGeobuf files are ordered by their spatial index
+    merged = read_anomalies(merged_path, output_format).sort_values("fid", ignore_index=True)
+    assert merged["fid"].tolist() == list(range(1, 41))
+    np.testing.assert_allclose(merged["anomaly"], anomalies_df["anomaly"], rtol=1e-6)
+    assert (data_dir / "anomalies_1_2021_failed.txt").read_text() == "41,42"
+    assert not list(data_dir.glob("*_shard_*"))
+
+
+def test_merge_shards_verifies(data_dir):
+    anomalies_df = pd.DataFrame({"fid": np.arange(1, 41), "anomaly": np.linspace(-2, 2, 40)})
+    with pytest.raises(ValueError, match="Missing the anomalies files of 2 of 2 shards"):
+        merge_shards(data_dir, "anomalies_1_2021", 2, "csv", data_dir)
+
+    write_shards(anomalies_df, data_dir, 2, "csv")
+    # a reservoir of shard 1 written to shard 0
+    shard_path = data_dir / f"{shard_name('anomalies_1_2021', 0, 2)}.csv"
+    shard_0 = pd.read_csv(shard_path, index_col=0)
+    misplaced = anomalies_df[shard_of(anomalies_df["fid"], 2) == 1].iloc[:1]
+    pd.concat([shard_0, misplaced], ignore_index=True).to_csv(shard_path)
+    with pytest.raises(ValueError, match="holds 1 reservoirs of other shards"):
+        merge_shards(data_dir, "anomalies_1_2021", 2, "csv", data_dir)
+
+    pd.concat([shard_0, shard_0.iloc[:1]], ignore_index=True).to_csv(shard_path)
+    with pytest.raises(ValueError, match="1 reservoirs occur more than once"):
+        merge_shards(data_dir, "anomalies_1_2021", 2, "csv", data_dir)
+
+
+def test_merge_shards_verifies_reservoirs(data_dir):
+    anomalies_df = pd.DataFrame({"fid": np.arange(1, 41), "anomaly": np.linspace(-2, 2, 40)})
+    pd.DataFrame({"fid": np.arange(1, 43)}).to_parquet(data_dir / "climatologies.parquet")
+    write_shards(anomalies_df, data_dir, 2, "csv")
+    (data_dir / f"{shard_name('anomalies_1_2021', 0, 2)}_failed.txt").write_text("41")
+    with pytest.raises(ValueError, match="1 reservoirs are neither in the anomalies files .* e.g. 42"):
+        merge_shards(data_dir, "anomalies_1_2021", 2, "csv", data_dir)
+    assert not (data_dir / "anomalies_1_2021.csv").exists()
+
+    (data_dir / f"{shard_name('anomalies_1_2021', 1, 2)}_no_data.txt").write_text("42")
+    merge_shards(data_dir, "anomalies_1_2021", 2, "csv", data_dir, remove=True)
+    assert (data_dir / "anomalies_1_2021_no_data.txt").read_text() == "42"
+    assert not list(data_dir.glob("*_shard_*"))
+
+    # the reservoirs of a run with a reservoir list
+    write_shards(anomalies_df.iloc[:20], data_dir, 2, "csv")
+    merge_shards(data_dir, "anomalies_1_2021", 2, "csv", data_dir, fids=range(1, 21))
+    with pytest.raises(ValueError, match="1 reservoirs are neither"):
+        merge_shards(data_dir, "anomalies_1_2021", 2, "csv", data_dir, fids=range(1, 22))
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from gww_anomalies.standard_index import DistributionIndex, climatology_dist, standard_index
+
+stats = pytest.importorskip("scipy.stats")
+
+PARAMETERS = {
+    "norm": {"mean": [1e6, 2e6], "std": [1e5, 3e5]},
+    "gamma": {"a": [5.0, 2.0], "loc": [0.0, 0.0], "scale": [2e5, 1e6]},
+    "genextreme": {"c": [0.1, -0.1], "loc": [1e6, 2e6], "scale": [1e5, 3e5]},
+}
+
+
+def climatologies(dist, p_zero=None):
+    data = {"fid": [20, 10]}
+    for m in range(1, 13):
+        data[f"mean_{m}"] = [2e6, 1e6]
+        data[f"std_{m}"] = [3e5, 1e5]
+        for name, values in PARAMETERS[dist].items():
+            # the parameters of reservoir 20 are scaled with the calendar month
+            data[f"{name}_{m}"] = [values[1] * (1 + m / 100 if name in ("scale", "std") else 1), values[0]]
+        if p_zero is not None:
+            data[f"p_zero_{m}"] = p_zero
+    return pd.DataFrame(data)
+
+
+def quantile_trans(samples, fit_params, p_zero, dist):
+    # per reservoir-month reference, after `quantile_trans` of scripts/archive/reservoir_climatology.py
+    cdf_samples = p_zero + (1 - p_zero) * getattr(stats, dist).cdf(samples, *fit_params)
+    if p_zero > 0:
+        cdf_samples[samples == 0] = p_zero
+    return stats.norm.ppf(cdf_samples)
+
+
+@pytest.mark.parametrize("dist", list(PARAMETERS))
+def test_standard_index_matches_per_group_transform(dist):
+    climatology_df = climatologies(dist, p_zero=[0.0, 0.1] if dist == "gamma" else None)
+    index = DistributionIndex.from_dataframe(climatology_df)
+    assert index.dist == dist
+    rng = np.random.default_rng(0)
+    fid = np.repeat([10, 20, 30], 24)
+    time = np.tile(np.arange(24).astype("timedelta64[M]") + np.datetime64("2020-01"), 3).astype("datetime64[s]")
+    value = np.where(fid == 10, 1e6, 2e6) * rng.normal(1, 0.1, len(fid))
+    if dist == "gamma":
+        value[0] = 0
+    value[5] = np.nan
+
+    standardized = standard_index(fid, time, value, index)
+
+    expected = np.full(len(fid), np.nan)
+    for i in range(48):
+        row = climatology_df[climatology_df["fid"] == fid[i]].iloc[0]
+        m = time[i].astype("datetime64[M]").astype(int) % 12 + 1
+        params = [row[f"{name}_{m}"] for name in PARAMETERS[dist]]
+        p_zero = row[f"p_zero_{m}"] if f"p_zero_{m}" in row else 0.0
+        expected[i] = quantile_trans(value[i : i + 1], params, p_zero, dist)[0]
+    np.testing.assert_allclose(standardized, expected, rtol=1e-9)
+    # reservoir 30 has no climatology and the missing value stays missing
+    assert np.isnan(standardized[48:]).all()
+    assert np.isnan(standardized[5])
+
+
+def test_standard_index_zero_probability():
+    index = DistributionIndex.from_dataframe(climatologies("gamma", p_zero=[0.5, 0.0]))
+    time = np.array(["2020-03-01", "2020-03-01"], dtype="datetime64[s]")
+    standardized = standard_index(np.array([20, 20]), time, np.array([0.0, 1e12]), index)
+    # a dry reservoir is at the median when half of its months are dry, and far outliers stay finite
+    np.testing.assert_allclose(standardized[0], 0.0, atol=1e-12)
+    assert np.isfinite(standardized[1])
+    assert standardized[1] > 4
+
+
+def test_distribution_index():
+    assert climatology_dist(climatologies("norm").columns) == "norm"
+    assert climatology_dist(climatologies("genextreme").columns) == "genextreme"
+    index = DistributionIndex.from_dataframe(climatologies("gamma"))
+    np.testing.assert_array_equal(index.fid, [10, 20])
+    np.testing.assert_allclose(index.parameters["a"][:, 0], [5.0, 2.0])
+    np.testing.assert_allclose(index.mean[:, 0], [1e6, 2e6])
+    np.testing.assert_array_equal(index.p_zero, 0)
+    with pytest.raises(ValueError, match="Missing the gamma parameters loc, scale"):
+        DistributionIndex([1], [[1.0]], [[1.0]], dist="gamma", parameters={"a": [[1.0]]}, months=[1])
@@ -1,6 +1,11 @@
+from datetime import datetime
 from pathlib import Path
 
-from gww_anomalies.utils import _parse_reservoir_ids_file
+import numpy as np
+import pandas as pd
+import pytest
+
+from gww_anomalies.utils import _parse_reservoir_ids_file, anomalies_all, get_calendar_months, get_month_range
 
 
 def test_parse_reservoir_ids_file(tmp_path: Path):
@@ -13,3 +18,33 @@ def test_parse_reservoir_ids_file(tmp_path: Path):
     assert fid_list[0] == "90249"
     assert fid_list[1] == "38599"
 
+
+def test_get_month_range():
+    start, stop = get_month_range(datetime(2020, 11, 15), datetime(2021, 1, 1))
+    assert start == datetime(2020, 11, 1)
+    assert stop == datetime(2021, 2, 1)
+    with pytest.raises(ValueError, match="should not be before"):
+        get_month_range(datetime(2021, 1, 1), datetime(2020, 12, 1))
+
+
+def test_get_calendar_months():
+    assert get_calendar_months(datetime(2020, 11, 1), datetime(2021, 2, 1)) == [1, 11, 12]
+    assert get_calendar_months(datetime(2019, 1, 1), datetime(2021, 2, 1)) == list(range(1, 13))
+
+
+def test_anomalies_all():
+    months = pd.date_range("2020-01-31", periods=3, freq="ME")
+    dfs = {
+        "1": pd.DataFrame({"surface_area": [1.0, 2.0, 7.0]}, index=months),
+        "2": pd.DataFrame({"surface_area": [5.0]}, index=months[:1]),
+    }
+    climatology = pd.DataFrame({"mean": np.arange(1.0, 13.0), "std": np.full(12, 2.0)}, index=range(1, 13))
+    anomalies = anomalies_all(dfs, {"1": climatology, "2": climatology})
+    assert list(anomalies) == ["1", "2"]
+    assert anomalies["1"].index.name == "time"
+    assert anomalies["1"]["month"].tolist() == [1, 2, 3]
+    np.testing.assert_allclose(anomalies["1"]["anomaly"], [0.0, 0.0, 2.0])
+    np.testing.assert_allclose(anomalies["2"]["anomaly"], [2.0])
+    # the inputs are left as they are
+    assert list(dfs["1"].columns) == ["surface_area"]
+    assert "month" not in climatology.columns